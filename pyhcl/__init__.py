@@ -1,4 +1,4 @@
 from .core import *
 from .util import *
-from .builder import elaborate, emit, dumpverilog
+from .builder import elaborate, emit, dumpverilog, elaborate_many, load_circuit
 from .simulator import *
\ No newline at end of file
@@ -6,11 +6,15 @@ Author  : SunnyChen
 from __future__ import annotations
 
 import os
-from typing import List
+import pickle
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, List, Sequence
 
 from pyhcl.core.bundle import Bundle
 from pyhcl.core.ports import Port
-from pyhcl.core.rawmodule import Module, modules_list
+from pyhcl.core.context import ElaborationContext, current_context
+from pyhcl.core.rawmodule import Module
 from pyhcl.firrtl import ir
 from pyhcl.firrtl.passes.auto_inferring import AutoInferring
 from pyhcl.firrtl.passes.check_forms import CheckForms
@@ -22,7 +26,6 @@ from pyhcl.firrtl.passes.remove_access import RemoveAccess
 from pyhcl.firrtl.passes.replace_subaccess import ReplaceSubaccess
 from pyhcl.firrtl.passes.verilog_optimize import VerilogOptimize
 
-syntax_tree = []
 # If a self-define module override a var from base class
 # Throw a warning
 # override_warning = False
@@ -104,7 +107,7 @@ def build_syntax_tree(module):
                 module._define_node.ports.append(node)
             elif not isinstance(obj, Module):
                 module._define_node.stats.append(node)
-            syntax_tree.append(node)
+            current_context().syntax_tree.append(node)
 
     # temp_output = Output(io_obj)
     # io_obj._define_node = temp_output._define_node
@@ -135,7 +138,8 @@ def build_syntax_tree(module):
 
 def elaborate(module) -> ir.Circuit:
     """Elaborate the module's definition.
-    The module must be the top level module.
+    The module must be the top level module. The current context is reset
+    afterwards, the next design is generated from a clean state.
     """
     # Timer
     # print("[%f] Start elaborate" % 0)
@@ -186,7 +190,7 @@ def elaborate(module) -> ir.Circuit:
     #     print(i, end='\n')
 
     # Attach
-    for i in modules_list:
+    for i in current_context().modules_list:
         circuit.modules.append(i)
         circuit.instanceid.add_child(i.instanceid.id)
         i.instanceid.add_parent(circuit.instanceid.id)
@@ -200,6 +204,9 @@ def elaborate(module) -> ir.Circuit:
     # elapsed = time.time() - start
     # print("[%f] Done elaboration" % elapsed)
 
+    # Submodule definitions, when statements and the module cache belong to this design only
+    current_context().reset()
+
     return circuit
 
 
@@ -218,6 +225,19 @@ def emit(circuit: ir.Circuit, filename: str):
 
 def emit_verilog(circuit: ir.Circuit, filename: str):
     """From syntax tree to emit Verilog code"""
+    s = compile_verilog(circuit)
+
+    if not os.path.exists('.v'):
+        os.mkdir('.v')
+    f = os.path.join('.v', filename)
+    with open(f, "w+") as fir_file:
+        fir_file.write(s)
+    
+    return f
+
+
+def compile_verilog(circuit: ir.Circuit) -> str:
+    """Lower the syntax tree and return the Verilog code"""
     # From circuit, if the first element is not a circuit, raise a Error
     namespace = Namespace()
     circuit = CheckForms(circuit).run(namespace)
@@ -228,15 +248,58 @@ def emit_verilog(circuit: ir.Circuit, filename: str):
     circuit = RemoveAccess(circuit).run(namespace)
     circuit = VerilogOptimize(circuit).run(namespace)
     circuit = ExpandSequential(circuit).run(namespace)
-    s = circuit.emit_verilog()
+    return circuit.emit_verilog()
+
+
+def elaborate_task(factory: Callable, output: str):
+    """Generate, elaborate and emit one design in a fresh context"""
+    with ElaborationContext():
+        circuit = elaborate(factory())
+        if output == "firrtl":
+            return circuit.emit()
+        elif output == "verilog":
+            return compile_verilog(circuit)
+        elif output == "circuit":
+            return zlib.compress(pickle.dumps(circuit, pickle.HIGHEST_PROTOCOL))
+        raise ValueError("Unknown output {}".format(output))
+
+
+def elaborate_many(factories: Sequence[Callable], workers: int = None, output: str = "firrtl",
+                   chunksize: int = 1) -> List:
+    """Elaborate independent designs in a process pool
+
+    Every factory returns a generated top level module, e.g.
+    functools.partial(make_top, width). Factories run in worker processes,
+    so they must be picklable: module level functions or partials of them.
+
+    Args:
+        factories: Callables construct the designs
+        workers: Number of worker processes, default the CPU count. With 1
+            the designs are elaborated in this process
+        output: "firrtl" or "verilog" for the emitted code, "circuit" for the
+            compressed pickle of ir.Circuit, see load_circuit
+        chunksize: Factories sent to a worker at once
+
+    Returns:
+        The results in the order of the factories, identical results are
+        one shared object
+    """
+    if output not in ("firrtl", "verilog", "circuit"):
+        raise ValueError("Unknown output {}".format(output))
 
-    if not os.path.exists('.v'):
-        os.mkdir('.v')
-    f = os.path.join('.v', filename)
-    with open(f, "w+") as fir_file:
-        fir_file.write(s)
-    
-    return f
+    if workers == 1:
+        results = [elaborate_task(factory, output) for factory in factories]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(elaborate_task, factories, [output] * len(factories), chunksize=chunksize))
+
+    unique = {}
+    return [unique.setdefault(result, result) for result in results]
+
+
+def load_circuit(data: bytes) -> ir.Circuit:
+    """Load a circuit serialized by elaborate_many"""
+    return pickle.loads(zlib.decompress(data))
 
 
 def dumpverilog(fir_file, vfile):
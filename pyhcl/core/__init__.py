@@ -3,7 +3,9 @@ from .define import U, S, stop, printf, skip, validif, Node
 from .memory import Mem
 from .ports import Input, Output
 from .rawdata import Vec, UInt, SInt, Bool, Clock
-from .rawmodule import Module
+from .rawmodule import Module, cached_module
 from .reg import Reg, RegInit
 from .wire import Wire
-from .when import *
\ No newline at end of file
+from .when import *
+from .resources import set_sourceinfo_mode
+from .context import ElaborationContext, current_context, reset_context
@@ -6,14 +6,14 @@ Author: SunnyChen
 from __future__ import annotations
 
 import copy
-import sys
 
 from pyhcl.core.define import Define
 from pyhcl.core import rawdata
+from pyhcl.core.context import current_context
 from pyhcl.core.memory import Mem
 from pyhcl.core.ports import Port, Input, Output
 from pyhcl.core.reg import Reg, RegInit
-from pyhcl.core.resources import InstanceId, HasInfo
+from pyhcl.core.resources import InstanceId, HasInfo, caller_frame
 from pyhcl.core.wire import Wire
 from pyhcl.firrtl import ir
 from pyhcl.firrtl.ir import Vector
@@ -43,7 +43,7 @@ class Bundle(Define):
         """Inits a Bundle object
         **Call at last**
         """
-        super().__init__(rawdata.Record(sys._getframe(1)))
+        super().__init__(rawdata.Record(caller_frame(1)))
 
     def update_subfield(self, refsubfield):
         for k in self.__dict__:
@@ -132,7 +132,7 @@ class Bundle(Define):
                                           self._define_node)
             pass
         else:
-            self._define_node = Output(rawdata.Record(sys._getframe(1)))._define_node
+            self._define_node = Output(rawdata.Record(caller_frame(1)))._define_node
         # Append to bundle
         # for k in self.__dict__:
         #     if not k.startswith("_") and not k.startswith("__"):
@@ -167,7 +167,7 @@ class Bundle(Define):
             self._data._ir_exp = ir.RefId(ir.Gender.bi_gender, self._data._ir_exp.type, self._data._ir_exp.passive_type,
                                           self._define_node)
         else:
-            self._define_node = Reg(rawdata.Record(sys._getframe(1)))._define_node
+            self._define_node = Reg(rawdata.Record(caller_frame(1)))._define_node
         # Append to Bundle
         self.append_bundle(Reg)
         return self
@@ -179,7 +179,7 @@ class Bundle(Define):
             self._data._ir_exp = ir.RefId(ir.Gender.bi_gender, self._data._ir_exp.type, self._data._ir_exp.passive_type,
                                           self._define_node)
         else:
-            self._define_node = Wire(rawdata.Record(sys._getframe(1)))._define_node
+            self._define_node = Wire(rawdata.Record(caller_frame(1)))._define_node
         # Append to Bundle
         self.append_bundle(Wire)
         return self
@@ -201,10 +201,10 @@ class Bundle(Define):
         """
         # Construct RefMemPort Definition
         # Push to local syntax tree
-        _sourceinfo = HasInfo(sys._getframe(1))._sourceinfo
+        _sourceinfo = HasInfo(caller_frame(1))._sourceinfo
         _id = InstanceId()
         refmemport = ir.RefMemPort(_sourceinfo, "_T_" + str(_id.id), _id, None, self._define_node, item._data._ir_exp, True, True)
-        rawdata.local_sytax_tree.append(refmemport)
+        current_context().local_syntax_tree.append(refmemport)
 
         # Temporary change all field's ref
         for k in self.__dict__:
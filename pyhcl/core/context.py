@@ -0,0 +1,85 @@
+"""Elaboration context
+
+All state of an elaboration lives in an ElaborationContext, every thread
+works in its own current context. Enter a fresh context to elaborate a
+design in isolation:
+
+    with ElaborationContext():
+        circuit = elaborate(Top().gen())
+
+Modules must be generated and elaborated in the same context.
+
+Filename: context.py
+"""
+import os
+import threading
+from typing import Dict, List
+
+# Current contexts of the threads, a stack of the entered ones
+local = threading.local()
+
+
+class ElaborationContext(object):
+    """State of an elaboration
+
+    Attributes:
+        local_syntax_tree: Statements of the module under construction
+        modules_list: Submodule definitions generated so far
+        module_defs: Submodule definitions by their structural keys
+        module_names: Number of definitions named after every module class
+        module_cache: Cached modules by class and constructor arguments
+        global_id: Next instance id
+        when_list: When statements seen so far
+        track_index: Statements between when/elsewhen and elsewhen/otherwise begin here
+        syntax_tree: Definitions collected by the builder
+        emit_level: Indent level of the code emitters
+        sourceinfo_mode: How source info is captured, see resources.sourceinfo_modes
+        sourceinfo_rate: Capture one object in rate for the "sampled" mode
+        sourceinfo_count: Objects since the last sample
+    """
+
+    def __init__(self, sourceinfo_mode: str = None, sourceinfo_rate: int = 64):
+        self.sourceinfo_mode = os.environ.get("PYHCL_SOURCEINFO", "full") if sourceinfo_mode is None \
+            else sourceinfo_mode
+        self.sourceinfo_rate = sourceinfo_rate
+        self.reset()
+
+    def reset(self):
+        """Drop all elaboration state, keep the settings"""
+        self.local_syntax_tree: List = []
+        self.modules_list: List = []
+        self.module_defs: Dict = {}
+        self.module_names: Dict[str, int] = {}
+        self.module_cache: Dict = {}
+        self.global_id = 0
+        self.when_list: List = []
+        self.track_index = 0
+        self.syntax_tree: List = []
+        self.emit_level = 0
+        self.sourceinfo_count = 0
+
+    def __enter__(self):
+        stack().append(self)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        stack().pop()
+
+
+def stack() -> List[ElaborationContext]:
+    if not hasattr(local, "stack"):
+        local.stack = [ElaborationContext()]
+    return local.stack
+
+
+def current_context() -> ElaborationContext:
+    """Context of the running thread, a default one is created on first use"""
+    try:
+        return local.stack[-1]
+    except AttributeError:
+        return stack()[-1]
+
+
+def reset_context():
+    """Reset the current context, e.g. between runs of a long-lived worker"""
+    current_context().reset()
@@ -6,10 +6,10 @@ Author: SunnyChen
 from __future__ import annotations
 
 import copy
-import sys
 from typing import Union, List
 from pyhcl.core import rawdata
-from pyhcl.core.resources import HasInfo, InstanceId
+from pyhcl.core.context import current_context
+from pyhcl.core.resources import HasInfo, InstanceId, caller_frame
 from pyhcl.firrtl import ir
 
 # TODO(SunnyChen): Use frame to track the definition's class
@@ -82,9 +82,9 @@ def stop(clk: Define, halt: Define, exit_code: int):
             raise TypeError("Stop statement's clock signal must be clock type, halt signal must be 1 bit UInt")
 
     # Construct a stop statement
-    sourceinfo = HasInfo(sys._getframe(1))._sourceinfo
+    sourceinfo = HasInfo(caller_frame(1))._sourceinfo
     stop_node = ir.Stop(sourceinfo, clk._data._ir_exp, halt._data._ir_exp, exit_code)
-    rawdata.local_sytax_tree.append(stop_node)
+    current_context().local_syntax_tree.append(stop_node)
 
 
 def printf(clk: Define, con: Define, printstr, *variables):
@@ -95,18 +95,18 @@ def printf(clk: Define, con: Define, printstr, *variables):
             raise TypeError("Stop statement's clock signal must be clock type, halt signal must be 1 bit UInt")
 
     # Construct a printf statement
-    sourceinfo = HasInfo(sys._getframe(1))._sourceinfo
+    sourceinfo = HasInfo(caller_frame(1))._sourceinfo
     exp_list = [k._data._ir_exp for k in variables]
     printf_node = ir.Printf(sourceinfo, clk._data._ir_exp, con._data._ir_exp, printstr, exp_list)
-    rawdata.local_sytax_tree.append(printf_node)
+    current_context().local_syntax_tree.append(printf_node)
 
 
 def skip():
     """Skip statement"""
     # Construct skip statement
-    sourceinfo = HasInfo(sys._getframe(1))._sourceinfo
+    sourceinfo = HasInfo(caller_frame(1))._sourceinfo
     skip_node = ir.Skip(sourceinfo)
-    rawdata.local_sytax_tree.append(skip_node)
+    current_context().local_syntax_tree.append(skip_node)
 
 
 def validif(condition: Define, input_def: Define):
@@ -119,17 +119,17 @@ def validif(condition: Define, input_def: Define):
     validif_exp = ir.ValidIf(ir.Gender.male, input_def._data._ir_exp.type, True,
                              condition._data._ir_exp, input_def._data._ir_exp)
 
-    sourceinfo = HasInfo(sys._getframe(1))._sourceinfo
+    sourceinfo = HasInfo(caller_frame(1))._sourceinfo
     _id = InstanceId()
     node = ir.DefNode(sourceinfo, "_T_" + str(_id.id), _id, validif_exp)
 
     # Create node reference
     node_ref = ir.RefId(ir.Gender.male, node.node_exp.type, True, node)
-    raw_data = rawdata.Bits(sys._getframe(1))
+    raw_data = rawdata.Bits(caller_frame(1))
     raw_data._ir_exp = node_ref
     def_node = Define(raw_data)
 
-    rawdata.local_sytax_tree.append(node)
+    current_context().local_syntax_tree.append(node)
 
     return def_node
 
@@ -213,7 +213,7 @@ class Define(object):
             return node
         else:
             # BitPat: operand == bitpat
-            sourceinfo = HasInfo(sys._getframe(1))._sourceinfo
+            sourceinfo = HasInfo(caller_frame(1))._sourceinfo
 
             # Convert bitpat.mask and bitpat.cmp to "hxx" style
             mask_str = 'h0' + str(hex(int(other.mask[1:], 2)))[2:]
@@ -231,9 +231,9 @@ class Define(object):
             eq_node = ir.DefNode(sourceinfo, "_T_" + str(_id.id), _id, eq_op)
             eq_node_ref = ir.RefId(ir.Gender.male, eq_node.node_exp.type, True, eq_node)
 
-            rawdata.local_sytax_tree.extend([and_node, eq_node])
+            current_context().local_syntax_tree.extend([and_node, eq_node])
 
-            raw_data = rawdata.Bits(sys._getframe(1))
+            raw_data = rawdata.Bits(caller_frame(1))
             raw_data._ir_exp = eq_node_ref
             def_node = Define(raw_data)
 
@@ -246,7 +246,7 @@ class Define(object):
             return node
         else:
             # BitPat: operand == bitpat
-            sourceinfo = HasInfo(sys._getframe(1))._sourceinfo
+            sourceinfo = HasInfo(caller_frame(1))._sourceinfo
 
             # Convert bitpat.mask and bitpat.cmp to "hxx" style
             mask_str = 'h0' + str(hex(int(other.mask[1:], 2)))[2:]
@@ -264,9 +264,9 @@ class Define(object):
             neq_node = ir.DefNode(sourceinfo, "_T_" + str(_id.id), _id, neq_op)
             neq_node_ref = ir.RefId(ir.Gender.male, neq_node.node_exp.type, True, neq_node)
 
-            rawdata.local_sytax_tree.extend([and_node, neq_node])
+            current_context().local_syntax_tree.extend([and_node, neq_node])
 
-            raw_data = rawdata.Bits(sys._getframe(1))
+            raw_data = rawdata.Bits(caller_frame(1))
             raw_data._ir_exp = neq_node_ref
             def_node = Define(raw_data)
 
@@ -444,9 +444,9 @@ class Define(object):
     def invalid(self):
         """Generate an invalid statement"""
         # Construct a IsInvalid
-        sourceinfo = HasInfo(sys._getframe(1))._sourceinfo
+        sourceinfo = HasInfo(caller_frame(1))._sourceinfo
         invalid_node = ir.IsInvalid(sourceinfo, self._data._ir_exp)
-        rawdata.local_sytax_tree.append(invalid_node)
+        current_context().local_syntax_tree.append(invalid_node)
 
 
 class Node(Define):
@@ -5,11 +5,11 @@ Filename: memory.py
 Author: SunnyChen
 """
 import copy
-import sys
 
 from pyhcl.core.define import Define
-from pyhcl.core.rawdata import Data, Vec, local_sytax_tree, Bits
-from pyhcl.core.resources import InstanceId, HasInfo
+from pyhcl.core.context import current_context
+from pyhcl.core.rawdata import Data, Vec, Bits
+from pyhcl.core.resources import InstanceId, HasInfo, caller_frame
 from pyhcl.firrtl.ir import DefMem, Gender, RefId, RefMemPort, RefSubaccess, Connect, UInt, SInt
 
 
@@ -63,13 +63,13 @@ class Mem(Define):
         # Construct a Memory Ref Definition
         # This definition must push to the local syntax tree
         exp = self._data._ir_exp
-        _sourceinfo = HasInfo(sys._getframe(1))._sourceinfo
+        _sourceinfo = HasInfo(caller_frame(1))._sourceinfo
         _id = InstanceId()
         refmemport = RefMemPort(_sourceinfo, "_T_" + str(_id.id), _id, None, self._define_node, addr._data._ir_exp, True)
-        local_sytax_tree.append(refmemport)
+        current_context().local_syntax_tree.append(refmemport)
 
         ref = RefId(Gender.bi_gender, exp.type.type, exp.passive_type, refmemport)
-        temp_data = Bits(sys._getframe())
+        temp_data = Bits(caller_frame(0))
 
         temp_data._ir_exp = ref
         temp_def = Define(temp_data)
@@ -88,15 +88,15 @@ class Mem(Define):
         """
         # Construct memory port reference
         exp = self._data._ir_exp
-        _sourceinfo = HasInfo(sys._getframe(1))._sourceinfo
+        _sourceinfo = HasInfo(caller_frame(1))._sourceinfo
         _id = InstanceId()
         refmemport = RefMemPort(_sourceinfo, "_T_" + str(_id.id), _id, None, self._define_node, addr._data._ir_exp, False)
-        local_sytax_tree.append(refmemport)
+        current_context().local_syntax_tree.append(refmemport)
 
         # Write the memory
         port_ref = RefId(Gender.bi_gender, exp.type.type, exp.passive_type, refmemport)
         connect = Connect(_sourceinfo, port_ref, value._data._ir_exp)
-        local_sytax_tree.append(connect)
+        current_context().local_syntax_tree.append(connect)
 
     def __setitem__(self, key, value):
         """Virtually override __setitem__ method, no use"""
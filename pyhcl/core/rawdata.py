@@ -4,15 +4,13 @@ Filename: rawdata.py
 Author  : SunnyChen
 """
 from __future__ import annotations
-import sys
 import copy
 from enum import Enum
 from typing import Union, List
-from pyhcl.core.resources import HasInfo, InstanceId
+from pyhcl.core.resources import HasInfo, InstanceId, caller_frame
+from pyhcl.core.context import current_context
 from pyhcl.firrtl import ir
 
-local_sytax_tree = []
-
 
 class Direction(Enum):
     """PyHCL frontend direction enum class"""
@@ -167,7 +165,7 @@ class Vec(Aggregate):
         [WARNING]: Temporary Vec only support ground type
         """
         raw_vtype = copy.deepcopy(vtype)
-        super().__init__(sys._getframe(1))
+        super().__init__(caller_frame(1))
         # Construct a Vector type
         self._ir_exp = ir.Ref()
         # Modify size and type in definition
@@ -246,11 +244,11 @@ class Bits(Element):
         Return the reference of the node
         """
         # Construct node
-        _sourceinfo = HasInfo(sys._getframe(3))._sourceinfo
+        _sourceinfo = HasInfo(caller_frame(3))._sourceinfo
         _id = InstanceId()
         node = ir.DefNode(_sourceinfo, "_T_" + str(_id.id), _id, op)
 
-        local_sytax_tree.append(node)
+        current_context().local_syntax_tree.append(node)
         node_ref = ir.RefId(ir.Gender.male, node.node_exp.type, True, node)
         return node_ref
 
@@ -650,7 +648,7 @@ class Bits(Element):
 
     def __imatmul__(self, other: Data):
         """Overload '@=' as connect"""
-        sourceinfo = HasInfo(sys._getframe(2))._sourceinfo
+        sourceinfo = HasInfo(caller_frame(2))._sourceinfo
         lexp = self._ir_exp
         rexp = other._ir_exp
         trace = lexp
@@ -665,7 +663,7 @@ class Bits(Element):
         #     if isinstance(trace, ir.RefMemPort):
         #         # rexp = copy.deepcopy(other._ir_exp)
         connect = ir.Connect(sourceinfo, lexp, rexp)
-        local_sytax_tree.append(connect)
+        current_context().local_syntax_tree.append(connect)
         return self
 
 
@@ -674,7 +672,7 @@ class UInt(Bits):
     def __init__(self, width=0):
         """Inits a UInt object"""
         # TODO(SunnyChen): Temporary search frame stack 1 depth
-        super().__init__(sys._getframe(1))
+        super().__init__(caller_frame(1))
         # If inits a UInt object, it must be referred to a definition object
         # Such as Input(UInt(8)), Wire(UInt(8)) or Reg(UInt(8))
         self._ir_exp = ir.Ref()
@@ -686,7 +684,7 @@ class SInt(Bits):
     def __init__(self, width=0):
         """Inits a SInt object"""
         # TODO(SunnyChen): Temporary search frame stack 1 depth
-        super().__init__(sys._getframe(1))
+        super().__init__(caller_frame(1))
         self._ir_exp = ir.Ref()
         self._ir_exp.type = ir.SInt(width)
 
@@ -710,7 +708,7 @@ class Clock(Element):
     """PyHCL Clock data class"""
     def __init__(self):
         """Inits a clock object"""
-        super().__init__(sys._getframe(1))
+        super().__init__(caller_frame(1))
         self._ir_exp = ir.Ref()
         self._ir_exp.type = ir.Clock(1)
 
@@ -718,6 +716,6 @@ class Clock(Element):
 class AsyncReset(Element):
     """PyHCL AsyncReset data class"""
     def __init__(self):
-        super().__init__(sys._getframe(1))
+        super().__init__(caller_frame(1))
         self._ir_exp = ir.Ref()
         self._ir_exp.type = ir.AsyncReset(1)
@@ -6,20 +6,21 @@ Author  : SunnyChen
 from __future__ import annotations
 
 import copy
-import sys
+import functools
+import re
 import time
 
 from pyhcl.core import ports
 from pyhcl.core import rawdata
 from pyhcl.core.bundle import Bundle
+from pyhcl.core.context import current_context
 from pyhcl.core.define import Define, Node
+from pyhcl.core.memory import Mem
 from pyhcl.core.ports import Port
-from pyhcl.core.resources import InstanceId, HasInfo
+from pyhcl.core.resources import InstanceId, HasInfo, caller_frame
 from pyhcl.firrtl import ir
 
 
-modules_list = []
-
 def inherit(*basecls):
     """Must excute when define your own module and inherit form self-define module
 
@@ -83,6 +84,138 @@ def update_submodule(submodule: Module, upper_node):
                 pass
 
 
+# Source info annotations of the emitted statements and ports
+sourceinfo_pattern = re.compile(r" ?(@\[[^\]\n]*\]|// (\S+:\d+|unknown)$)", re.M)
+
+
+def structural_key(module: Module):
+    """Key of a submodule's body, equal for structurally identical instances
+
+    Internal node names are numbered by the instance ids, they are renamed
+    in order of appearance before comparing. Source locations are left out,
+    the same body built from different call sites is still one definition.
+    """
+    body = module._define_node.emit()
+    body = body[body.index("\n") + 1:]
+    body = sourceinfo_pattern.sub("", body)
+    temps = {}
+    body = re.sub(r"\b_T_\d+\b", lambda m: temps.setdefault(m.group(0), "_T_" + str(len(temps))), body)
+    return module.__class__.__name__, body
+
+
+def module_definition(module: Module) -> ir.Module:
+    """Shared definition of a submodule instance
+
+    Structurally identical instances share one definition, a different body
+    of an already defined class gets a numbered name. Must be called before
+    the instance's references are updated, only a new definition is copied.
+    """
+    context = current_context()
+    cached = context.module_cache.get(module.__dict__.get("_cache_key"))
+    if cached is not None:
+        if cached.definition is None:
+            cached.definition = structural_definition(cached.prototype)
+        return cached.definition
+    return structural_definition(module)
+
+
+def structural_definition(module: Module) -> ir.Module:
+    context = current_context()
+    key = structural_key(module)
+    definition = context.module_defs.get(key)
+    if definition is None:
+        definition = copy.deepcopy(module._define_node)
+
+        name = module.__class__.__name__
+        count = context.module_names.get(name, 0)
+        context.module_names[name] = count + 1
+        definition.name = name if count == 0 else "{}_{}".format(name, count)
+
+        context.module_defs[key] = definition
+        context.modules_list.append(definition)
+    return definition
+
+
+class CachedModule(object):
+    """A generated module reused for equal constructor arguments
+
+    Attributes:
+        prototype: The first generated instance
+        attrs: Prototype's attributes after gen
+        ports: Pristine copies of the prototype's ports and bundles
+        definition: Shared definition, found when first instantiated
+    """
+
+    def __init__(self, prototype: Module):
+        self.prototype = prototype
+        self.attrs = dict(prototype.__dict__)
+        self.ports = copy.deepcopy({k: v for k, v in self.attrs.items()
+                                    if not k.startswith("_") and isinstance(v, (Port, Bundle))})
+        self.definition = None
+
+    def instance(self, module: Module):
+        """Turn an uninitialized module into a new instance of the prototype"""
+        module.__dict__.update(instance_attrs(self.attrs))
+        module.__dict__.update(copy.deepcopy(self.ports))
+        node = copy.copy(self.prototype._define_node)
+        node.instanceid = InstanceId()
+        module._define_node = node
+        module._cached = True
+
+
+def instance_attrs(attrs):
+    """Copy attributes of a module, memories and submodules get identities of their own"""
+    new_attrs = {}
+    for k, obj in attrs.items():
+        if isinstance(obj, Mem):
+            obj = copy.copy(obj)
+        elif isinstance(obj, Module):
+            sub = copy.copy(obj)
+            sub.__dict__ = instance_attrs(obj.__dict__)
+            obj = sub
+        new_attrs[k] = obj
+    return new_attrs
+
+
+def cached_module(cls):
+    """Class decorator, memoizes a module's definition by its constructor arguments
+
+    The first instance of every argument set is elaborated as usual. Later
+    instances skip __init__, they get fresh ports and share the definition:
+
+        @cached_module
+        class Adder(Module):
+            def __init__(self, width):
+                ...
+
+    Arguments must be hashable, otherwise the instance is not cached. The
+    cache lives in the current ElaborationContext and is dropped with the
+    rest of its state once the design is elaborated, the prototypes are not
+    shared with later designs.
+    """
+    init = cls.__init__
+
+    @functools.wraps(init)
+    def __init__(self, *args, **kwargs):
+        # Subclasses run their own bodies
+        if type(self) is not cls:
+            return init(self, *args, **kwargs)
+        try:
+            key = (cls, args, frozenset(kwargs.items()))
+            cached = current_context().module_cache.get(key)
+        except TypeError:
+            return init(self, *args, **kwargs)
+
+        if cached is None:
+            init(self, *args, **kwargs)
+            self._cache_key = key
+        else:
+            cached.instance(self)
+
+    cls.__init__ = __init__
+    return cls
+
+
 class Module(HasInfo):
     """Abstract Class for module definition
 
@@ -96,7 +229,7 @@ class Module(HasInfo):
     def __init__(self):
         """Inits a module"""
         # Construct Module node
-        super().__init__(sys._getframe(1))
+        super().__init__(caller_frame(1))
         self.clock = ports.Input(rawdata.Clock())
         self.reset = ports.Input(rawdata.UInt(1))
         _id = InstanceId()
@@ -106,18 +239,26 @@ class Module(HasInfo):
         """Construct submodule
         If init a module inside a module, must indicate the upper module's node
         """
+        # An instance of a cached module is generated already
+        if self.__dict__.get("_cached", False):
+            return self
 
         self.build_syntax_tree()
 
-        for i in list(filter(lambda x: isinstance(x, ir.RefMemPort), rawdata.local_sytax_tree)):
+        local_syntax_tree = current_context().local_syntax_tree
+        for i in list(filter(lambda x: isinstance(x, ir.RefMemPort), local_syntax_tree)):
             i.clk = self.clock._data._ir_exp
-        self._define_node.stats.extend(rawdata.local_sytax_tree)
-        rawdata.local_sytax_tree.clear()
+        self._define_node.stats.extend(local_syntax_tree)
+        local_syntax_tree.clear()
 
         # update_submodule(self, self._define_node)
 
         # modules_list.append(self._define_node)
 
+        module_cache = current_context().module_cache
+        if "_cache_key" in self.__dict__ and self._cache_key not in module_cache:
+            module_cache[self._cache_key] = CachedModule(self)
+
         return self
 
     def build_syntax_tree(self):
@@ -145,18 +286,14 @@ class Module(HasInfo):
 
                 # If it is a module
                 if isinstance(obj, Module):
-                    new_node = copy.deepcopy(node)
-                    new_node.name = obj.__class__.__name__
-                    instmodule = ir.InstModule(None, k, InstanceId(), new_node)
+                    instmodule = ir.InstModule(None, k, InstanceId(), module_definition(obj))
                     self._define_node.stats.append(instmodule)
 
-                    modules_list.append(new_node)
-
                     update_submodule(obj, obj._define_node)
 
-                    clk_connect = ir.Connect(HasInfo(sys._getframe(1))._sourceinfo, obj.clock._data._ir_exp,
+                    clk_connect = ir.Connect(HasInfo(caller_frame(1))._sourceinfo, obj.clock._data._ir_exp,
                                self.clock._data._ir_exp)
-                    rst_connect = ir.Connect(HasInfo(sys._getframe(1))._sourceinfo, obj.reset._data._ir_exp,
+                    rst_connect = ir.Connect(HasInfo(caller_frame(1))._sourceinfo, obj.reset._data._ir_exp,
                                self.reset._data._ir_exp)
                     self._define_node.stats.extend([clk_connect, rst_connect])
 
@@ -3,11 +3,76 @@
 Filename: resources.py
 Author: SunnyChen
 """
+import dis
 import inspect
+import sys
 from dataclasses import dataclass, field
+from functools import lru_cache
 from typing import List
 
-global_id: int = 0
+from pyhcl.core.context import current_context
+
+# Source info capture modes: "full" records every object, "off" none, "sampled"
+# one object in the sourceinfo_rate of the context, "lazy" keeps the code object and instruction
+# offset and finds the file and line only when they are emitted
+sourceinfo_modes = ("full", "off", "sampled", "lazy")
+
+# Entries of the file name and line caches, shared by all threads
+filename_cache_size = 1024
+line_cache_size = 1 << 16
+
+
+def set_sourceinfo_mode(mode: str, rate: int = None) -> str:
+    """Select how source info is captured in the current elaboration context
+
+    Args:
+        mode: One of sourceinfo_modes
+        rate: Capture one object in rate for the "sampled" mode
+
+    Returns:
+        The previous mode
+    """
+    if mode not in sourceinfo_modes:
+        raise ValueError("Unknown source info mode: {}".format(mode))
+    context = current_context()
+    previous = context.sourceinfo_mode
+    context.sourceinfo_mode = mode
+    if rate is not None:
+        context.sourceinfo_rate = max(1, rate)
+    context.sourceinfo_count = 0
+    return previous
+
+
+def caller_frame(depth: int = 1):
+    """Frame of a construction site, depth counts from the caller like sys._getframe
+
+    Returns:
+        The frame, None if source info is off, the stack is not inspected then
+    """
+    if current_context().sourceinfo_mode == "off":
+        return None
+    return sys._getframe(depth + 1)
+
+
+@lru_cache(maxsize=filename_cache_size)
+def short_filename(path: str) -> str:
+    return path.split('/')[-1]
+
+
+@lru_cache(maxsize=line_cache_size)
+def line_of(code, lasti: int) -> int:
+    """Source line of a byte offset in a code object"""
+    if hasattr(code, "co_lines"):
+        for start, end, line in code.co_lines():
+            if start <= lasti < end and line is not None:
+                return line
+        return code.co_firstlineno
+    line = code.co_firstlineno
+    for offset, start_line in dis.findlinestarts(code):
+        if offset > lasti:
+            break
+        line = start_line
+    return line
 
 
 @dataclass
@@ -45,6 +110,53 @@ class SourceInfo(object):
         return self.info
 
 
+class UnknownSourceInfo(SourceInfo):
+    """Source info of objects created while capture is off
+
+    It is false, so the emitters leave it out like a missing source info,
+    error messages still get a readable location
+    """
+
+    def __bool__(self):
+        return False
+
+    def emit(self) -> str:
+        return "@[unknown]"
+
+    def emit_verilog(self) -> str:
+        return "// unknown"
+
+
+no_sourceinfo = UnknownSourceInfo("unknown", 0)
+
+
+class LazySourceInfo(SourceInfo):
+    """Source info resolved from a code object and instruction offset on first use"""
+
+    def __init__(self, code, lasti: int):
+        self.code = code
+        self.lasti = lasti
+        self.info = ""
+
+    @property
+    def filename(self) -> str:
+        return short_filename(self.code.co_filename)
+
+    @property
+    def line(self) -> int:
+        return line_of(self.code, self.lasti)
+
+    def __reduce__(self):
+        # Code objects cannot be pickled, resolve to a plain source info
+        return SourceInfo, (self.filename, self.line)
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+
 class HasInfo(object):
     """A PyHCL object which has source info"""
     _sourceinfo: SourceInfo = None
@@ -54,10 +166,21 @@ class HasInfo(object):
 
         The frame information is from a factory or something else?
         """
-        split_list = frame.f_code.co_filename.split('/')
-        filename = split_list[len(split_list) - 1]
-        lineno = frame.f_lineno
-        self._sourceinfo = SourceInfo(filename, lineno)
+        context = current_context()
+        mode = context.sourceinfo_mode
+        if mode == "off" or frame is None:
+            self._sourceinfo = no_sourceinfo
+        elif mode == "full":
+            self._sourceinfo = SourceInfo(short_filename(frame.f_code.co_filename), frame.f_lineno)
+        elif mode == "lazy":
+            self._sourceinfo = LazySourceInfo(frame.f_code, frame.f_lasti)
+        elif mode == "sampled":
+            context.sourceinfo_count += 1
+            if context.sourceinfo_count >= context.sourceinfo_rate:
+                context.sourceinfo_count = 0
+                self._sourceinfo = SourceInfo(short_filename(frame.f_code.co_filename), frame.f_lineno)
+            else:
+                self._sourceinfo = no_sourceinfo
 
 
 @dataclass(init=False)
@@ -76,9 +199,9 @@ class InstanceId(object):
 
     def __init__(self):
         """Inits a InstanceId object"""
-        global global_id
-        self.id = global_id
-        global_id += 1
+        context = current_context()
+        self.id = context.global_id
+        context.global_id += 1
         self.parent_id: List[int] = []
         self.child_id: List[int] = []
 
@@ -3,20 +3,13 @@
 Filename: when.py
 Author: SunnyChen
 """
-import sys
 
 from pyhcl.core.define import Define
-from pyhcl.core import rawdata
+from pyhcl.core.context import current_context
 from pyhcl.firrtl import ir
-from pyhcl.core.resources import HasInfo
+from pyhcl.core.resources import HasInfo, caller_frame
 from pyhcl.util import utils_func
 
-# Trace when statements
-when_list = []
-
-# Track if other statements between when/elsewhen and elsewhen/otherwise statements
-track_index = 0
-
 
 class WhenMarks:
     def __init__(self, when_node, elsewhen: bool = False):
@@ -33,19 +26,21 @@ class When(object):
         self.prv_index = 0
 
     def __enter__(self):
-        self.sourceinfo = HasInfo(sys._getframe(1))._sourceinfo
+        context = current_context()
+        self.sourceinfo = HasInfo(caller_frame(1))._sourceinfo
 
         # Create a new when ir node
         self.when_node = ir.When(self.sourceinfo)
 
         # Add trace
-        when_list.append(WhenMarks(self.when_node))
+        context.when_list.append(WhenMarks(self.when_node))
         self.whenbegin_node = ir.WhenBegin(self.sourceinfo, self.con._data._ir_exp)
-        self.prv_index = len(rawdata.local_sytax_tree)
+        self.prv_index = len(context.local_syntax_tree)
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        self.when_node.stats.extend(rawdata.local_sytax_tree[self.prv_index:])
-        del rawdata.local_sytax_tree[self.prv_index:]
+        context = current_context()
+        self.when_node.stats.extend(context.local_syntax_tree[self.prv_index:])
+        del context.local_syntax_tree[self.prv_index:]
 
         whenend_node = ir.WhenEnd(self.sourceinfo)
 
@@ -54,10 +49,9 @@ class When(object):
         self.when_node.elsebegin = ir.ElseBegin(self.sourceinfo)
         self.when_node.elseend = ir.ElseEnd(self.sourceinfo)
 
-        rawdata.local_sytax_tree.append(self.when_node)
+        context.local_syntax_tree.append(self.when_node)
 
-        global track_index
-        track_index = len(rawdata.local_sytax_tree)
+        context.track_index = len(context.local_syntax_tree)
 
 
 # def when(con):
@@ -107,9 +101,9 @@ class Elsewhen(object):
         self.prv_index = 0
 
     def __enter__(self):
-        global track_index
+        context = current_context()
         condition_stack = []
-        self.sourceinfo = HasInfo(sys._getframe(1))._sourceinfo
+        self.sourceinfo = HasInfo(caller_frame(1))._sourceinfo
 
         # Construct outer else statement
         else_node = ir.ElseBegin(self.sourceinfo)
@@ -118,33 +112,33 @@ class Elsewhen(object):
         utils_func.search_def(self.con._data._ir_exp, condition_stack)
         else_node.stats.extend(condition_stack)
         condition_stack.clear()
-        else_node.stats.extend(rawdata.local_sytax_tree[track_index:])
-        del rawdata.local_sytax_tree[track_index:]
+        else_node.stats.extend(context.local_syntax_tree[context.track_index:])
+        del context.local_syntax_tree[context.track_index:]
 
         elseend_node = ir.ElseEnd(self.sourceinfo)
 
         # Search when list from the tail to the beginning
-        for i in range(len(when_list) - 1, -1, -1):
-            if not when_list[i].elsewhen:
-                when_list[i].elsewhen = True
-                when_list[i].when_node.has_else = True
-                when_list[i].when_node.elsebegin = else_node
-                when_list[i].when_node.elseend = elseend_node
+        for i in range(len(context.when_list) - 1, -1, -1):
+            if not context.when_list[i].elsewhen:
+                context.when_list[i].elsewhen = True
+                context.when_list[i].when_node.has_else = True
+                context.when_list[i].when_node.elsebegin = else_node
+                context.when_list[i].when_node.elseend = elseend_node
                 break
 
         # Construct a new when statement
         self.when_node = ir.When(self.sourceinfo)
-        when_list.append(WhenMarks(self.when_node))
+        context.when_list.append(WhenMarks(self.when_node))
         self.whenbegin_node = ir.WhenBegin(self.sourceinfo, self.con._data._ir_exp)
 
         else_node.stats.append(self.when_node)
 
-        self.prv_index = len(rawdata.local_sytax_tree)
+        self.prv_index = len(context.local_syntax_tree)
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        global track_index
-        self.when_node.stats.extend(rawdata.local_sytax_tree[self.prv_index:])
-        del rawdata.local_sytax_tree[self.prv_index:]
+        context = current_context()
+        self.when_node.stats.extend(context.local_syntax_tree[self.prv_index:])
+        del context.local_syntax_tree[self.prv_index:]
 
         whenend_node = ir.WhenEnd(self.sourceinfo)
 
@@ -153,7 +147,7 @@ class Elsewhen(object):
         self.when_node.elsebegin = ir.ElseBegin(self.sourceinfo)
         self.when_node.elseend = ir.ElseEnd(self.sourceinfo)
 
-        track_index = len(rawdata.local_sytax_tree)
+        context.track_index = len(context.local_syntax_tree)
 
 
 # def elsewhen(con):
@@ -217,35 +211,35 @@ class Otherwise(object):
         self.prv_index = 0
 
     def __enter__(self):
-        global track_index
-        self.sourceinfo = HasInfo(sys._getframe(1))._sourceinfo
+        context = current_context()
+        self.sourceinfo = HasInfo(caller_frame(1))._sourceinfo
 
         # Construct outer else statement
         self.else_node = ir.ElseBegin(self.sourceinfo)
 
         # Condition statements must append to the else node
-        self.else_node.stats.extend(rawdata.local_sytax_tree[track_index:])
-        del rawdata.local_sytax_tree[track_index:]
+        self.else_node.stats.extend(context.local_syntax_tree[context.track_index:])
+        del context.local_syntax_tree[context.track_index:]
 
         elseend_node = ir.ElseEnd(self.sourceinfo)
 
         # Search when list from the tail to the beginning
-        for i in range(len(when_list) - 1, -1, -1):
-            if not when_list[i].elsewhen:
-                when_list[i].elsewhen = True
-                when_list[i].when_node.has_else = True
-                when_list[i].when_node.elsebegin = self.else_node
-                when_list[i].when_node.elseend = elseend_node
+        for i in range(len(context.when_list) - 1, -1, -1):
+            if not context.when_list[i].elsewhen:
+                context.when_list[i].elsewhen = True
+                context.when_list[i].when_node.has_else = True
+                context.when_list[i].when_node.elsebegin = self.else_node
+                context.when_list[i].when_node.elseend = elseend_node
                 break
 
-        self.prv_index = len(rawdata.local_sytax_tree)
+        self.prv_index = len(context.local_syntax_tree)
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        global track_index
-        self.else_node.stats.extend(rawdata.local_sytax_tree[self.prv_index:])
-        del rawdata.local_sytax_tree[self.prv_index:]
+        context = current_context()
+        self.else_node.stats.extend(context.local_syntax_tree[self.prv_index:])
+        del context.local_syntax_tree[self.prv_index:]
 
-        track_index = len(rawdata.local_sytax_tree)
+        context.track_index = len(context.local_syntax_tree)
 
 
 # def otherwise():
@@ -7,6 +7,7 @@ from __future__ import annotations
 from dataclasses import dataclass
 from dataclasses import field
 from typing import Optional, List, Union
+from pyhcl.core.context import current_context
 from pyhcl.core.resources import InstanceId, SourceInfo
 from pyhcl.exceptions import EquivalentError
 from enum import Enum
@@ -32,9 +33,6 @@ v_PrimOp = {
     "bits": "", "head": "", "tail": ""
 }
 
-# emit level
-emit_level = 0
-
 
 # IR direction enum class
 class Dir(Enum):
@@ -291,17 +289,17 @@ class Circuit(Definition):
             The FIRRTL code string
         """
         # Using a table to record the result, do not use "+" operator to increase execution time
-        global emit_level
+        context = current_context()
         cat_table: List[str] = []
-        if not self.sourceinfo is None:
+        if self.sourceinfo:
             cat_table.append("circuit {} : {}\n".format(self.name, self.sourceinfo.emit()))
         else:
             cat_table.append("circuit {} :\n".format(self.name))
 
-        emit_level = emit_level + 1
+        context.emit_level += 1
         for m in self.modules:
-            cat_table.append("  "*emit_level + m.emit() + "\n")
-        emit_level = emit_level - 1
+            cat_table.append("  "*context.emit_level + m.emit() + "\n")
+        context.emit_level -= 1
 
         return "".join(cat_table)
     
@@ -311,7 +309,6 @@ class Circuit(Definition):
         Returns:
             The Verilog code string
         """
-        global emit_level
         cat_table: List[str] = []
         for m in self.modules:
             cat_table.append(m.emit_verilog() + '\n')
@@ -381,24 +378,24 @@ class Module(Definition):
         Returns:
             The FIRRTL code string
         """
-        global emit_level
+        context = current_context()
         cat_table: List[str] = []
-        if self.sourceinfo is None:
+        if not self.sourceinfo:
             cat_table.append("module {} : \n".format(self.name))
         else:
             cat_table.append("module {} : {}\n".format(self.name, self.sourceinfo.emit()))
 
-        emit_level = emit_level + 1
+        context.emit_level += 1
         # Generate ports define
         for p in self.ports:
-            cat_table.append("  "*emit_level + p.emit())
+            cat_table.append("  "*context.emit_level + p.emit())
         cat_table.append("\n")
 
         # Generate statements define
         for s in self.stats:
-            cat_table.append("  "*emit_level + s.emit())
+            cat_table.append("  "*context.emit_level + s.emit())
         cat_table.append("\n")
-        emit_level = emit_level - 1
+        context.emit_level -= 1
 
         return "".join(cat_table)
     
@@ -408,22 +405,22 @@ class Module(Definition):
         Returns:
             The Verilog code string
         """
-        global emit_level
+        context = current_context()
         port_declares: List[str] = []
         stat_declares: List[str] = []
         cat_table: List[str] = []
 
-        emit_level = emit_level + 1
+        context.emit_level += 1
         for p in self.ports:
-            port_declares.append("\n" + "\t"*emit_level + p.emit_verilog())
-        emit_level = emit_level - 1
+            port_declares.append("\n" + "\t"*context.emit_level + p.emit_verilog())
+        context.emit_level -= 1
 
-        emit_level = emit_level + 1
+        context.emit_level += 1
         for s in self.stats:
-            stat_declares.append("\n" + "\t"*emit_level + s.emit_verilog())
-        emit_level = emit_level - 1
+            stat_declares.append("\n" + "\t"*context.emit_level + s.emit_verilog())
+        context.emit_level -= 1
 
-        if self.sourceinfo is None:
+        if not self.sourceinfo:
             cat_table.append(f"module {self.name}({''.join(port_declares)}\n);\n{''.join(stat_declares)}\nendmodule")
         else:
             cat_table.append(f"module {self.name}(\t{self.sourceinfo.emit_verilog()}{''.join(port_declares)}\n);\n{''.join(stat_declares)}\nendmodule")
@@ -455,7 +452,7 @@ class Port(Definition):
             dir_str = "input"
         else:
             dir_str = "output"
-        if self.sourceinfo is None:
+        if not self.sourceinfo:
             return "{} {} : {}\n".format(dir_str, self.name, self.type.emit())
         else:
             return "{} {} : {} {}\n".format(dir_str, self.name, self.type.emit(), self.sourceinfo.emit_verilog())
@@ -470,7 +467,7 @@ class Port(Definition):
             dir_str = "input"
         else:
             dir_str = "output"
-        if self.sourceinfo is None:
+        if not self.sourceinfo:
             return f"{dir_str}\t{self.type.emit_verilog()}{self.name};"
         else:
             return f"{dir_str}\t{self.type.emit_verilog()}{self.name};\t{self.sourceinfo.emit_verilog()}"
@@ -543,7 +540,7 @@ class DefWire(DefStat):
         Returns:
             The FIRRTL code string
         """
-        if self.sourceinfo is None:
+        if not self.sourceinfo:
             return "wire {} : {}\n".format(self.name, self.type.emit())
         else:
             return "wire {} : {} {}\n".format(self.name, self.type.emit(), self.sourceinfo.emit())
@@ -554,7 +551,7 @@ class DefWire(DefStat):
         Returns:
             The Verilog code string
         """
-        if self.sourceinfo is None:
+        if not self.sourceinfo:
             return f"wire\t{self.type.emit_verilog()}{self.name};"
         else:
             return f"wire\t{self.type.emit_verilog()}{self.name};\t{self.sourceinfo.emit_verilog()}"
@@ -581,7 +578,7 @@ class DefReg(DefStat):
         Returns:
             The FIRRTL code string
         """
-        if self.sourceinfo is None:
+        if not self.sourceinfo:
             return "reg {} : {}, {}\n".format(self.name, self.type.emit(), self.clk.emit())
         else:
             return "reg {} : {}, {} {}\n".format(self.name, self.type.emit(), self.clk.emit(), self.sourceinfo.emit())
@@ -592,7 +589,7 @@ class DefReg(DefStat):
         Returns:
             The Verilog code string
         """
-        if self.sourceinfo is None:
+        if not self.sourceinfo:
             return f"reg\t{self.type.emit_verilog()}{self.name};"
         else:
             return f"reg\t{self.type.emit_verilog()}{self.name};\t{self.sourceinfo.emit_verilog()}"
@@ -625,7 +622,7 @@ class DefRegReset(DefStat):
         Returns:
             The FIRRTL code string
         """
-        if self.sourceinfo is None:
+        if not self.sourceinfo:
             return "reg %s : %s, %s with: (reset => (%s, %s))\n" % (self.name, self.type.emit(), self.clk.emit(),
                                                                       self.reset_signal.emit(), self.reset_value.emit())
         else:
@@ -640,7 +637,7 @@ class DefRegReset(DefStat):
         Returns:
             The Verilog code string
         """
-        if self.sourceinfo is None:
+        if not self.sourceinfo:
             return f"reg\t{self.type.emit_verilog()}{self.name};"
         else:
             return f"reg\t{self.type.emit_verilog()}{self.name};\t{self.sourceinfo.emit_verilog()}"
@@ -673,7 +670,7 @@ class DefMem(DefStat):
             cat_table.append("smem ")
         else:
             cat_table.append("cmem ")
-        if self.sourceinfo is None:
+        if not self.sourceinfo:
             cat_table.append("{} : {}\n".format(self.name, self.type.emit()))
         else:
             cat_table.append("{} : {} {}\n".format(self.name, self.type.emit(), self.sourceinfo.emit()))
@@ -686,7 +683,7 @@ class DefMem(DefStat):
         Returns:
             The Verilog code string
         """
-        if self.sourceinfo is None:
+        if not self.sourceinfo:
             return f"reg\t{self.type.emit_verilog()}{self.name}\t[0:{self.size-1}];"
         else:
             return f"reg\t{self.type.emit_verilog()}{self.name}\t[0:{self.size-1}];\t{self.sourceinfo.emit_verilog()}"
@@ -710,7 +707,7 @@ class DefNode(DefStat):
         Returns:
             The FIRRTL code string
         """
-        if self.sourceinfo is None:
+        if not self.sourceinfo:
             return "node {} = {}\n".format(self.name, self.node_exp.emit())
         else:
             return "node {} = {} {}\n".format(self.name, self.node_exp.emit(), self.sourceinfo.emit())
@@ -722,7 +719,7 @@ class DefNode(DefStat):
         Returns:
             The Verilog code string
         """
-        if self.sourceinfo is None:
+        if not self.sourceinfo:
             return f"wire\t{self.node_exp.type.emit_verilog()}{self.name} = {self.node_exp.emit_verilog()};"
         else:
             return f"wire\t{self.node_exp.type.emit_verilog()}{self.name} = {self.node_exp.emit_verilog()};\t{self.sourceinfo.emit_verilog()}"
@@ -746,7 +743,7 @@ class InstModule(DefStat):
         Returns:
             The FIRRTL code string
         """
-        if self.sourceinfo is None:
+        if not self.sourceinfo:
             return "inst {} of {}\n".format(self.name, self.module.name)
         else:
             return "inst {} of {} {}\n".format(self.name, self.module.name, self.sourceinfo.emit())
@@ -759,13 +756,13 @@ class InstModule(DefStat):
         """
         port_decs: List[str] = []
         inst_ports: List[str] = []
-        global emit_level
-        emit_level = emit_level + 1
+        context = current_context()
+        context.emit_level += 1
         for p in self.module.ports:
             port_decs.append(f"wire\t{p.type.emit_verilog()}\t{self.name}_{p.name}")
-            inst_ports.append("\n" + "\t" * emit_level + f".{p.name}({self.name}_{p.name}),")
+            inst_ports.append("\n" + "\t" * context.emit_level + f".{p.name}({self.name}_{p.name}),")
         port_dec = '\n'.join(port_decs)
-        if self.sourceinfo is None:
+        if not self.sourceinfo:
             return f"{port_dec}\n{self.module.name}\t{self.name}({''.join(inst_ports)});"
         else:
             return f"{port_dec}\n{self.module.name}\t{self.name}(\t{self.sourceinfo.emit_verilog()}{''.join(inst_ports)});"
@@ -808,7 +805,7 @@ class RefMemPort(DefStat):
                 cat_table.append("write mport ")
         cat_table.append("{} = {}[{}], {}".format(self.name, self.refmem.name, self.addr.emit(), self.clk.emit()))
 
-        if self.sourceinfo is None:
+        if not self.sourceinfo:
             cat_table.append("\n")
         else:
             cat_table.append(" %s\n" % self.sourceinfo.emit())
@@ -821,16 +818,16 @@ class RefMemPort(DefStat):
         Returns:
             The Verilog code string
         """
-        global emit_level
+        context = current_context()
         cat_table: List[str] = []
         cat_table.append(f"wire {self.refmem.type.emit_verilog()}{self.refmem.name}_{self.name}_data;")
-        cat_table.append("\t" * emit_level + f"wire [{get_width(self.refmem.size)-1}:0] {self.refmem.name}_{self.name}_addr;")
-        cat_table.append("\t" * emit_level + f"wire {self.refmem.name}_{self.name}_en;")
-        cat_table.append("\t" * emit_level + f"assign {self.refmem.name}_{self.name}_addr = {self.addr.emit_verilog()};")
-        cat_table.append("\t" * emit_level + f"assign {self.refmem.name}_{self.name}_en = 1\'h1;")
+        cat_table.append("\t" * context.emit_level + f"wire [{get_width(self.refmem.size)-1}:0] {self.refmem.name}_{self.name}_addr;")
+        cat_table.append("\t" * context.emit_level + f"wire {self.refmem.name}_{self.name}_en;")
+        cat_table.append("\t" * context.emit_level + f"assign {self.refmem.name}_{self.name}_addr = {self.addr.emit_verilog()};")
+        cat_table.append("\t" * context.emit_level + f"assign {self.refmem.name}_{self.name}_en = 1\'h1;")
         if self.read_or_write is False:
-            cat_table.append("\t" * emit_level + f'wire {self.refmem.name}_{self.name}_mask;')
-            cat_table.append("\t" * emit_level + f"assign {self.refmem.name}_{self.name}_mask = 1\'h1;")
+            cat_table.append("\t" * context.emit_level + f'wire {self.refmem.name}_{self.name}_mask;')
+            cat_table.append("\t" * context.emit_level + f"assign {self.refmem.name}_{self.name}_mask = 1\'h1;")
         return "\n".join(cat_table)
 
 
@@ -899,7 +896,7 @@ class Connect(CmdStat):
         Returns:
             The FIRRTL code string
         """
-        if self.sourceinfo is None:
+        if not self.sourceinfo:
             return "{} <= {}\n".format(self.lexp.emit(), self.rexp.emit())
         else:
             return "{} <= {} {}\n".format(self.lexp.emit(), self.rexp.emit(), self.sourceinfo.emit())
@@ -911,12 +908,12 @@ class Connect(CmdStat):
             The Verilog code string
         """
         if self.is_block:
-            if self.sourceinfo is None:
+            if not self.sourceinfo:
                 return f"assign\t{self.lexp.emit_verilog()} = {self.rexp.emit_verilog()};"
             else:
                 return f"assign\t{self.lexp.emit_verilog()} = {self.rexp.emit_verilog()};\t{self.sourceinfo.emit_verilog()}"
         else:
-            if self.sourceinfo is None:
+            if not self.sourceinfo:
                 return f"{self.lexp.emit_verilog()} <= {self.rexp.emit_verilog()};"
             else:
                 return f"{self.lexp.emit_verilog()} <= {self.rexp.emit_verilog()};\t{self.sourceinfo.emit_verilog()}"
@@ -938,7 +935,7 @@ class IsInvalid(CmdStat):
         Returns:
             The FIRRTL code string
         """
-        if self.sourceinfo is None:
+        if not self.sourceinfo:
             return "%s is invalid\n" % self.invad_exp.emit()
         else:
             return "%s is invalid %s\n" % (self.invad_exp.emit(), self.sourceinfo.emit())
@@ -967,7 +964,7 @@ class Stop(CmdStat):
         Returns:
             The FIRRTL code string
         """
-        if self.sourceinfo is None:
+        if not self.sourceinfo:
             return "stop({}, {}, {})\n".format(self.clk.emit(), self.con.emit(), self.exit_code)
         else:
             return "stop({}, {}, {}) {}\n".format(self.clk.emit(), self.con.emit(), self.exit_code, self.sourceinfo.emit())
@@ -990,7 +987,7 @@ class Skip(CmdStat):
         Returns:
             The FIRRTL code string
         """
-        if self.sourceinfo is None:
+        if not self.sourceinfo:
             return "skip\n"
         else:
             return "skip %s\n" % self.sourceinfo.emit()
@@ -1028,7 +1025,7 @@ class Printf(CmdStat):
             cat_table.append("%s, " % self.vars[i].emit())
         cat_table.append("%s)" % self.vars[len(self.vars)-1].emit())
 
-        if self.sourceinfo is None:
+        if not self.sourceinfo:
             cat_table.append("\n")
         else:
             cat_table.append(" %s\n" % self.sourceinfo.emit())
@@ -1055,7 +1052,7 @@ class WhenBegin(CmdStat):
         Return:
             The FIRRTL code string
         """
-        if self.sourceinfo is None:
+        if not self.sourceinfo:
             return "when %s :\n" % self.con.emit()
         else:
             return "when %s : %s\n" % (self.con.emit(), self.sourceinfo.emit())
@@ -1066,7 +1063,7 @@ class WhenBegin(CmdStat):
         Returns:
             The Verilog code string
         """
-        if self.sourceinfo is None:
+        if not self.sourceinfo:
             return f"if ({self.con.emit_verilog()}) begin"
         else:
             return f"if ({self.con.emit_verilog()}) begin\t{self.sourceinfo.emit_verilog()}"
@@ -1087,11 +1084,11 @@ class WhenEnd(CmdStat):
         Return:
             The FIRRTL code string
         """
-        global emit_level
-        if self.sourceinfo is None:
-            return "  "*emit_level + "skip\n"
+        context = current_context()
+        if not self.sourceinfo:
+            return "  "*context.emit_level + "skip\n"
         else:
-            return "  "*emit_level + "skip %s\n" % self.sourceinfo.emit()
+            return "  "*context.emit_level + "skip %s\n" % self.sourceinfo.emit()
     
     def emit_verilog(self) -> str:
         """Generate and return the Verilog code of current when end statement
@@ -1099,8 +1096,8 @@ class WhenEnd(CmdStat):
         Returns:
             The Verilog code string
         """
-        global emit_level
-        return "\t" * emit_level + "end"
+        context = current_context()
+        return "\t" * context.emit_level + "end"
 
 
 @dataclass
@@ -1123,16 +1120,16 @@ class ElseBegin(CmdStat):
         Return:
             The FIRRTL code string
         """
-        global emit_level
+        context = current_context()
         cat_table = []
-        if self.sourceinfo is None:
-            cat_table.append("  "*emit_level + "else : \n")
+        if not self.sourceinfo:
+            cat_table.append("  "*context.emit_level + "else : \n")
         else:
-            cat_table.append("  "*emit_level + "else : %s\n" % self.sourceinfo.emit())
+            cat_table.append("  "*context.emit_level + "else : %s\n" % self.sourceinfo.emit())
 
-        emit_level = emit_level + 1
+        context.emit_level += 1
         for s in self.stats:
-            cat_table.append("  "*emit_level + s.emit())
+            cat_table.append("  "*context.emit_level + s.emit())
 
         return "".join(cat_table)
     
@@ -1142,16 +1139,16 @@ class ElseBegin(CmdStat):
         Returns:
             The Verilog code string
         """
-        global emit_level
+        context = current_context()
         cat_table: List[str] = []
-        if self.sourceinfo is None:
-            cat_table.append("\t" * emit_level + "else begin")
+        if not self.sourceinfo:
+            cat_table.append("\t" * context.emit_level + "else begin")
         else:
-            cat_table.append("\t" * emit_level + f"else begin\t{self.sourceinfo.emit_verilog()}")
+            cat_table.append("\t" * context.emit_level + f"else begin\t{self.sourceinfo.emit_verilog()}")
         
-        emit_level = emit_level + 1
+        context.emit_level += 1
         for s in self.stats:
-            cat_table.append("\t"*emit_level + s.emit_verilog())
+            cat_table.append("\t"*context.emit_level + s.emit_verilog())
 
         return "\n".join(cat_table)
 
@@ -1169,11 +1166,11 @@ class ElseEnd(CmdStat):
         Return:
             The FIRRTL code string
         """
-        global emit_level
-        if self.sourceinfo is None:
-            return "  "*emit_level + "skip\n"
+        context = current_context()
+        if not self.sourceinfo:
+            return "  "*context.emit_level + "skip\n"
         else:
-            return "  "*emit_level + "skip %s\n" % self.sourceinfo.emit()
+            return "  "*context.emit_level + "skip %s\n" % self.sourceinfo.emit()
     
     def emit_verilog(self) -> str:
         """Generate and return the Verilog code of current else end statement
@@ -1181,8 +1178,8 @@ class ElseEnd(CmdStat):
         Returns:
             The Verilog code string
         """
-        global emit_level
-        return "\t" * emit_level + "end"
+        context = current_context()
+        return "\t" * context.emit_level + "end"
 
 
 @dataclass
@@ -1215,20 +1212,20 @@ class When(CmdStat):
         Return:
             The FIRRTL code string
         """
-        global emit_level
+        context = current_context()
         cat_table = []
         cat_table.append(self.whenbegin.emit())
 
-        emit_level = emit_level + 1
+        context.emit_level += 1
         for s in self.stats:
-            cat_table.append("  "*emit_level + s.emit())
+            cat_table.append("  "*context.emit_level + s.emit())
         cat_table.append(self.whenend.emit())
-        emit_level = emit_level - 1
+        context.emit_level -= 1
 
         if self.has_else:
             cat_table.append(self.elsebegin.emit())
             cat_table.append(self.elseend.emit())
-            emit_level = emit_level - 1
+            context.emit_level -= 1
 
         return "".join(cat_table)
     
@@ -1238,19 +1235,19 @@ class When(CmdStat):
         Returns:
             The Verilog code string
         """
-        global emit_level
+        context = current_context()
         cat_table: List[str] = []
         cat_table.append(self.whenbegin.emit_verilog())
 
-        emit_level = emit_level + 1
+        context.emit_level += 1
         for s in self.stats:
-            cat_table.append("\t"*emit_level + s.emit_verilog())
-        emit_level = emit_level - 1
+            cat_table.append("\t"*context.emit_level + s.emit_verilog())
+        context.emit_level -= 1
         cat_table.append(self.whenend.emit_verilog())
 
         if self.has_else:
             cat_table.append(self.elsebegin.emit_verilog())
-            emit_level = emit_level - 1
+            context.emit_level -= 1
             cat_table.append(self.elseend.emit_verilog())
 
         return "\n".join(cat_table)
@@ -1264,19 +1261,19 @@ class AlwaysBlock(CmdStat):
         pass
 
     def emit_verilog(self) -> str:
-        global emit_level
+        context = current_context()
         cat_table: List[str] = []
-        emit_level = emit_level + 1
+        context.emit_level += 1
         for stat in self.stats:
-            cat_table.append("\t"*emit_level + stat.emit_verilog())
-        emit_level = emit_level - 1
+            cat_table.append("\t"*context.emit_level + stat.emit_verilog())
+        context.emit_level -= 1
         
         if self.clk is None:
             declares = "\n".join(cat_table)
-            return f"always @(posedge clock) begin\n{declares}\n"+"\t"*emit_level+"end"
+            return f"always @(posedge clock) begin\n{declares}\n"+"\t"*context.emit_level+"end"
         else:
             declares = "\n".join(cat_table)
-            return f"always @(posedge {self.clk.emit_verilog()}) begin\n{declares}\n" +"\t"*emit_level+"end"
+            return f"always @(posedge {self.clk.emit_verilog()}) begin\n{declares}\n" +"\t"*context.emit_level+"end"
         
 @dataclass
 class UInt(Type):
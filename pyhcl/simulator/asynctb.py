@@ -0,0 +1,181 @@
+"""Asyncio testbench on top of a simulator
+
+Drivers and monitors are coroutines awaiting clock edges. Every edge is one
+batched cycle() transaction: all values driven since the last edge are
+poked, one cycle is stepped and every watched output is sampled. The clock
+advances once no process can run without it, processes may also wait on
+each other, e.g. through tasks, queues or events, but not on wall time.
+
+Filename: asynctb.py
+"""
+import asyncio
+from typing import Dict, List
+
+
+class TestbenchLoop(asyncio.SelectorEventLoop):
+    """Event loop keeps the callbacks which are scheduled but have not run"""
+
+    def __init__(self):
+        super().__init__()
+        self.ready = set()
+
+    def call_soon(self, callback, *args, context=None):
+        entry = []
+        handle = super().call_soon(self.run_ready, entry, callback, args, context=context)
+        entry.append(handle)
+        self.ready.add(handle)
+        return handle
+
+    def run_ready(self, entry, callback, args):
+        self.ready.discard(entry[0])
+        callback(*args)
+
+    def idle(self) -> bool:
+        """No callback is ready to run, every task waits on a pending future"""
+        self.ready = {handle for handle in self.ready if not handle.cancelled()}
+        return len(self.ready) == 0
+
+
+class AsyncTestbench(object):
+    def __init__(self, sim):
+        """Inits an AsyncTestbench
+
+        Args:
+            sim: Simulator, PySimulator or any backend with cycle() and peek()
+        """
+        self.sim = sim
+        self.pending: Dict = {}
+        self.watched: List = []
+        self.samples: Dict = {}
+        self.clock_waiters: List = []
+        self.value_waiters: List = []
+        self.processes = set()
+        self.error = None
+        self.cycles = 0
+
+    def drive(self, port, value):
+        """Drive an input, applied at the next clock edge"""
+        self.pending[port] = value
+
+    def watch(self, port):
+        """Sample an output at every clock edge"""
+        if port not in self.samples:
+            self.watched.append(port)
+            self.samples[port] = self.sim.peek(port)
+
+    def peek(self, port):
+        """Value of an output sampled at the last clock edge"""
+        self.watch(port)
+        return self.samples[port]
+
+    async def clock(self, n=1):
+        """Wait for n clock edges"""
+        if n <= 0:
+            return
+        future = asyncio.get_running_loop().create_future()
+        self.clock_waiters.append([n, future])
+        await future
+
+    async def wait_for(self, port, value, max_cycles=None):
+        """Wait until an output equals a value, checked at every clock edge
+
+        Returns:
+            The number of edges waited
+
+        Raises:
+            TimeoutError: The port did not reach the value within max_cycles
+        """
+        self.watch(port)
+        if self.samples[port] == value:
+            return 0
+        future = asyncio.get_running_loop().create_future()
+        self.value_waiters.append([port, value, max_cycles, 0, future])
+        return await future
+
+    def fork(self, coro) -> asyncio.Task:
+        """Start a concurrent testbench process"""
+        task = asyncio.get_running_loop().create_task(coro)
+        self.processes.add(task)
+        task.add_done_callback(self.finished)
+        return task
+
+    def finished(self, task):
+        self.processes.discard(task)
+        if not task.cancelled() and task.exception() is not None and self.error is None:
+            self.error = task.exception()
+
+    def run(self, main):
+        """Run a main coroutine and the processes it forks, until main returns
+
+        Returns:
+            The result of main
+
+        Raises:
+            RuntimeError: Every process waits, but none of them on the clock
+        """
+        loop = TestbenchLoop()
+        try:
+            return loop.run_until_complete(self.schedule(main))
+        finally:
+            # Tasks left over, e.g. created without fork(), are cancelled like asyncio.run() does
+            tasks = asyncio.all_tasks(loop)
+            for task in tasks:
+                task.cancel()
+            if len(tasks) > 0:
+                loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+            loop.run_until_complete(loop.shutdown_asyncgens())
+            loop.close()
+
+    async def schedule(self, main):
+        loop = asyncio.get_running_loop()
+        # Callbacks of an earlier run may still have recorded its failure
+        self.error = None
+        task = self.fork(main)
+        try:
+            while not task.done() and self.error is None:
+                # Let every process run until none of them can go on without a clock edge
+                await asyncio.sleep(0)
+                if not loop.idle() or task.done() or self.error is not None:
+                    continue
+                if len(self.clock_waiters) == 0 and len(self.value_waiters) == 0:
+                    raise RuntimeError("Testbench deadlock, no process waits on the clock")
+                self.edge()
+        finally:
+            for process in list(self.processes):
+                process.cancel()
+            self.clock_waiters, self.value_waiters = [], []
+
+        error, self.error = self.error, None
+        if error is not None:
+            raise error
+        return task.result()
+
+    def edge(self):
+        """Advance the clock in one transaction, as many edges as nobody observes"""
+        n = 1
+        if len(self.value_waiters) == 0 and len(self.pending) == 0:
+            n = min(waiter[0] for waiter in self.clock_waiters)
+        self.samples.update(self.sim.cycle(self.pending, self.watched, n=n))
+        self.pending = {}
+        self.cycles += n
+
+        clock_waiters = []
+        for waiter in self.clock_waiters:
+            waiter[0] -= n
+            if waiter[0] <= 0:
+                waiter[1].set_result(None)
+            else:
+                clock_waiters.append(waiter)
+        self.clock_waiters = clock_waiters
+
+        value_waiters = []
+        for waiter in self.value_waiters:
+            port, value, max_cycles, waited, future = waiter
+            waiter[3] = waited = waited + n
+            if self.samples[port] == value:
+                future.set_result(waited)
+            elif max_cycles is not None and waited >= max_cycles:
+                future.set_exception(TimeoutError("Port did not reach {} within {} cycles".format(value, max_cycles)))
+            else:
+                value_waiters.append(waiter)
+        self.value_waiters = value_waiters
@@ -0,0 +1,258 @@
+"""Bit-parallel NumPy simulator backend
+
+Run many independent stimulus lanes in lockstep, every signal is a NumPy
+uint64 array holding one value per lane.
+
+Filename: lanesim.py
+"""
+from typing import Dict, List
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from pyhcl.exceptions import PyHCLException
+from pyhcl.simulator.memimage import write_hex
+from pyhcl.simulator.pysim import PyDialect, PySimulator
+
+
+def shl(a, b):
+    """Dynamic left shift, shift amounts of 64 or more give zero"""
+    return np.where(b < 64, a << np.minimum(b, 63), np.uint64(0))
+
+
+def shr(a, b):
+    return np.where(b < 64, a >> np.minimum(b, 63), np.uint64(0))
+
+
+def sar(a, b):
+    """Arithmetic right shift of sign-extended 64-bit patterns"""
+    return (a.astype(np.int64) >> np.minimum(b, 63).astype(np.int64)).astype(np.uint64)
+
+
+def div(a, b, signed):
+    """FIRRTL division, truncate toward zero, zero divisor gives zero"""
+    if not signed:
+        return np.where(b == 0, np.uint64(0), a // np.where(b == 0, np.uint64(1), b))
+    a, b = a.astype(np.int64), b.astype(np.int64)
+    q = np.abs(a) // np.where(b == 0, 1, np.abs(b))
+    q = np.where((a < 0) != (b < 0), -q, q)
+    return np.where(b == 0, 0, q).astype(np.uint64)
+
+
+def rem(a, b, signed):
+    """FIRRTL remainder, takes the sign of the dividend"""
+    if not signed:
+        return np.where(b == 0, a, a % np.where(b == 0, np.uint64(1), b))
+    a, b = a.astype(np.int64), b.astype(np.int64)
+    r = np.abs(a) % np.where(b == 0, 1, np.abs(b))
+    r = np.where(a < 0, -r, r)
+    return np.where(b == 0, a, r).astype(np.uint64)
+
+
+def parity(a):
+    for n in (32, 16, 8, 4, 2, 1):
+        a = a ^ (a >> np.uint64(n))
+    return a & np.uint64(1)
+
+
+def boolean(x):
+    return np.asarray(x).astype(np.uint64)
+
+
+def signed(x):
+    return np.asarray(x).astype(np.int64)
+
+
+class NumpyDialect(PyDialect):
+    """Code generation rules for NumPy uint64 lanes
+
+    Every value is the unsigned bit pattern of its width, signed operations
+    work on the sign-extended 64-bit pattern. Constants are hoisted to
+    np.uint64 globals of the generated code.
+    """
+    max_width = 64
+
+    def __init__(self, lanes: int):
+        if np is None:
+            raise ImportError("LaneSimulator requires numpy")
+        self.lanes = lanes
+        self.consts: Dict[int, str] = {}
+        self.lane_index = np.arange(lanes)
+
+    def namespace(self) -> Dict:
+        namespace = {"np": np, "_shl": shl, "_shr": shr, "_sar": sar, "_div": div, "_rem": rem,
+                     "_parity": parity, "_b": boolean, "_s": signed,
+                     "_mread": self.mem_read_lanes, "_mwrite": self.mem_write_lanes}
+        namespace.update({name: np.uint64(value) for value, name in self.consts.items()})
+        return namespace
+
+    def new_slots(self, n: int) -> List:
+        return [np.zeros(self.lanes, dtype=np.uint64) for _ in range(n)]
+
+    def new_mem(self, size: int):
+        return np.zeros((size, self.lanes), dtype=np.uint64)
+
+    def const(self, value: int) -> str:
+        if value >= 1 << 64:
+            raise PyHCLException("Constant {} does not fit in 64 bits".format(value))
+        if value not in self.consts:
+            self.consts[value] = "_k{}".format(len(self.consts))
+        return self.consts[value]
+
+    def mask(self, code: str, width: int) -> str:
+        if width >= 64:
+            return code
+        return "({} & {})".format(code, self.const((1 << width) - 1))
+
+    def signed(self, code: str, width: int) -> str:
+        if width >= 64:
+            return code
+        sign = self.const(1 << (width - 1))
+        return "(({} ^ {}) - {})".format(code, sign, sign)
+
+    def compare(self, op: str, a: str, b: str, signed: bool) -> str:
+        if signed:
+            return "_b(_s({}) {} _s({}))".format(a, op, b)
+        return "_b({} {} {})".format(a, op, b)
+
+    def mux(self, con: str, true_code: str, false_code: str) -> str:
+        return "np.where({}, {}, {})".format(con, true_code, false_code)
+
+    def shl(self, a: str, n) -> str:
+        if n.startswith("_k"):
+            return "({} << {})".format(a, n)
+        return "_shl({}, {})".format(a, n)
+
+    def shr(self, a: str, n, signed: bool) -> str:
+        if signed:
+            return "_sar({}, {})".format(a, n)
+        if n.startswith("_k"):
+            return "({} >> {})".format(a, n)
+        return "_shr({}, {})".format(a, n)
+
+    def neg(self, a: str) -> str:
+        return "({} - {})".format(self.const(0), a)
+
+    def div(self, a: str, b: str, signed: bool) -> str:
+        return "_div({}, {}, {})".format(a, b, signed)
+
+    def rem(self, a: str, b: str, signed: bool) -> str:
+        return "_rem({}, {}, {})".format(a, b, signed)
+
+    def mem_read(self, mem: str, addr: str, size: int) -> str:
+        return "_mread({}, {})".format(mem, addr)
+
+    def mem_write(self, mem: str, en: str, addr: str, data: str, size: int) -> str:
+        return "_mwrite({}, {}, {}, {})".format(mem, en, addr, data)
+
+    def printf(self, en: str, fmt: str, values: List[str]) -> str:
+        return "_printf({!r}, ({}), {})".format(fmt, "".join(x + ", " for x in values), en)
+
+    def stop(self, en: str, exit_code: int) -> str:
+        return "if np.any({}): _stop({})".format(en, exit_code)
+
+    def mem_read_lanes(self, mem, addr):
+        """Every lane reads its own copy of the memory"""
+        size = mem.shape[0]
+        data = mem[np.minimum(addr, size - 1).astype(np.intp), self.lane_index]
+        return np.where(addr < size, data, np.uint64(0))
+
+    def mem_write_lanes(self, mem, en, addr, data):
+        size = mem.shape[0]
+        en, addr, data = np.broadcast_arrays(en, addr, data)
+        hit = (en != 0) & (addr < size)
+        if hit.ndim == 0:
+            hit = np.full(self.lanes, bool(hit))
+            addr, data = np.full(self.lanes, addr), np.full(self.lanes, data)
+        mem[addr[hit].astype(np.intp), self.lane_index[hit]] = data[hit]
+
+
+class LaneSimulator(PySimulator):
+    def __init__(self, module, lanes: int = 1024):
+        """Inits a LaneSimulator, compile the module into NumPy code
+
+        Args:
+            module: Top level module, already generated
+            lanes: Number of independent stimulus lanes simulated in lockstep
+        """
+        self.lanes = lanes
+        super().__init__(module, NumpyDialect(lanes))
+
+    def printf(self, fmt, values, en):
+        """Print once for every lane whose printf condition holds"""
+        for lane in np.nonzero(np.broadcast_to(en, (self.lanes,)))[0]:
+            print("[lane {}] ".format(lane), end="")
+            super().printf(fmt, [np.broadcast_to(x, (self.lanes,))[lane] for x in values])
+
+    def eval(self):
+        with np.errstate(over="ignore"):
+            super().eval()
+
+    def step(self, n=1):
+        with np.errstate(over="ignore"):
+            super().step(n)
+
+    def poke(self, port, value):
+        """Poke a value into every lane, a scalar is broadcast to all lanes"""
+        signal = self.signal(port)
+        if signal.kind != "input":
+            raise PyHCLException("{} is not an input port".format(signal.name))
+        value = np.asarray(value)
+        if value.dtype != np.uint64:
+            value = value.astype(np.int64).astype(np.uint64)
+        if signal.width < 64:
+            value = value & np.uint64((1 << signal.width) - 1)
+        self.values[signal.slot] = np.broadcast_to(value, (self.lanes,)).copy()
+        self.dirty = True
+
+    def peek(self, port):
+        """Returns a uint64 array holds the port value of every lane"""
+        self.eval()
+        return np.broadcast_to(self.values[self.signal(port).slot], (self.lanes,))
+
+    def write_mem(self, mem, base, values, mask):
+        """Values are (count,) for all lanes or (count, lanes) for every lane"""
+        values = np.asarray(values)
+        if values.dtype != np.uint64:
+            values = values.astype(np.int64).astype(np.uint64)
+        values = values & np.uint64(mask)
+        mem[base:base + len(values)] = values if values.ndim == 2 else values[:, None]
+
+    def read_mem(self, mem, base, count):
+        """Returns a (count, lanes) array, a hex file holds the first lane"""
+        return mem[base:base + count].copy()
+
+    def dump_mem(self, mem, filename=None, base=0, count=None):
+        values = super().dump_mem(mem, None, base, count)
+        if filename is not None:
+            write_hex(filename, values[:, 0], self.mem_info(mem)[2], base)
+        return values
+
+    def poke_all(self, ports: List) -> Dict:
+        """Poke every combination of the port values, one combination a lane
+
+        Lanes beyond the number of combinations wrap around, use at least
+        as many lanes as combinations for an exhaustive test.
+
+        Args:
+            ports: Input ports to be swept
+
+        Returns:
+            A dict maps every port to the array poked into it
+        """
+        widths = [self.signal(port).width for port in ports]
+        total = 1
+        for width in widths:
+            total <<= width
+        index = np.arange(self.lanes, dtype=np.uint64) % np.uint64(total)
+
+        poked = {}
+        shift = 0
+        for port, width in zip(ports, widths):
+            value = (index >> np.uint64(shift)) & np.uint64((1 << width) - 1)
+            self.poke(port, value)
+            poked[port] = value
+            shift += width
+        return poked
@@ -0,0 +1,57 @@
+"""Memory images for the simulators
+
+Locate the memories of a design and read or write them as hex files in the
+$readmemh format.
+
+Filename: memimage.py
+"""
+from typing import Dict, List, Tuple
+
+from pyhcl.core.memory import Mem
+from pyhcl.core.rawmodule import Module
+
+
+def find_mems(module, path: List[str] = None) -> Dict:
+    """Find every memory of a module and its submodules
+
+    Returns:
+        A dict maps every Mem object to its hierarchical path, a list of
+        instance names ends with the memory name
+    """
+    path = [] if path is None else path
+    mems = {}
+    for k, obj in module.__dict__.items():
+        if k.startswith("_"):
+            continue
+        if isinstance(obj, Mem):
+            mems[obj] = path + [k]
+        elif isinstance(obj, Module):
+            mems.update(find_mems(obj, path + [k]))
+    return mems
+
+
+def read_hex(filename: str) -> List[Tuple[int, List[int]]]:
+    """Read a $readmemh image
+
+    Returns:
+        A list of (address, values) blocks, one block for every @address
+        directive, the first block starts at address 0
+    """
+    blocks = [(0, [])]
+    with open(filename) as hex_file:
+        for line in hex_file:
+            for token in line.split("//")[0].split():
+                if token.startswith("@"):
+                    blocks.append((int(token[1:], 16), []))
+                else:
+                    blocks[-1][1].append(int(token.replace("_", ""), 16))
+    return [block for block in blocks if len(block[1]) > 0]
+
+
+def write_hex(filename: str, values, width: int, base: int = 0):
+    """Write values as a $readmemh image, one zero-padded word a line"""
+    digits = max(1, (width + 3) // 4)
+    with open(filename, "w") as hex_file:
+        if base != 0:
+            hex_file.write("@{:x}\n".format(base))
+        hex_file.write("".join("{:0{}x}\n".format(int(value), digits) for value in values))
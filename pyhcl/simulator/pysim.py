@@ -0,0 +1,776 @@
+"""Pure-Python simulator backend
+
+Compile the elaborated circuit into straight-line Python code and run it in
+the current process, no verilator or C++ toolchain is required.
+
+Filename: pysim.py
+"""
+import copy
+import re
+from typing import Dict, List
+
+from pyhcl import builder
+from pyhcl.exceptions import PyHCLException
+from pyhcl.firrtl import ir
+from pyhcl.simulator.memimage import find_mems, read_hex, write_hex
+
+# Times a circuit is recompiled while inferring unknown widths
+max_infer_rounds = 16
+
+# Slot references in the generated code
+slot_ref = re.compile(r"v\[(\d+)\]")
+
+
+def parse_literal(exp: ir.LitInt) -> int:
+    """Get the integer value of a literal, "h"/"b"/"o" style strings included"""
+    value = exp.initial
+    if isinstance(value, str):
+        negative = value.startswith("-")
+        digits = value[1:] if negative else value
+        value = int(digits[1:], {"h": 16, "b": 2, "o": 8, "d": 10}[digits[0]])
+        if negative:
+            value = -value
+    return value
+
+
+def flatten_type(name: str, t: ir.Type, flip: bool = False):
+    """Split an aggregate type into ground fields
+
+    Returns:
+        A list of (name, ground type, flip) tuples, and a dict maps every
+        aggregate name to the (suffix, flip) list of its ground fields
+    """
+    leaves = []
+    aggregates = {}
+    if isinstance(t, ir.Bundle):
+        for fx in t.fields:
+            sub_leaves, sub_aggregates = flatten_type("{}_{}".format(name, fx.name), fx.type, flip ^ fx.is_flip)
+            leaves.extend(sub_leaves)
+            aggregates.update(sub_aggregates)
+    elif isinstance(t, ir.Vector):
+        for i in range(t.size):
+            sub_leaves, sub_aggregates = flatten_type("{}_{}".format(name, i), t.type, flip)
+            leaves.extend(sub_leaves)
+            aggregates.update(sub_aggregates)
+    else:
+        return [(name, t, flip)], {}
+    aggregates[name] = [(leaf[len(name):], leaf_flip ^ flip) for leaf, _, leaf_flip in leaves]
+    return leaves, aggregates
+
+
+def ref_path(e) -> str:
+    """Flat name of a reference, bundle fields, vector indexes and
+    instance ports are joined with "_"
+    """
+    if isinstance(e, ir.Definition):
+        return e.name
+    elif isinstance(e, ir.RefSubfield):
+        base = ref_path(e.ref_arg)
+        if e.ref_field is None:
+            return base
+        elif isinstance(e.ref_field, ir.Field):
+            return "{}_{}".format(base, e.ref_field.name)
+        else:
+            return "{}_{}".format(base, ref_path(e.ref_field))
+    elif isinstance(e, ir.RefSubindex):
+        return "{}_{}".format(ref_path(e.ref_arg), e.index)
+    elif isinstance(e, ir.Ref):
+        return ref_path(e.ref_arg)
+    else:
+        raise PyHCLException("{} is not a reference".format(e))
+
+
+def div(a, b):
+    """FIRRTL division, truncate toward zero, zero divisor gives zero"""
+    if b == 0:
+        return 0
+    q = abs(a) // abs(b)
+    return q if (a < 0) == (b < 0) else -q
+
+
+def rem(a, b):
+    """FIRRTL remainder, takes the sign of the dividend"""
+    if b == 0:
+        return a
+    r = abs(a) % abs(b)
+    return -r if a < 0 else r
+
+
+def parity(a):
+    return bin(a).count("1") & 1
+
+
+def printf(fmt, values):
+    """Print like the FIRRTL printf statement, %d, %x, %b and %c supported"""
+    conv = {"d": str, "x": lambda x: "%x" % x, "b": lambda x: bin(x)[2:], "c": chr}
+    values = iter(values)
+    print(re.sub(r"%([dxbc])", lambda m: conv[m.group(1)](int(next(values))), fmt), end="")
+
+
+class PyDialect(object):
+    """Code generation rules for plain Python integers
+
+    Every value is kept as the unsigned bit pattern of its width, signed
+    operations reinterpret the pattern before computing.
+    """
+    max_width = None
+
+    def namespace(self) -> Dict:
+        """Helpers visible to the generated code"""
+        return {"_div": div, "_rem": rem, "_parity": parity}
+
+    def new_slots(self, n: int) -> List:
+        return [0] * n
+
+    def new_mem(self, size: int):
+        return [0] * size
+
+    def const(self, value: int) -> str:
+        return str(value)
+
+    def mask(self, code: str, width: int) -> str:
+        return "({} & {})".format(code, hex((1 << width) - 1))
+
+    def signed(self, code: str, width: int) -> str:
+        sign = hex(1 << (width - 1))
+        return "(({} ^ {}) - {})".format(code, sign, sign)
+
+    def binary(self, op: str, a: str, b: str) -> str:
+        return "({} {} {})".format(a, op, b)
+
+    def compare(self, op: str, a: str, b: str, signed: bool) -> str:
+        return "({} {} {})".format(a, op, b)
+
+    def mux(self, con: str, true_code: str, false_code: str) -> str:
+        return "({} if {} else {})".format(true_code, con, false_code)
+
+    def shl(self, a: str, n) -> str:
+        return "({} << {})".format(a, n)
+
+    def shr(self, a: str, n, signed: bool) -> str:
+        return "({} >> {})".format(a, n)
+
+    def invert(self, a: str) -> str:
+        return "(~{})".format(a)
+
+    def neg(self, a: str) -> str:
+        return "(-{})".format(a)
+
+    def div(self, a: str, b: str, signed: bool) -> str:
+        return "_div({}, {})".format(a, b)
+
+    def rem(self, a: str, b: str, signed: bool) -> str:
+        return "_rem({}, {})".format(a, b)
+
+    def parity(self, a: str) -> str:
+        return "_parity({})".format(a)
+
+    def mem_read(self, mem: str, addr: str, size: int) -> str:
+        return "({}[{}] if {} < {} else 0)".format(mem, addr, addr, size)
+
+    def mem_write(self, mem: str, en: str, addr: str, data: str, size: int) -> str:
+        return "if {} and {} < {}: {}[{}] = {}".format(en, addr, size, mem, addr, data)
+
+    def printf(self, en: str, fmt: str, values: List[str]) -> str:
+        return "if {}: _printf({!r}, ({}))".format(en, fmt, "".join(x + ", " for x in values))
+
+    def stop(self, en: str, exit_code: int) -> str:
+        return "if {}: _stop({})".format(en, exit_code)
+
+
+class Signal(object):
+    """A flattened ground signal of the circuit
+
+    Attributes:
+        name: Flat name, hierarchy and aggregate levels joined with "_"
+        slot: Index in the value list
+        width: Bit width
+        signed: True if it is a SInt
+        kind: "input", "wire", "reg", "node", "mport" or "temp"
+    """
+    __slots__ = ("name", "slot", "width", "signed", "kind")
+
+    def __init__(self, name: str, slot: int, width: int, signed: bool, kind: str):
+        self.name = name
+        self.slot = slot
+        self.width = width
+        self.signed = signed
+        self.kind = kind
+
+
+class Compiler(object):
+    """Compile the top module of an elaborated circuit into source code
+
+    The hierarchy and aggregates are flattened, the connections are resolved
+    with last-connect semantics, the combinational assignments are levelized
+    and registers and memories become state updated by the tick function.
+    """
+
+    def __init__(self, top: ir.Module, dialect: PyDialect):
+        self.top = top
+        self.dialect = dialect
+        self.hints: Dict[str, int] = {}
+        self.changed = False
+
+    def compile(self) -> str:
+        """Returns the generated source, defines _comb(v, m) and _tick(v, m)"""
+        for _ in range(max_infer_rounds):
+            self.init_state()
+            self.walk(self.top, "", True)
+            if not self.changed:
+                break
+        else:
+            unknown = [k for k in self.hints]
+            raise PyHCLException("Cannot infer the width of {}".format(", ".join(unknown)))
+
+        return self.generate(self.levelize())
+
+    def init_state(self):
+        self.changed = False
+        self.signals: Dict[str, Signal] = {}
+        self.aggregates: Dict[str, List] = {}
+        self.codes: Dict[str, str] = {}
+        self.drivers: Dict[str, str] = {}
+        self.regs: List = []
+        self.mems: Dict[str, tuple] = {}
+        self.mports: Dict[str, tuple] = {}
+        self.writes: List = []
+        self.prints: List = []
+        self.stops: List = []
+        self.path = None
+        self.ntemp = 0
+
+    # Declarations
+    def declare(self, name: str, t: ir.Type, kind: str, input_dir: bool = None):
+        leaves, aggregates = flatten_type(name, t)
+        self.aggregates.update(aggregates)
+        for leaf, leaf_type, flip in leaves:
+            leaf_kind = kind
+            if input_dir is not None:
+                leaf_kind = "input" if input_dir ^ flip else "wire"
+            self.add_signal(leaf, leaf_type.width, isinstance(leaf_type, ir.SInt), leaf_kind)
+
+    def add_signal(self, name: str, width: int, signed: bool, kind: str) -> Signal:
+        if width == 0:
+            width = self.hints.setdefault(name, 0) or 1
+        if self.dialect.max_width is not None and width > self.dialect.max_width:
+            raise PyHCLException("{} is {} bits wide, the backend supports up to {} bits".format(
+                name, width, self.dialect.max_width))
+        signal = Signal(name, len(self.signals), width, signed, kind)
+        self.signals[name] = signal
+        return signal
+
+    def ref(self, name: str) -> str:
+        return "v[{}]".format(self.signals[name].slot)
+
+    def temp(self, code: str, width: int, signed: bool = False) -> str:
+        """Materialize an expression in a hidden slot, returns its reference"""
+        name = "$" + str(self.ntemp)
+        self.ntemp += 1
+        self.add_signal(name, width, signed, "temp")
+        self.codes[name] = code
+        return self.ref(name)
+
+    # Statements
+    def walk(self, module: ir.Module, prefix: str, is_top: bool):
+        for p in module.ports:
+            self.declare(prefix + p.name, p.type, "wire", p.direction == ir.Dir.Input if is_top else None)
+        for s in module.stats:
+            self.stat(s, prefix)
+
+    def stat(self, s, prefix: str):
+        d = self.dialect
+        if isinstance(s, ir.DefWire):
+            self.declare(prefix + s.name, s.type, "wire")
+        elif isinstance(s, (ir.DefReg, ir.DefRegReset)):
+            leaves, _ = flatten_type(prefix + s.name, s.type)
+            self.declare(prefix + s.name, s.type, "reg")
+            reset = None
+            if isinstance(s, ir.DefRegReset) and s.reset_signal is not None:
+                reset = (self.cond(s.reset_signal, prefix), self.exp(s.reset_value, prefix))
+            for leaf, _, _ in leaves:
+                self.regs.append((leaf, reset))
+        elif isinstance(s, ir.DefMem):
+            if not isinstance(s.type.type, (ir.UInt, ir.SInt)):
+                raise PyHCLException("[{}] Memory {} must have a ground element type".format(
+                    s.sourceinfo.emit(), s.name))
+            self.mems[prefix + s.name] = ("m[{}]".format(len(self.mems)), s.size, s.type.type.width,
+                                          isinstance(s.type.type, ir.SInt))
+        elif isinstance(s, ir.DefNode):
+            code, width, signed = self.exp(s.node_exp, prefix)
+            self.add_signal(prefix + s.name, width, signed, "node")
+            self.codes[prefix + s.name] = code
+        elif isinstance(s, ir.InstModule):
+            self.walk(s.module, "{}{}_".format(prefix, s.name), False)
+        elif isinstance(s, ir.RefMemPort):
+            if s.infer:
+                raise PyHCLException("[{}] Aggregate memories are not supported".format(s.sourceinfo.emit()))
+            mem = self.mems[prefix + s.refmem.name]
+            addr, width, _ = self.exp(s.addr, prefix)
+            self.mports[prefix + s.name] = (mem, self.temp(addr, width))
+        elif isinstance(s, ir.Connect):
+            self.connect(s.lexp, s.rexp, prefix)
+        elif isinstance(s, ir.When):
+            con = self.cond(s.whenbegin.con, prefix)
+            outer = self.path
+            self.path = con if outer is None else self.temp(d.binary("&", outer, con), 1)
+            for sx in s.stats:
+                self.stat(sx, prefix)
+            if s.has_else:
+                negated = d.binary("^", con, d.const(1))
+                self.path = self.temp(negated if outer is None else d.binary("&", outer, negated), 1)
+                for sx in s.elsebegin.stats:
+                    self.stat(sx, prefix)
+            self.path = outer
+        elif isinstance(s, ir.Printf):
+            en = self.enable(self.cond(s.con, prefix))
+            values = [self.temp(*self.exp(x, prefix)) for x in s.vars]
+            self.prints.append((en, s.printstr, values))
+        elif isinstance(s, ir.Stop):
+            self.stops.append((self.enable(self.cond(s.con, prefix)), s.exit_code))
+        else:
+            # Skip, IsInvalid, WhenBegin and so on do not change the values
+            ...
+
+    def enable(self, con: str) -> str:
+        """Combine a condition with the current path condition"""
+        if self.path is None:
+            return con
+        return self.temp(self.dialect.binary("&", self.path, con), 1)
+
+    def connect(self, lexp: ir.Exp, rexp: ir.Exp, prefix: str):
+        d = self.dialect
+        if isinstance(lexp, ir.RefSubaccess):
+            base = prefix + ref_path(lexp.ref_arg)
+            index, width, _ = self.exp(lexp.index_exp, prefix)
+            index = self.temp(index, width)
+            elements = [k for k, _ in self.aggregates[base]]
+            value = self.exp(rexp, prefix)
+            for i, suffix in enumerate(elements):
+                self.drive(base + suffix, value, d.compare("==", index, d.const(i), False))
+            return
+
+        name = prefix + ref_path(lexp)
+        if name in self.mports:
+            (mem, size, width, _), addr = self.mports[name]
+            code, w, signed = self.exp(rexp, prefix)
+            data = self.temp(self.fit(code, w, signed, width), width)
+            en = self.path if self.path is not None else d.const(1)
+            self.writes.append((mem, en, addr, data, size))
+        elif name in self.aggregates:
+            other = prefix + ref_path(rexp)
+            for suffix, flip in self.aggregates[name]:
+                if flip:
+                    sink, source = other + suffix, name + suffix
+                else:
+                    sink, source = name + suffix, other + suffix
+                signal = self.signals[source]
+                self.drive(sink, (self.ref(source), signal.width, signal.signed))
+        elif name in self.signals:
+            self.drive(name, self.exp(rexp, prefix))
+        else:
+            raise PyHCLException("Unknown connect target {}".format(name))
+
+    def drive(self, name: str, value: tuple, extra: str = None):
+        """Connect a value to a ground signal under the current path condition"""
+        d = self.dialect
+        signal = self.signals[name]
+        code, width, signed = value
+        if signal.kind == "input":
+            raise PyHCLException("Cannot connect to the input port {}".format(name))
+        if name in self.hints and width > self.hints[name]:
+            self.hints[name] = width
+            self.changed = True
+
+        code = self.fit(code, width, signed, signal.width)
+        con = self.path
+        if extra is not None:
+            con = extra if con is None else d.binary("&", con, extra)
+        if con is None:
+            self.drivers[name] = code
+        else:
+            old = self.drivers.get(name, self.ref(name) if signal.kind == "reg" else d.const(0))
+            self.drivers[name] = d.mux(con, code, old)
+
+    # Expressions
+    def fit(self, code: str, width: int, signed: bool, target: int) -> str:
+        """Extend or truncate a value to the target width"""
+        d = self.dialect
+        if width == target:
+            return code
+        elif width < target:
+            return d.mask(d.signed(code, width), target) if signed else code
+        else:
+            return d.mask(code, target)
+
+    def cond(self, e: ir.Exp, prefix: str) -> str:
+        """Compile an expression used as a 1-bit condition"""
+        code, width, _ = self.exp(e, prefix)
+        if width > 1:
+            code = self.dialect.compare("!=", code, self.dialect.const(0), False)
+        return code
+
+    def exp(self, e: ir.Exp, prefix: str):
+        """Compile an expression
+
+        Returns:
+            A (code, width, signed) tuple, the code gives the unsigned bit pattern
+        """
+        d = self.dialect
+        if isinstance(e, ir.LitUInt):
+            value = parse_literal(e)
+            width = e.type.width if e.type.width > 0 else max(ir.get_width(value), 1)
+            return d.const(value & ((1 << width) - 1)), width, False
+        elif isinstance(e, ir.LitSInt):
+            value = parse_literal(e)
+            width = e.type.width if e.type.width > 0 else ir.get_width(abs(value)) + 1
+            return d.const(value & ((1 << width) - 1)), width, True
+        elif isinstance(e, ir.Mux):
+            con = self.cond(e.con, prefix)
+            t_code, t_width, signed = self.exp(e.true_exp, prefix)
+            f_code, f_width, f_signed = self.exp(e.false_exp, prefix)
+            width = max(t_width, f_width)
+            return d.mux(con, self.fit(t_code, t_width, signed, width), self.fit(f_code, f_width, f_signed, width)), \
+                width, signed
+        elif isinstance(e, ir.ValidIf):
+            return self.exp(e.vad, prefix)
+        elif isinstance(e, ir.Op):
+            return self.op(e, prefix)
+        elif isinstance(e, ir.RefSubaccess):
+            base = prefix + ref_path(e.ref_arg)
+            index, width, _ = self.exp(e.index_exp, prefix)
+            index = self.temp(index, width)
+            elements = [self.signals[base + k] for k, _ in self.aggregates[base]]
+            code = self.ref(elements[-1].name)
+            for i in range(len(elements) - 2, -1, -1):
+                code = d.mux(d.compare("==", index, d.const(i), False), self.ref(elements[i].name), code)
+            return code, elements[0].width, elements[0].signed
+        elif isinstance(e, ir.Ref):
+            if isinstance(e, ir.RefId) and not isinstance(e.ref_arg, (ir.Definition, ir.Ref)):
+                return self.exp(e.ref_arg, prefix)
+            name = prefix + ref_path(e)
+            if name in self.mports:
+                return self.mport_read(name)
+            elif name in self.signals:
+                signal = self.signals[name]
+                return self.ref(name), signal.width, signal.signed
+            elif name in self.aggregates:
+                raise PyHCLException("Aggregate {} cannot be used in an expression".format(name))
+            raise PyHCLException("Unknown reference {}".format(name))
+        raise PyHCLException("Unsupported expression {}".format(type(e).__name__))
+
+    def mport_read(self, name: str):
+        (mem, size, width, signed), addr = self.mports[name]
+        if name not in self.signals:
+            self.add_signal(name, width, signed, "mport")
+            self.codes[name] = self.dialect.mem_read(mem, addr, size)
+        return self.ref(name), width, signed
+
+    def op(self, e: ir.Op, prefix: str):
+        d = self.dialect
+        operands = [self.exp(operand, prefix) for operand in e.operands]
+        a, wa, sa = operands[0]
+        b, wb, sb = operands[1] if len(operands) > 1 else (None, 0, False)
+        sx_a = d.signed(a, wa) if sa else a
+        sx_b = d.signed(b, wb) if sb else b
+        name = e.name
+
+        if name in ("add", "sub"):
+            signed = sa or sb
+            width = max(wa + (signed and not sa), wb + (signed and not sb)) + 1
+            return d.mask(d.binary("+" if name == "add" else "-", sx_a, sx_b), width), width, signed
+        elif name == "mul":
+            signed = sa or sb
+            width = wa + wb + (sa != sb)
+            return d.mask(d.binary("*", sx_a, sx_b), width), width, signed
+        elif name == "div":
+            signed = sa or sb
+            width = wa + signed
+            if signed:
+                return d.mask(d.div(sx_a, sx_b, True), width), width, True
+            return d.div(a, b, False), width, False
+        elif name == "rem":
+            signed = sa or sb
+            width = min(wa, wb)
+            return d.mask(d.rem(sx_a, sx_b, signed), width), width, signed
+        elif name in ("lt", "leq", "gt", "geq", "eq", "neq"):
+            symbol = {"lt": "<", "leq": "<=", "gt": ">", "geq": ">=", "eq": "==", "neq": "!="}[name]
+            return d.compare(symbol, sx_a, sx_b, sa or sb), 1, False
+        elif name == "pad":
+            width = max(wa, e.parameters[0])
+            return self.fit(a, wa, sa, width), width, sa
+        elif name == "asUInt":
+            return a, wa, False
+        elif name == "asSInt":
+            return a, wa, True
+        elif name == "asClock":
+            return self.fit(a, wa, False, 1), 1, False
+        elif name == "shl":
+            width = wa + e.parameters[0]
+            return d.mask(d.shl(a, d.const(e.parameters[0])), width), width, sa
+        elif name == "shr":
+            n = e.parameters[0]
+            width = max(wa - n, 1)
+            if sa:
+                return d.mask(d.shr(sx_a, d.const(n), True), width), width, True
+            return d.shr(a, d.const(n), False), width, False
+        elif name == "dshl":
+            width = wa + (1 << wb) - 1
+            if d.max_width is not None:
+                width = min(width, d.max_width)
+            return d.mask(d.shl(a, b), width), width, sa
+        elif name == "dshr":
+            if sa:
+                return d.mask(d.shr(sx_a, b, True), wa), wa, True
+            return d.shr(a, b, False), wa, False
+        elif name == "cvt":
+            return a, wa if sa else wa + 1, True
+        elif name == "neg":
+            return d.mask(d.neg(sx_a), wa + 1), wa + 1, True
+        elif name == "not":
+            return d.mask(d.invert(a), wa), wa, False
+        elif name in ("and", "or", "xor"):
+            width = max(wa, wb)
+            symbol = {"and": "&", "or": "|", "xor": "^"}[name]
+            return d.binary(symbol, self.fit(a, wa, sa, width), self.fit(b, wb, sb, width)), width, False
+        elif name == "andr":
+            return d.compare("==", a, d.const((1 << wa) - 1), False), 1, False
+        elif name == "orr":
+            return d.compare("!=", a, d.const(0), False), 1, False
+        elif name == "xorr":
+            return d.parity(a), 1, False
+        elif name == "cat":
+            return d.binary("|", d.shl(a, d.const(wb)), b), wa + wb, False
+        elif name == "bits":
+            hi, lo = e.parameters
+            return d.mask(d.shr(a, d.const(lo), False), hi - lo + 1), hi - lo + 1, False
+        elif name == "head":
+            n = e.parameters[0]
+            return d.shr(a, d.const(wa - n), False), n, False
+        elif name == "tail":
+            n = e.parameters[0]
+            return d.mask(a, wa - n), wa - n, False
+        raise PyHCLException("Unsupported primitive operation {}".format(name))
+
+    # Code generation
+    def levelize(self) -> List[str]:
+        """Sort the combinational assignments by their dependencies
+
+        Raises:
+            PyHCLException: The circuit has a combinational loop
+        """
+        for name, reset in self.regs:
+            signal = self.signals[name]
+            code = self.drivers.pop(name, self.ref(name))
+            if reset is not None:
+                con, (value, width, signed) = reset
+                code = self.dialect.mux(con, self.fit(value, width, signed, signal.width), code)
+            self.add_signal(name + "$next", signal.width, signal.signed, "temp")
+            self.codes[name + "$next"] = code
+        self.codes.update(self.drivers)
+
+        slots = {self.signals[name].slot: name for name in self.codes}
+        deps = {name: [slots[int(x)] for x in slot_ref.findall(code) if int(x) in slots]
+                for name, code in self.codes.items()}
+
+        order: List[str] = []
+        state: Dict[str, int] = {}
+        for root in self.codes:
+            if root in state:
+                continue
+            stack = [(root, iter(deps[root]))]
+            state[root] = 1
+            while len(stack) > 0:
+                name, children = stack[-1]
+                child = next(children, None)
+                if child is None:
+                    stack.pop()
+                    state[name] = 2
+                    order.append(name)
+                elif child not in state:
+                    state[child] = 1
+                    stack.append((child, iter(deps[child])))
+                elif state[child] == 1:
+                    loop = [x for x, _ in stack]
+                    loop = loop[loop.index(child):] + [child]
+                    raise PyHCLException("Combinational loop detected: {}".format(
+                        " -> ".join(x for x in loop if not x.startswith("$"))))
+        return order
+
+    def generate(self, order: List[str]) -> str:
+        d = self.dialect
+        lines = ["def _comb(v, m):"]
+        for name in order:
+            lines.append("    v[{}] = {}".format(self.signals[name].slot, self.codes[name]))
+        lines.append("    pass")
+
+        lines.append("def _tick(v, m):")
+        for en, fmt, values in self.prints:
+            lines.append("    " + d.printf(en, fmt, values))
+        for en, exit_code in self.stops:
+            lines.append("    " + d.stop(en, exit_code))
+        for mem, en, addr, data, size in self.writes:
+            lines.append("    " + d.mem_write(mem, en, addr, data, size))
+        for name, _ in self.regs:
+            lines.append("    v[{}] = v[{}]".format(self.signals[name].slot, self.signals[name + "$next"].slot))
+        lines.append("    pass")
+        return "\n".join(lines) + "\n"
+
+
+class PySimulator(object):
+    def __init__(self, module, dialect: PyDialect = None):
+        """Inits a PySimulator, compile the module into Python code
+
+        Args:
+            module: Top level module, already generated
+            dialect: Code generation rules, plain Python integers by default
+        """
+        self.dut_name = module.__class__.__name__
+        self.dialect = PyDialect() if dialect is None else dialect
+        self.step_count = 0
+        self.exit_code = None
+
+        circuit = builder.elaborate(module)
+        self.compiler = Compiler(circuit.modules[-1], self.dialect)
+        self.source = self.compiler.compile()
+        self.signals = self.compiler.signals
+
+        namespace = {"_printf": self.printf, "_stop": self.stop}
+        namespace.update(self.dialect.namespace())
+        exec(compile(self.source, "<{}-pysim>".format(self.dut_name), "exec"), namespace)
+        self._comb = namespace["_comb"]
+        self._tick = namespace["_tick"]
+
+        self.values = self.dialect.new_slots(len(self.signals))
+        self.mems = [self.dialect.new_mem(size) for _, size, _, _ in self.compiler.mems.values()]
+        self.mem_names = {mem: "_".join(path) for mem, path in find_mems(module).items()}
+        self.dirty = True
+
+    def signal(self, port) -> Signal:
+        """Find the flattened signal of a port object or a flat name"""
+        name = port if isinstance(port, str) else "_".join(port._data._ir_exp.emit().split("."))
+        if name not in self.signals:
+            raise PyHCLException("Unknown signal {}".format(name))
+        return self.signals[name]
+
+    def eval(self):
+        if self.dirty:
+            self._comb(self.values, self.mems)
+            self.dirty = False
+
+    def printf(self, fmt, values):
+        printf(fmt, values)
+
+    def stop(self, exit_code):
+        self.exit_code = exit_code
+
+    def poke(self, port, value):
+        signal = self.signal(port)
+        if signal.kind != "input":
+            raise PyHCLException("{} is not an input port".format(signal.name))
+        self.values[signal.slot] = int(value) & ((1 << signal.width) - 1)
+        self.dirty = True
+
+    def peek(self, port):
+        """Returns the unsigned bit pattern of a port or an internal signal"""
+        self.eval()
+        return int(self.values[self.signal(port).slot])
+
+    def step(self, n=1):
+        for _ in range(n):
+            self.eval()
+            self._tick(self.values, self.mems)
+            self._comb(self.values, self.mems)
+        self.step_count += n
+
+    def cycle(self, inputs=None, sample=None, n=1):
+        """Poke inputs, step n cycles and peek the sample ports
+
+        Args:
+            inputs: Dict maps input ports to the values to be poked
+            sample: Output ports to be peeked after stepping
+            n: Number of cycles to step
+
+        Returns:
+            A dict maps every sampled port to its value
+        """
+        for port, value in (inputs or {}).items():
+            self.poke(port, value)
+        self.step(n)
+        return {port: self.peek(port) for port in (sample or [])}
+
+    def mem_info(self, mem):
+        """Index, size and width of a memory given by its Mem object or flat name"""
+        name = mem if isinstance(mem, str) else self.mem_names.get(mem)
+        if name not in self.compiler.mems:
+            raise PyHCLException("Unknown memory {}".format(name))
+        _, size, width, _ = self.compiler.mems[name]
+        return list(self.compiler.mems).index(name), size, width
+
+    def load_mem(self, mem, data, base=0):
+        """Fill a memory in bulk, without driving its write ports
+
+        Args:
+            mem: Mem object or flat name of the memory
+            data: Sequence or NumPy array of values, or a $readmemh file name
+            base: Address of the first value, @address directives of a hex file
+                  are relative to it
+        """
+        index, size, width = self.mem_info(mem)
+        blocks = read_hex(data) if isinstance(data, str) else [(0, data)]
+        for address, values in blocks:
+            start = base + address
+            if start < 0 or start + len(values) > size:
+                raise PyHCLException("Range [{}, {}) exceeds memory of size {}".format(
+                    start, start + len(values), size))
+            self.write_mem(self.mems[index], start, values, (1 << width) - 1)
+        self.dirty = True
+
+    def dump_mem(self, mem, filename=None, base=0, count=None):
+        """Read a memory in bulk
+
+        Args:
+            mem: Mem object or flat name of the memory
+            filename: Also write the values to this $readmemh file
+            base: Address of the first value
+            count: Number of values, up to the end of the memory by default
+
+        Returns:
+            A list of the values
+        """
+        index, size, width = self.mem_info(mem)
+        count = size - base if count is None else count
+        if base < 0 or base + count > size:
+            raise PyHCLException("Range [{}, {}) exceeds memory of size {}".format(base, base + count, size))
+        values = self.read_mem(self.mems[index], base, count)
+        if filename is not None:
+            write_hex(filename, values, width, base)
+        return values
+
+    def write_mem(self, mem, base, values, mask):
+        mem[base:base + len(values)] = [int(x) & mask for x in values]
+
+    def read_mem(self, mem, base, count):
+        return mem[base:base + count]
+
+    def save_state(self):
+        """Returns a handle of the current state for restore_state()"""
+        self.eval()
+        return copy.deepcopy((self.values, self.mems, self.step_count, self.exit_code))
+
+    def restore_state(self, handle):
+        """Restore a state saved by save_state(), the state stays reusable"""
+        self.values, self.mems, self.step_count, self.exit_code = copy.deepcopy(handle)
+        self.dirty = False
+
+    def reset(self):
+        self.poke("reset", 1)
+        self.step()
+
+    def start(self):
+        self.poke("reset", 0)
+        self.step()
+
+    def term(self):
+        self.values = None
+        self.mems = None
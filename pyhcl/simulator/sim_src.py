@@ -4,18 +4,25 @@ Filename: sim_src.py
 Author: SunnyChen
 """
 
-import mmap, os
+import ctypes, hashlib, json, mmap, os, platform, select, shutil, struct, subprocess, tempfile
 
 # Backend config
 import time
-from inspect import getmodule
+from dataclasses import dataclass, field
+from typing import List
 
 from pyhcl import *
+from pyhcl.simulator.memimage import find_mems, read_hex, write_hex
 
-psize = 4096
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Channel regions are aligned to the mapping granularity
+psize = mmap.ALLOCATIONGRANULARITY
+vsize = 1 << 20
 uint64_t_size = 8
-input_signum = 0
-output_signum = 0
 
 # Signals
 WAIT = 0
@@ -25,6 +32,180 @@ TERM = 3
 STEP = 4
 START = 5
 RESET = 6
+CYCLE = 7
+VECTOR = 8
+TRACE_ON = 9
+TRACE_OFF = 10
+RUN_UNTIL = 11
+SNAPSHOT = 12
+SAVE = 13
+RESTORE = 14
+LOAD_MEM = 15
+DUMP_MEM = 16
+RANDOM = 17
+
+# Random stimulus distributions
+DIST_RANGE = 0
+DIST_CHOICE = 1
+
+# Words of the signal page: signal, wait mode, trace window [start, stop) in cycles
+# and the byte offsets of the input, output and vector regions in the segment
+SIG_TRACE_START = 2
+SIG_TRACE_STOP = 3
+SIG_IN_OFFSET = 4
+SIG_OUT_OFFSET = 5
+SIG_VEC_OFFSET = 6
+trace_forever = 0xffffffffffffffff
+
+# Trace formats: trace class, header, verilator flag and file extension
+trace_formats = {
+    "vcd": ("VerilatedVcdC", "verilated_vcd_c.h", "--trace", "vcd"),
+    "fst": ("VerilatedFstC", "verilated_fst_c.h", "--trace-fst", "fst"),
+}
+
+# Wait modes, the host selects one in sig[1]
+WAIT_SPIN = 0
+WAIT_ADAPTIVE = 1
+WAIT_FUTEX = 2
+wait_modes = {"spin": WAIT_SPIN, "adaptive": WAIT_ADAPTIVE, "futex": WAIT_FUTEX}
+
+# Compiled harness binaries are cached here, keyed by the hash of the build inputs
+cache_root = os.environ.get("PYHCL_SIM_CACHE", os.path.join(os.path.expanduser("~"), ".cache", "pyhcl", "sim"))
+tool_versions = None
+
+# Spin rounds before an adaptive or futex waiter starts to block
+spin_limit = 256
+
+# Blocked wait rounds between two checks that the harness is still alive
+alive_check = 64
+
+# Seconds to wait for the harness to exit after TERM
+term_timeout = 5
+
+# Round trip latency histogram buckets, bucket i counts latencies below 2^i microseconds
+latency_buckets = 32
+
+# Transaction log records: kind, signal number, value words, cycle
+LOG_POKE = 0
+LOG_PEEK = 1
+LOG_STEP = 2
+log_kinds = ("poke", "peek", "step")
+log_magic = b"PYHCLLOG"
+log_record = struct.Struct("<BxHIQ")
+log_buffer = 1 << 16
+
+# futex(2) support
+FUTEX_WAIT = 0
+FUTEX_WAKE = 1
+futex_syscalls = {"x86_64": 202, "aarch64": 98, "riscv64": 98}
+libc = None
+
+
+class Timespec(ctypes.Structure):
+    _fields_ = [("tv_sec", ctypes.c_long), ("tv_nsec", ctypes.c_long)]
+
+
+def futex_available():
+    global libc
+    if platform.system() != "Linux" or platform.machine() not in futex_syscalls:
+        return False
+    if libc is None:
+        try:
+            libc = ctypes.CDLL(None, use_errno=True)
+        except OSError:
+            return False
+    return True
+
+
+def futex_wait(addr, value, timeout=0.01):
+    ts = Timespec(0, int(timeout * 1e9))
+    libc.syscall(futex_syscalls[platform.machine()], ctypes.c_void_p(addr), FUTEX_WAIT,
+                 ctypes.c_uint32(value), ctypes.byref(ts), None, 0)
+
+
+def futex_wake(addr):
+    libc.syscall(futex_syscalls[platform.machine()], ctypes.c_void_p(addr), FUTEX_WAKE, 1, None, None, 0)
+
+
+@dataclass
+class SimBuildConfig:
+    """Verilator and make options of a harness build
+
+    Attributes:
+        threads: Threads evaluating the model, Verilator --threads
+        optimize: Verilator -O level, also used for OPT_FAST, None keeps the defaults
+        x_assign: Verilator --x-assign and --x-initial mode, e.g. "fast"
+        output_split: Split the generated C++ into files of about this many statements, 0 disables
+        ccache: Compile through ccache, set as OBJCACHE of the generated makefile
+        jobs: Cap of make -j, None reads PYHCL_SIM_JOBS and leaves make unbounded if unset
+        savable: Verilate with --savable for save_state and restore_state
+        mem_access: Verilate with --public-flat-rw for load_mem and dump_mem, it
+                    disables some Verilator optimizations
+        extra_args: More Verilator arguments
+    """
+    threads: int = 1
+    optimize: int = None
+    x_assign: str = None
+    output_split: int = 0
+    ccache: bool = False
+    jobs: int = None
+    savable: bool = False
+    mem_access: bool = False
+    extra_args: List[str] = field(default_factory=list)
+
+    def verilator_args(self) -> List[str]:
+        args = []
+        if self.threads > 1:
+            args += ["--threads", str(self.threads)]
+        if self.optimize is not None:
+            args.append("-O{}".format(self.optimize))
+        if self.x_assign is not None:
+            args += ["--x-assign", self.x_assign, "--x-initial", self.x_assign]
+        if self.output_split > 0:
+            args += ["--output-split", str(self.output_split)]
+        if self.savable:
+            args.append("--savable")
+        if self.mem_access:
+            # Memories are reached through the flattened public names of the model
+            args.append("--public-flat-rw")
+        return args + list(self.extra_args)
+
+    def make_args(self) -> List[str]:
+        jobs = self.jobs if self.jobs is not None else os.environ.get("PYHCL_SIM_JOBS")
+        args = ["-j"] if jobs is None else ["-j{}".format(jobs)]
+        if self.optimize is not None:
+            args.append("OPT_FAST=-O{}".format(self.optimize))
+        if self.ccache:
+            args.append("OBJCACHE=ccache")
+        return args
+
+    def key(self) -> str:
+        """Options which change the binary, ccache and jobs do not"""
+        return " ".join(self.verilator_args() + ["OPT_FAST={}".format(self.optimize)])
+
+
+def get_tool_versions():
+    """Versions of the tools which affect the compiled harness"""
+    global tool_versions
+    if tool_versions is None:
+        outputs = []
+        for cmd in (["verilator", "--version"], [os.environ.get("CXX", "g++"), "--version"]):
+            try:
+                result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+                outputs.append(result.stdout.decode(errors="replace").strip())
+            except OSError:
+                outputs.append("")
+        tool_versions = "\n".join(outputs)
+    return tool_versions
+
+
+def build_key(*sources):
+    """Content hash of the harness build inputs and the tool versions"""
+    digest = hashlib.sha256()
+    for source in sources + (get_tool_versions(),):
+        digest.update(source.encode())
+        digest.update(b"\0")
+    return digest.hexdigest()
 
 
 def read_data(mm):
@@ -38,19 +219,117 @@ def write_data(mm, value):
     mm.seek(0)
 
 
+def write_frame(mm, words):
+    struct.pack_into("<%dQ" % len(words), mm, 0, *words)
+
+
+def read_frame(mm, count):
+    return struct.unpack_from("<%dQ" % count, mm, 0)
+
+
+def create_segment(name, size):
+    """Anonymous shared memory segment, memfd if supported, else an unlinked
+    file in /dev/shm. Returns the file descriptor
+    """
+    if hasattr(os, "memfd_create"):
+        fd = os.memfd_create(name)
+    else:
+        directory = "/dev/shm" if os.path.isdir("/dev/shm") else None
+        fd, path = tempfile.mkstemp(prefix=name + "-", dir=directory)
+        os.unlink(path)
+    os.ftruncate(fd, size)
+    return fd
+
+
+def to_words(value, n):
+    """Split a value into n little-endian 64-bit channel words"""
+    value = int(value)
+    return [(value >> (64 * i)) & 0xffffffffffffffff for i in range(n)]
+
+
+def from_words(words):
+    """Join little-endian 64-bit words into a Python int"""
+    return sum(int(w) << (64 * i) for i, w in enumerate(words))
+
+
+def read_value(mm, offset, n):
+    """Read a value of n channel words straight from the mapped bytes"""
+    return int.from_bytes(mm[offset:offset + n * uint64_t_size], "little")
+
+
+def port_name(port):
+    """Name of the verilated signal of a port"""
+    return "_".join(port._data._ir_exp.emit().split("."))
+
+
+class TransactionLog(object):
+    """Buffered log of the poke, peek and step transactions of a simulator
+
+    "jsonl" writes one JSON object a line. "binary" writes the magic, a
+    length-prefixed JSON header maps port names to signal numbers, then
+    fixed records of kind, signal number, value words and cycle, each
+    followed by its value words.
+    """
+
+    def __init__(self, path, log_format, input_sig_map, output_sig_map):
+        if log_format not in ("jsonl", "binary"):
+            raise ValueError("Unknown log format: {}".format(log_format))
+        self.binary = log_format == "binary"
+        self.file = open(path, "wb", buffering=log_buffer)
+        # Names are resolved once, records only carry signal numbers
+        self.names = ({signum: port_name(port) for port, signum in input_sig_map.items()},
+                      {signum: port_name(port) for port, signum in output_sig_map.items()})
+        if self.binary:
+            header = json.dumps({"inputs": {v: k for k, v in self.names[LOG_POKE].items()},
+                                 "outputs": {v: k for k, v in self.names[LOG_PEEK].items()}}).encode()
+            self.file.write(log_magic + struct.pack("<I", len(header)) + header)
+
+    def write(self, kind, signum, value, nwords, cycle):
+        if self.binary:
+            words = to_words(value, nwords)
+            self.file.write(log_record.pack(kind, signum, nwords, cycle))
+            self.file.write(struct.pack("<{}Q".format(nwords), *words))
+        else:
+            record = {"cycle": cycle, "op": log_kinds[kind]}
+            if kind == LOG_STEP:
+                record["n"] = value
+            else:
+                record["port"] = self.names[kind][signum]
+                record["value"] = value
+            self.file.write(json.dumps(record).encode() + b"\n")
+
+    def close(self):
+        self.file.close()
+
+
+def read_log(path):
+    """Iterate the records of a binary transaction log as (op, port, value, cycle)"""
+    with open(path, "rb") as log_file:
+        if log_file.read(len(log_magic)) != log_magic:
+            raise ValueError("{} is not a binary transaction log".format(path))
+        size, = struct.unpack("<I", log_file.read(4))
+        header = json.loads(log_file.read(size))
+        names = ({v: k for k, v in header["inputs"].items()}, {v: k for k, v in header["outputs"].items()})
+        while True:
+            record = log_file.read(log_record.size)
+            if len(record) < log_record.size:
+                return
+            kind, signum, nwords, cycle = log_record.unpack(record)
+            value = from_words(struct.unpack("<{}Q".format(nwords), log_file.read(nwords * uint64_t_size)))
+            port = None if kind == LOG_STEP else names[kind][signum]
+            yield log_kinds[kind], port, value, cycle
+
+
 def search_io(io, input_sig_map, output_sig_map):
-    global input_signum, output_signum
     for k in io.__dict__:
         if not k.startswith("_") and not k.startswith("__"):
             obj = io.__dict__[k]
             if isinstance(obj, Bundle):
                 search_io(obj, input_sig_map, output_sig_map)
             elif isinstance(obj, Input):
-                input_sig_map[obj] = input_signum
-                input_signum += 1
+                input_sig_map[obj] = len(input_sig_map)
             elif isinstance(obj, Output):
-                output_sig_map[obj] = output_signum
-                output_signum += 1
+                output_sig_map[obj] = len(output_sig_map)
 
 
 def select_datawrapper(width):
@@ -62,35 +341,133 @@ def select_datawrapper(width):
         return "IDataWrapper"
     elif 33 <= width <= 64:
         return "QDataWrapper"
+    elif width > 64:
+        return "WDataWrapper"
+
+
+def new_datawrapper(port):
+    """C++ expression wraps the verilated signal of a port"""
+    width = port._define_node.type.width
+    if width <= 0:
+        raise ValueError("Simulate IO ports must specified width")
+
+    datawrapper = select_datawrapper(width)
+    name = port_name(port)
+    if width > 64:
+        # Wide signals are VlWide/WData arrays of 32-bit words
+        return "new {datawrapper}(&(dut->{name}[0]), {width})".format(datawrapper=datawrapper, name=name,
+                                                                    width=width)
+    return "new {datawrapper}(&(dut->{name}))".format(datawrapper=datawrapper, name=name)
 
 
 def push_data(input_sig_map, output_sig_map):
     cat_table = []
     for k in input_sig_map.keys():
-        width = k._define_node.type.width
-        if width <= 0:
-            raise ValueError("Simulate IO ports must specified width")
-
-        datawrapper = select_datawrapper(width)
-        port_name = "_".join(k._data._ir_exp.emit().split("."))
-        cat_table.append(
-            "\t\tthis->sim_datas.inputs.push_back(new {datawrapper}(&(dut->{name})));\n".format(datawrapper=datawrapper,
-                                                                                                name=port_name))
+        cat_table.append("\t\tthis->sim_datas.inputs.push_back({});\n".format(new_datawrapper(k)))
 
     for k in output_sig_map.keys():
-        width = k._define_node.type.width
-        if width <= 0:
-            raise ValueError("Simulate IO ports must specified width")
-
-        datawrapper = select_datawrapper(width)
-        port_name = "_".join(k._data._ir_exp.emit().split("."))
-        cat_table.append(
-            "\t\tthis->sim_datas.outputs.push_back(new {datawrapper}(&(dut->{name})));\n".format(datawrapper=datawrapper,
-                                                                                                name=port_name))
+        cat_table.append("\t\tthis->sim_datas.outputs.push_back({});\n".format(new_datawrapper(k)))
     return "".join(cat_table)
 
+def encode_distribution(signum, spec, width):
+    """Channel words of a random stimulus distribution
+
+    Args:
+        signum: Signal number of the input port
+        spec: (lo, hi) draws uniformly from lo to hi inclusive, a list draws
+              one of its values, a dict maps values to integer weights
+        width: Width of the input port
+    """
+    mask = (1 << width) - 1
+    if isinstance(spec, tuple) and len(spec) == 2:
+        lo, hi = int(spec[0]), int(spec[1])
+        if not 0 <= lo <= hi <= mask:
+            raise ValueError("Range ({}, {}) does not fit in {} bits".format(lo, hi, width))
+        return [signum, DIST_RANGE, 2, lo, hi]
+
+    weights = dict(spec) if isinstance(spec, dict) else {value: 1 for value in spec}
+    if len(weights) == 0 or any(w < 0 for w in weights.values()) or sum(weights.values()) == 0:
+        raise ValueError("Random choice needs values with positive total weight")
+    cumulative, total = [], 0
+    for w in weights.values():
+        total += int(w)
+        cumulative.append(total)
+    return [signum, DIST_CHOICE, len(weights)] + [int(v) & mask for v in weights] + cumulative
+
+
+def state_access():
+    """C++ save() and restore() overrides of a harness verilated with --savable
+
+    The trace timestamp main_time is not part of the state, it keeps
+    increasing across a restore
+    """
+    return """
+    virtual bool save(const char *path, uint64_t *steps)
+    {
+        VerilatedSave os;
+        os.open(path);
+        if (!os.isOpen())
+            return false;
+        os << *steps << *this->dut;
+        os.close();
+        return true;
+    }
+
+    virtual bool restore(const char *path, uint64_t *steps)
+    {
+        VerilatedRestore os;
+        os.open(path);
+        if (!os.isOpen())
+            return false;
+        os >> *steps >> *this->dut;
+        os.close();
+        return true;
+    }
+"""
+
+
+def mem_access(dut_name, mem_map):
+    """C++ mem_access() override, one case for every memory of 64 bits or less"""
+    cases = []
+    for index, path, size, width in mem_map.values():
+        if width <= 64:
+            member = "__DOT__".join([dut_name] + path)
+            cases.append("\t\t\tcase {}: return access_mem(this->dut->rootp->{}, {}, write, base, count, data);\n".format(
+                index, member, size))
+    return """
+    virtual bool mem_access(int mem, bool write, uint64_t base, uint64_t count, uint64_t *data)
+    {{
+        switch (mem)
+        {{
+{cases}\t\t}}
+        return false;
+    }}
+""".format(cases="".join(cases))
+
+
 class Simulator(object):
-    def __init__(self, module):
+    def __init__(self, module, wait_mode="spin", cache=True, workdir=None, trace="full", trace_format="vcd",
+                 ready_timeout=60, log=None, log_format="jsonl", build=None, report_interval=None):
+        """Inits a Simulator, build and launch the verilator harness
+
+        Args:
+            module: Top level module, already generated
+            wait_mode: How both sides wait for each other, "spin", "adaptive" or
+                       "futex". "futex" falls back to "adaptive" if unsupported
+            cache: Reuse the harness binary built from the same Verilog, harness
+                   and tool versions, cached under PYHCL_SIM_CACHE or
+                   ~/.cache/pyhcl/sim
+            workdir: Directory owns the build files, channel files and traces of
+                     this simulator, a fresh directory under ./simulation by default
+            trace: "full" dumps every cycle, "off" builds the harness without
+                   tracing, a (start, stop) tuple dumps cycles in [start, stop)
+            trace_format: "vcd" or "fst"
+            ready_timeout: Seconds to wait for the harness to map its channel
+            log: Path of a transaction log of every poke, peek and step, none by default
+            log_format: "jsonl" or "binary", see TransactionLog
+            build: SimBuildConfig of the harness build, the defaults if None
+            report_interval: Print stats() every this many seconds of simulation, never if None
+        """
         # Cat table of the harness code string
         cat_table = []
 
@@ -98,18 +475,36 @@ class Simulator(object):
         self.mm_in = None
         self.mm_sig = None
         self.mm_out = None
+        self.mm_vec = None
+
+        if wait_mode not in wait_modes:
+            raise ValueError("Unknown wait mode: {}".format(wait_mode))
+        self.wait_mode = wait_modes[wait_mode]
+        if self.wait_mode == WAIT_FUTEX and not futex_available():
+            self.wait_mode = WAIT_ADAPTIVE
+        self.sig_addr = None
+
+        if trace_format not in trace_formats:
+            raise ValueError("Unknown trace format: {}".format(trace_format))
+        if trace == "full":
+            self.trace_window = (0, trace_forever)
+        elif trace == "off":
+            self.trace_window = None
+        elif isinstance(trace, tuple) and len(trace) == 2:
+            self.trace_window = (int(trace[0]), int(trace[1]))
+        else:
+            raise ValueError("Unknown trace mode: {}".format(trace))
+        trace_class, trace_header, trace_flag, trace_ext = trace_formats[trace_format]
 
         self.input_sig_map = {}
         self.output_sig_map = {}
         self.dut_name = module.__class__.__name__
         self.step_count = 0
+        self.saved_count = 0
 
-        global input_signum
-        # Push clock and reset
-        self.input_sig_map[module.clock] = input_signum
-        input_signum += 1
-        self.input_sig_map[module.reset] = input_signum
-        input_signum += 1
+        # Push clock and reset, signals are numbered per simulator
+        self.input_sig_map[module.clock] = 0
+        self.input_sig_map[module.reset] = 1
 
         # Recursively search bundle
         for k in module.__dict__:
@@ -117,68 +512,135 @@ class Simulator(object):
             if isinstance(obj, Bundle):
                 search_io(obj, self.input_sig_map, self.output_sig_map)
 
+        # Memories are numbered in the order they are found: index, path, size and width
+        self.mem_map = {}
+        for mem, path in find_mems(module).items():
+            node = mem._define_node
+            self.mem_map[mem] = (len(self.mem_map), path, node.size, node.type.type.width)
+
+        # Channel words of every port, ports wider than 64 bits take several
+        self.port_words = {}
+        for k in list(self.input_sig_map) + list(self.output_sig_map):
+            self.port_words[k] = max(1, (k._define_node.type.width + 63) // 64)
+
+        # Frame regions hold a signal number and the value words of every port
+        frame_words = 8 + 2 * (len(self.port_words) + sum(self.port_words.values()))
+        self.in_size = self.out_size = -(-frame_words * uint64_t_size // psize) * psize
+        self.vec_size = vsize
+        self.channel_fd = None
+        self.log = None if log is None else TransactionLog(log, log_format, self.input_sig_map, self.output_sig_map)
+
+        # Throughput counters, see stats(). reset() and start() run a cycle
+        # each, which step_count leaves out
+        self.reset_cycles = 0
+        self.round_trips = 0
+        self.latency_total = 0.0
+        self.latency_histogram = [0] * latency_buckets
+        self.harness_time = 0.0
+        self.sent_at = None
+        self.report_interval = report_interval
+        self.build = SimBuildConfig() if build is None else build
+
+        # Built without --trace, the trace classes must not be referenced
+        if self.trace_window is None:
+            trace_dump = trace_flush = ""
+        else:
+            trace_dump = """        if (this->tfp != NULL && this->trace_active())
+            this->tfp->dump((vluint64_t)this->main_time);
+"""
+            trace_flush = """        if (this->tfp != NULL)
+            this->tfp->flush();
+"""
+
+        # Bulk memory access dereferences the model's root, declared in its own header
+        bulk_mem = self.build.mem_access and len(self.mem_map) > 0
+        harness_includes = ""
+        if self.build.savable:
+            harness_includes += "#include <verilated_save.h>\n"
+        if bulk_mem:
+            harness_includes += "#include \"V{}___024root.h\"\n".format(self.dut_name)
 
         # Generate cpp harness code
         harness_code_A = """#include \"V{name}.h\"
 #include \"simulator.h\"
-using namespace std;
+#include <{header}>
+{includes}using namespace std;
+
+typedef {trace_class} TraceFile;
 
 class {name}_Simulator: public Simulator<DataWrapper*>
 {{
 private:
     V{name}* dut;
-    VerilatedVcdC *tfp;
-    int psize;
+    TraceFile *tfp;
 
 public:
     {name}_Simulator(V{name}* _dut): Simulator()
     {{
         this->dut = _dut;
-        this->psize = getpagesize();
     }}
 
-    ~{name}_Simulator()
+    void init_tfp(TraceFile *_tfp)
     {{
-        munmap(this->in, this->psize);
-        munmap(this->sig, this->psize);
-        munmap(this->out, this->psize);
-        close(this->in_fd);
-        close(this->out_fd);
-        close(this->sig_fd);
-        remove("./in.dat");
-        remove("./sig.dat");
-        remove("./out.dat");
+        this->tfp = _tfp;
     }}
 
-    void init_tfp(VerilatedVcdC *_tfp)
+    void dump()
     {{
-        this->tfp = _tfp;
-    }}
+{dump}    }}
 
+    virtual void trace_off()
+    {{
+        Simulator::trace_off();
+{flush}    }}
+{state_access}{mem_access}
     void init_simdata()
     {{
         this->sim_datas.inputs.clear();
         this->sim_datas.outputs.clear();
 
-""".format(name=self.dut_name)
+""".format(name=self.dut_name, header=trace_header, trace_class=trace_class,
+           dump=trace_dump, flush=trace_flush,
+           includes=harness_includes,
+           state_access=state_access() if self.build.savable else "",
+           mem_access=mem_access(self.dut_name, self.mem_map) if bulk_mem else "")
 
         cat_table.append(harness_code_A)
 
         push_str = push_data(self.input_sig_map, self.output_sig_map)
         cat_table.append(push_str)
         
+        if self.trace_window is None:
+            trace_init = "    TraceFile *tfp = NULL;\n"
+            trace_fini = ""
+        else:
+            trace_init = """    Verilated::traceEverOn(true);
+    TraceFile *tfp = new TraceFile;
+    top->trace(tfp, 99);
+    tfp->open(\"{name}.{ext}\");
+""".format(name=self.dut_name, ext=trace_ext)
+            trace_fini = "    delete tfp;\n"
+
+        # Verilator 5 models refuse a context with fewer threads than they were verilated with
+        threads_init = ""
+        if self.build.threads > 1:
+            threads_init = """#if VERILATOR_VERSION_INTEGER >= 5000000
+    Verilated::threads({threads});
+#endif
+""".format(threads=self.build.threads)
+
         harness_code_B = """\t}}
 
     virtual void step()
     {{
         this->dut->clock = 0;
         this->dut->eval();
-        this->tfp->dump((vluint64_t)this->main_time);
+        dump();
         this->main_time++;
 
         this->dut->clock = 1;
         this->dut->eval();
-        this->tfp->dump((vluint64_t)this->main_time);
+        dump();
         this->main_time++;
     }}
 
@@ -198,108 +660,657 @@ public:
 int main(int argc, char **argv)
 {{
     Verilated::commandArgs(argc, argv);
-    Verilated::traceEverOn(true);
-    V{name} *top = new V{name};
-    VerilatedVcdC *tfp = new VerilatedVcdC;
-    tfp = new VerilatedVcdC;
-    top->trace(tfp, 99);
-    tfp->open("{name}.vcd");
-    {name}_Simulator sim(top);
+    parse_args(argc, argv);
+{threads_init}    V{name} *top = new V{name};
+{trace_init}    {name}_Simulator sim(top);
     sim.init_simdata();
     sim.init_tfp(tfp);
+    notify_ready();
     
     top->reset = 1;
 
     while(!sim.isexit())
         sim.tick();
 
-    delete tfp;
-    delete top;
+{trace_fini}    delete top;
     exit(0);
 }}        
-        """.format(name=self.dut_name)
+        """.format(name=self.dut_name, trace_init=trace_init, trace_fini=trace_fini, threads_init=threads_init)
         cat_table.append(harness_code_B)
 
         harness_code = "".join(cat_table)
 
-        try:
-            os.mkdir("simulation")
-        except FileExistsError:
-            pass
-        with open("./simulation/{}-harness.cpp".format(self.dut_name), "w+") as harness_file:
-            harness_file.write(harness_code)
-
-        builder.emit(builder.elaborate(module), "./simulation/{}.fir".format(self.dut_name))
-        builder.dumpverilog("./simulation/{}.fir".format(self.dut_name), "./simulation/{}.v".format(self.dut_name))
+        if workdir is None:
+            os.makedirs("simulation", exist_ok=True)
+            workdir = tempfile.mkdtemp(prefix="{}-".format(self.dut_name), dir="simulation")
+        else:
+            os.makedirs(workdir, exist_ok=True)
+        self.workdir = os.path.abspath(workdir)
 
         vfn = "{}.v".format(self.dut_name)
         hfn = "{}-harness.cpp".format(self.dut_name)
         mfn = "V{}.mk".format(self.dut_name)
         efn = "V{}".format(self.dut_name)
+        ffn = "{}.fir".format(self.dut_name)
+
+        with open(self.path(hfn), "w+") as harness_file:
+            harness_file.write(harness_code)
 
-        src_file = "/".join(getmodule(Simulator).__file__.split("/")[:-1]) + "/src/simulator.h"
-        os.system("cp {} ./simulation".format(src_file))
+        with open(self.path(ffn), "w+") as fir_file:
+            fir_file.write(builder.elaborate(module).emit())
+        builder.dumpverilog(self.path(ffn), self.path(vfn))
 
-        # Using verilator backend
-        os.chdir("./simulation")
-        os.system("verilator --cc {vfn} --trace --exe {hfn}".format(vfn=vfn, hfn=hfn))
-        os.system("make -j -C ./obj_dir -f {mfn} {efn}".format(mfn=mfn, efn=efn))
+        src_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), "src", "simulator.h")
+        shutil.copy(src_file, self.workdir)
 
-        # Run simulation backend program
-        os.system("./obj_dir/{}&".format(efn))
+        build = self.build
+        binary = self.path("obj_dir", efn)
+        cached = None
+        if cache and os.path.exists(self.path(vfn)):
+            with open(self.path(vfn)) as vfile, open(src_file) as header:
+                key = build_key(vfile.read(), harness_code, header.read(), build.key())
+            cached = os.path.join(cache_root, key, efn)
 
-        time.sleep(1)
+        if cached is not None and os.path.exists(cached):
+            binary = cached
+        else:
+            # Using verilator backend
+            trace_args = [] if self.trace_window is None else [trace_flag]
+            subprocess.run(["verilator", "--cc", vfn] + trace_args + build.verilator_args()
+                           + ["--exe", hfn], cwd=self.workdir)
+            subprocess.run(["make"] + build.make_args() + ["-C", "./obj_dir", "-f", mfn, efn], cwd=self.workdir)
+
+            # Publish the binary atomically, other processes may build the same key
+            if cached is not None and os.path.exists(binary):
+                os.makedirs(os.path.dirname(cached), exist_ok=True)
+                staging = "{}.{}".format(cached, os.getpid())
+                shutil.copy2(binary, staging)
+                os.replace(staging, cached)
+
+        if not os.path.exists(binary):
+            raise RuntimeError("Failed to build the {} harness, see {}".format(self.dut_name, self.workdir))
 
         self.init_channel()
 
+        # Run simulation backend program, the channel segment is passed by fd.
+        # The harness reports READY on a pipe once the segment is mapped
+        ready_r, ready_w = os.pipe()
+        try:
+            self.process = subprocess.Popen(
+                [binary, "+ready_fd={}".format(ready_w), "+channel_fd={}".format(self.channel_fd)],
+                cwd=self.workdir, pass_fds=(ready_w, self.channel_fd))
+        finally:
+            os.close(ready_w)
+        try:
+            self.wait_ready(ready_r, ready_timeout)
+        finally:
+            os.close(ready_r)
+        self.started_at = time.perf_counter()
+        self.next_report = None if report_interval is None else self.started_at + report_interval
+
+    def wait_ready(self, fd, timeout):
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                self.process.kill()
+                raise TimeoutError("{} harness not ready after {} seconds".format(self.dut_name, timeout))
+            readable, _, _ = select.select([fd], [], [], min(remaining, 0.1))
+            if len(readable) > 0:
+                if os.read(fd, 16).startswith(b"READY"):
+                    return
+                # EOF, the harness exited without reporting ready
+                self.process.wait()
+                self.check_alive()
+
+    def check_alive(self):
+        """Raise if the harness process has exited"""
+        status = self.process.poll()
+        if status is not None:
+            raise RuntimeError("{} harness exited with status {}".format(self.dut_name, status))
+
+    def path(self, *names):
+        """Path of a file in the working directory of this simulator"""
+        return os.path.join(self.workdir, *names)
+
     def init_channel(self):
-        self.mm_in = mmap.mmap(os.open("./in.dat", os.O_RDWR), psize)
-        self.mm_sig = mmap.mmap(os.open("./sig.dat", os.O_RDWR), psize)
-        self.mm_out = mmap.mmap(os.open("./out.dat", os.O_RDWR), psize)
+        """Create the channel segment: signal page, input frame, output frame
+        and vector ring, one after another
+        """
+        in_offset = psize
+        out_offset = in_offset + self.in_size
+        vec_offset = out_offset + self.out_size
+        self.channel_fd = create_segment("pyhcl-{}".format(self.dut_name), vec_offset + self.vec_size)
+
+        self.mm_sig = mmap.mmap(self.channel_fd, psize)
+        self.mm_in = mmap.mmap(self.channel_fd, self.in_size, offset=in_offset)
+        self.mm_out = mmap.mmap(self.channel_fd, self.out_size, offset=out_offset)
+        self.mm_vec = mmap.mmap(self.channel_fd, self.vec_size, offset=vec_offset)
+
+        # Publish the wait mode, trace window and layout before the harness starts
+        trace_window = (0, trace_forever) if self.trace_window is None else self.trace_window
+        struct.pack_into("<6Q", self.mm_sig, uint64_t_size, self.wait_mode, *trace_window,
+                         in_offset, out_offset, vec_offset)
+        if self.wait_mode == WAIT_FUTEX:
+            self.sig_addr = ctypes.addressof(ctypes.c_uint64.from_buffer(self.mm_sig))
+
+        # Views over the output region, filled by snapshot() in signal number order
+        self.outputs = None
+        self.output_words = None
+        if np is not None:
+            names, formats, offsets = [], [], []
+            offset = 0
+            for port in self.output_sig_map:
+                n = self.port_words[port]
+                names.append(port_name(port))
+                formats.append("<u8" if n == 1 else ("<u8", (n,)))
+                offsets.append(offset)
+                offset += n * uint64_t_size
+            dtype = np.dtype({"names": names, "formats": formats, "offsets": offsets, "itemsize": max(offset, 1)})
+            self.outputs = np.frombuffer(self.mm_out, dtype=dtype, count=1).reshape(())
+            self.output_words = np.frombuffer(self.mm_out, dtype="<u8", count=offset // uint64_t_size)
 
-    def wait_signal(self):
+    def wait_signal(self, reply=False):
+        """Wait until the harness is idle
+
+        Args:
+            reply: The host blocks on the reply of the transaction it just sent,
+                   only then is the round trip a latency sample. Otherwise the
+                   wait may follow testbench code run after a fire-and-forget
+                   transaction, it only counts as harness time
+        """
+        waited_at = None if self.sent_at is None else time.perf_counter()
+        spins = 0
+        backoff = 1e-6
         signal = read_data(self.mm_sig)
         while signal != WAIT:
+            spins += 1
+            if spins > spin_limit:
+                if self.wait_mode == WAIT_FUTEX:
+                    futex_wait(self.sig_addr, signal)
+                elif self.wait_mode == WAIT_ADAPTIVE:
+                    time.sleep(backoff)
+                    backoff = min(backoff * 2, 1e-3)
+                if spins % alive_check == 0:
+                    self.check_alive()
             signal = read_data(self.mm_sig)
 
+        if self.sent_at is not None:
+            # A transaction completed, Python was blocked on the harness since waited_at
+            now = time.perf_counter()
+            self.harness_time += now - waited_at
+            if reply:
+                latency = now - self.sent_at
+                self.round_trips += 1
+                self.latency_total += latency
+                self.latency_histogram[min(int(latency * 1e6).bit_length(), latency_buckets - 1)] += 1
+            self.sent_at = None
+            if self.next_report is not None and now >= self.next_report:
+                self.next_report = now + self.report_interval
+                self.report()
+
+    def send_signal(self, signal):
+        write_data(self.mm_sig, signal)
+        if self.wait_mode == WAIT_FUTEX:
+            futex_wake(self.sig_addr)
+        self.sent_at = time.perf_counter()
+
+    def stats(self):
+        """Throughput counters since the harness started
+
+        Returns:
+            A dict of the cycles simulated, reset() and start() included, the
+            wall time and cycles per second, the number of round trips Python
+            blocked on with their mean latency and a histogram maps a bound in
+            microseconds to the round trips faster than it, and the seconds
+            Python waited on the harness and the rest of the wall time
+        """
+        wall_time = time.perf_counter() - self.started_at
+        cycles = self.step_count + self.reset_cycles
+        histogram = {}
+        for i, count in enumerate(self.latency_histogram):
+            if count > 0:
+                histogram[1 << i] = count
+        return {
+            "cycles": cycles,
+            "wall_time": wall_time,
+            "cycles_per_second": cycles / wall_time if wall_time > 0 else 0.0,
+            "round_trips": self.round_trips,
+            "mean_latency": self.latency_total / self.round_trips if self.round_trips > 0 else 0.0,
+            "latency_histogram": histogram,
+            "harness_time": self.harness_time,
+            "python_time": wall_time - self.harness_time,
+        }
+
+    def report(self):
+        """Print a one line summary of stats()"""
+        stats = self.stats()
+        print("[{}] {} cycles in {:.3f}s, {:.0f} cycles/s, {} round trips of {:.1f}us, "
+              "harness {:.3f}s, python {:.3f}s".format(
+                self.dut_name, stats["cycles"], stats["wall_time"], stats["cycles_per_second"],
+                stats["round_trips"], stats["mean_latency"] * 1e6, stats["harness_time"], stats["python_time"]))
+
     def poke(self, port, value):
         signum = self.input_sig_map[port]
-        # print(signum)
 
-        self. wait_signal()
-        write_data(self.mm_in, value)
-        self.mm_in.seek(uint64_t_size)
-        write_data(self.mm_in, signum)
-        write_data(self.mm_sig, DIN)
-        print("{}->".format(port._data._ir_exp.emit()), value)
+        self.wait_signal()
+        if self.port_words[port] == 1:
+            write_data(self.mm_in, value)
+            self.mm_in.seek(uint64_t_size)
+            write_data(self.mm_in, signum)
+        else:
+            # Wide values follow the signal number
+            write_frame(self.mm_in, [0, signum] + to_words(value, self.port_words[port]))
+        self.send_signal(DIN)
+        if self.log is not None:
+            self.log.write(LOG_POKE, signum, value, self.port_words[port], self.step_count)
 
     def peek(self, port):
         signum = self.output_sig_map[port]
-        # print(signum)
 
         self.wait_signal()
         self.mm_out.seek(uint64_t_size)
         write_data(self.mm_out, signum)
-        write_data(self.mm_sig, DOUT)
+        self.send_signal(DOUT)
+        self.wait_signal(reply=True)
+        if self.port_words[port] == 1:
+            value = read_data(self.mm_out)
+        else:
+            value = read_value(self.mm_out, 2 * uint64_t_size, self.port_words[port])
+        if self.log is not None:
+            self.log.write(LOG_PEEK, signum, value, self.port_words[port], self.step_count)
+        return value
+
+    def snapshot(self):
+        """Sample every output port in one transaction
+
+        Returns:
+            A structured NumPy array with one field per output port, named like
+            the verilated signal, wide ports are word arrays. It is a view over
+            the channel overwritten by the next transaction, copy it to keep it.
+            self.output_words views the same values as one flat uint64 array
+        """
+        if np is None:
+            raise ImportError("snapshot() requires numpy")
+        self.wait_signal()
+        self.send_signal(SNAPSHOT)
+        self.wait_signal(reply=True)
+        return self.outputs
+
+    def save_state(self, path=None):
+        """Checkpoint the model state with Verilator serialization, the
+        harness must be built with SimBuildConfig(savable=True)
+
+        Args:
+            path: File the state is saved to, a fresh file in the working directory by default
+
+        Returns:
+            A handle of the state for restore_state(), any Simulator of the same
+            module can restore it, e.g. to fork many tests from one boot sequence
+        """
+        if path is None:
+            self.saved_count += 1
+            path = self.path("state-{}.bin".format(self.saved_count))
+        self.state_transaction(SAVE, path)
+        return path
+
+    def restore_state(self, handle):
+        """Restore a state saved by save_state(), the state stays reusable"""
+        self.state_transaction(RESTORE, handle)
+        self.step_count = read_frame(self.mm_out, 2)[1]
+
+    def state_transaction(self, signal, path):
+        if not self.build.savable:
+            raise RuntimeError("Saving and restoring state needs a harness built with SimBuildConfig(savable=True)")
+        # Frame layout: [step count, path length, nul terminated path bytes]
+        data = os.path.abspath(path).encode() + b"\0"
+        if 2 * uint64_t_size + len(data) > self.in_size:
+            raise ValueError("State path exceeds the channel size")
+
         self.wait_signal()
-        print("{}->".format(port._data._ir_exp.emit()), read_data(self.mm_out))
+        write_frame(self.mm_in, [self.step_count, len(data)])
+        self.mm_in[2 * uint64_t_size:2 * uint64_t_size + len(data)] = data
+        self.send_signal(signal)
+        self.wait_signal(reply=True)
+        if read_frame(self.mm_out, 1)[0] == 0:
+            raise RuntimeError("{} harness failed to {} state {}".format(
+                self.dut_name, "save" if signal == SAVE else "restore", path))
 
-    def step(self):
+    def load_mem(self, mem, data, base=0):
+        """Fill a memory in bulk, without driving its write ports, the harness
+        must be built with SimBuildConfig(mem_access=True)
+
+        Args:
+            mem: Mem object of the top module or a submodule
+            data: Sequence or NumPy array of values, or a $readmemh file name
+            base: Address of the first value, @address directives of a hex file
+                  are relative to it
+        """
+        if isinstance(data, str):
+            for address, values in read_hex(data):
+                self.mem_transaction(LOAD_MEM, mem, base + address, values)
+        else:
+            self.mem_transaction(LOAD_MEM, mem, base, data)
+
+    def dump_mem(self, mem, filename=None, base=0, count=None):
+        """Read a memory in bulk
+
+        Args:
+            mem: Mem object of the top module or a submodule
+            filename: Also write the values to this $readmemh file
+            base: Address of the first value
+            count: Number of values, up to the end of the memory by default
+
+        Returns:
+            A uint64 array of the values, a list without numpy
+        """
+        _, _, size, width = self.mem_info(mem)
+        count = size - base if count is None else count
+        values = self.mem_transaction(DUMP_MEM, mem, base, [0] * count)
+        if filename is not None:
+            write_hex(filename, values, width, base)
+        return values if np is None else np.array(values, dtype=np.uint64)
+
+    def mem_info(self, mem):
+        if not self.build.mem_access:
+            raise RuntimeError("Bulk memory access needs a harness built with SimBuildConfig(mem_access=True)")
+        if mem not in self.mem_map:
+            raise ValueError("Unknown memory, it must be a Mem of the simulated module")
+        info = self.mem_map[mem]
+        if info[3] > 64:
+            raise ValueError("Bulk access supports memories up to 64 bits wide")
+        return info
+
+    def mem_transaction(self, signal, mem, base, values):
+        """Move values between the host and a memory through the vector region"""
+        index, path, size, width = self.mem_info(mem)
+        count = len(values)
+        if base < 0 or base + count > size:
+            raise ValueError("Range [{}, {}) exceeds memory {} of size {}".format(
+                base, base + count, ".".join(path), size))
+
+        mask = (1 << width) - 1
+        chunk = self.vec_size // uint64_t_size
+        ring = None if np is None else np.frombuffer(self.mm_vec, dtype=np.uint64)
+        results = []
         self.wait_signal()
-        write_data(self.mm_sig, STEP)
-        print("step %d" % self.step_count)
-        self.step_count += 1
+        for start in range(0, count, chunk):
+            n = min(chunk, count - start)
+            if signal == LOAD_MEM and ring is not None:
+                ring[:n] = np.asarray(values[start:start + n]).astype(np.uint64) & np.uint64(mask)
+            elif signal == LOAD_MEM:
+                struct.pack_into("<{}Q".format(n), self.mm_vec, 0,
+                                 *(int(x) & mask for x in values[start:start + n]))
+            write_frame(self.mm_in, [index, base + start, n])
+            self.send_signal(signal)
+            self.wait_signal(reply=True)
+            if read_frame(self.mm_out, 1)[0] == 0:
+                raise RuntimeError("{} harness cannot access memory {}".format(self.dut_name, ".".join(path)))
+            if signal == DUMP_MEM:
+                results.extend(ring[:n].tolist() if ring is not None else struct.unpack_from("<{}Q".format(n), self.mm_vec, 0))
+        del ring
+        return results
+
+    def read_samples(self, ports, offset):
+        """Decode sampled port values packed in the output channel"""
+        values = {}
+        for port in ports:
+            values[port] = read_value(self.mm_out, offset, self.port_words[port])
+            offset += self.port_words[port] * uint64_t_size
+        return values
+
+    def step(self, n=1):
+        """Step n cycles inside the harness, one round trip regardless of n"""
+        self.wait_signal()
+        if n == 1:
+            self.send_signal(STEP)
+        else:
+            write_frame(self.mm_in, [n, 0, 0])
+            self.send_signal(CYCLE)
+        if self.log is not None:
+            self.log.write(LOG_STEP, 0, n, 1, self.step_count)
+        self.step_count += n
+
+    def run_until(self, port, value, max_cycles, sample=None):
+        """Step until an output port equals a value, inside the harness
+
+        The condition is checked before every cycle, so no cycle runs if it
+        already holds.
+
+        Args:
+            port: Output port to be watched
+            value: Value waited for
+            max_cycles: Maximum number of cycles to step
+            sample: Output ports to be peeked at the end, the watched port by default
+
+        Returns:
+            The number of cycles stepped and a dict maps every sampled port to its value
+
+        Raises:
+            TimeoutError: The port did not reach the value within max_cycles
+        """
+        sample = [port] if sample is None else list(sample)
+        if self.port_words[port] != 1:
+            raise ValueError("run_until() can only watch ports up to 64 bits")
+        frame = [self.output_sig_map[port], int(value) & 0xffffffffffffffff, max_cycles, len(sample)]
+        frame.extend(self.output_sig_map[k] for k in sample)
+        if len(frame) * uint64_t_size > self.in_size:
+            raise ValueError("Transaction frame exceeds the channel size")
+
+        self.wait_signal()
+        write_frame(self.mm_in, frame)
+        self.send_signal(RUN_UNTIL)
+        self.wait_signal(reply=True)
+        cycles, matched = read_frame(self.mm_out, 2)
+        if self.log is not None:
+            self.log.write(LOG_STEP, 0, cycles, 1, self.step_count)
+        self.step_count += cycles
+
+        if not matched:
+            raise TimeoutError("{} did not reach {} within {} cycles".format(
+                port_name(port), value, max_cycles))
+        return cycles, self.read_samples(sample, 2 * uint64_t_size)
+
+    def run_random(self, constraints, cycles, seed=0, signature=None):
+        """Run constrained random stimulus generated inside the harness
+
+        Every cycle the harness draws a value for each constrained input, steps
+        and folds the signature outputs into an FNV-1a hash. Only the result
+        comes back, rerun with the same seed and tracing to debug a failure.
+
+        Args:
+            constraints: Dict maps input ports to distributions, see encode_distribution
+            cycles: Maximum number of cycles to run
+            seed: Seed of the stimulus generator
+            signature: Output ports hashed every cycle, all outputs by default
+
+        Returns:
+            The number of cycles run, whether an assertion failed, whether the
+            design stopped, and the signature. A stop with a zero exit code
+            ends the run without failing it
+        """
+        signature = list(self.output_sig_map) if signature is None else list(signature)
+        frame = [cycles, seed & 0xffffffffffffffff, len(constraints), len(signature)]
+        for port, spec in constraints.items():
+            if self.port_words[port] != 1:
+                raise ValueError("run_random() can only drive ports up to 64 bits")
+            frame.extend(encode_distribution(self.input_sig_map[port], spec, port._define_node.type.width))
+        frame.extend(self.output_sig_map[port] for port in signature)
+        if len(frame) * uint64_t_size > self.in_size:
+            raise ValueError("Transaction frame exceeds the channel size")
+
+        self.wait_signal()
+        write_frame(self.mm_in, frame)
+        self.send_signal(RANDOM)
+        self.wait_signal(reply=True)
+        ran, failed, stopped, value = read_frame(self.mm_out, 4)
+        if self.log is not None:
+            self.log.write(LOG_STEP, 0, ran, 1, self.step_count)
+        self.step_count += ran
+        return ran, bool(failed), bool(stopped), value
+
+    def cycle(self, inputs=None, sample=None, n=1):
+        """Poke inputs, step n cycles and peek the sample ports in one transaction
+
+        Args:
+            inputs: Dict maps input ports to the values to be poked
+            sample: Output ports to be peeked after stepping
+            n: Number of cycles to step
+
+        Returns:
+            A dict maps every sampled port to its value
+        """
+        inputs = {} if inputs is None else inputs
+        sample = [] if sample is None else list(sample)
+
+        # Frame layout: [n, npoke, nsample, (signum, value words) * npoke, signum * nsample]
+        frame = [n, len(inputs), len(sample)]
+        for port, value in inputs.items():
+            frame.append(self.input_sig_map[port])
+            frame.extend(to_words(value, self.port_words[port]))
+        frame.extend(self.output_sig_map[port] for port in sample)
+        if len(frame) * uint64_t_size > self.in_size:
+            raise ValueError("Transaction frame exceeds the channel size")
+
+        self.wait_signal()
+        write_frame(self.mm_in, frame)
+        self.send_signal(CYCLE)
+        self.wait_signal(reply=True)
+        values = self.read_samples(sample, 0)
+
+        if self.log is not None:
+            for port, value in inputs.items():
+                self.log.write(LOG_POKE, self.input_sig_map[port], value, self.port_words[port], self.step_count)
+            self.log.write(LOG_STEP, 0, n, 1, self.step_count)
+            for port, value in values.items():
+                self.log.write(LOG_PEEK, self.output_sig_map[port], value, self.port_words[port], self.step_count + n)
+        self.step_count += n
+
+        return values
+
+    def run_vectors(self, inputs, outputs):
+        """Drive the DUT from stimulus arrays, one row per cycle
+
+        The stimulus is streamed through a two-slot ring buffer in shared memory,
+        the next slot is filled while the harness clocks through the current one.
+
+        Args:
+            inputs: Dict maps input ports to arrays, all of the same length. Ports
+                    wider than 64 bits take (ncycles, nwords) word arrays or
+                    sequences of Python ints
+            outputs: Output ports to be sampled after every cycle
+
+        Returns:
+            A dict maps every output port to a uint64 array of its samples,
+            (ncycles, nwords) word arrays for ports wider than 64 bits
+        """
+        if np is None:
+            raise ImportError("run_vectors() requires numpy")
+
+        in_ports = list(inputs)
+        out_ports = list(outputs)
+        columns = [self.stimulus_words(port, inputs[port]) for port in in_ports]
+        ncycles = len(columns[0]) if len(columns) > 0 else 0
+        if any(len(column) != ncycles for column in columns):
+            raise ValueError("Stimulus arrays must have the same length")
+        if 4 + len(in_ports) + len(out_ports) > self.in_size // uint64_t_size:
+            raise ValueError("Too many ports for one vector transaction")
+
+        # nin and nout count channel words of a row, not ports
+        nin = sum(self.port_words[port] for port in in_ports)
+        nout = sum(self.port_words[port] for port in out_ports)
+        stimulus = np.concatenate(columns, axis=1) if len(columns) > 0 else np.zeros((ncycles, 0), dtype=np.uint64)
+        samples = np.zeros((ncycles, nout), dtype=np.uint64)
+        signums = [self.input_sig_map[port] for port in in_ports] + [self.output_sig_map[port] for port in out_ports]
+
+        slot_words = self.vec_size // uint64_t_size // 2
+        chunk = max(1, slot_words // max(1, nin + nout))
+        ring = np.frombuffer(self.mm_vec, dtype=np.uint64)
+
+        def collect(slot, start, stop):
+            base = slot * slot_words + (stop - start) * nin
+            samples[start:stop] = ring[base:base + (stop - start) * nout].reshape(stop - start, nout)
+
+        self.wait_signal()
+        pending = None
+        for index, start in enumerate(range(0, ncycles, chunk)):
+            stop = min(start + chunk, ncycles)
+            slot = index % 2
+            base = slot * slot_words
+            ring[base:base + (stop - start) * nin] = stimulus[start:stop].ravel()
+
+            # The harness may still be running the other slot
+            if pending is not None:
+                self.wait_signal()
+                collect(*pending)
+
+            write_frame(self.mm_in, [base, stop - start, len(in_ports), len(out_ports)] + signums)
+            self.send_signal(VECTOR)
+            pending = (slot, start, stop)
+
+        if pending is not None:
+            self.wait_signal()
+            collect(*pending)
+        del ring
+        if self.log is not None:
+            self.log.write(LOG_STEP, 0, ncycles, 1, self.step_count)
+        self.step_count += ncycles
+
+        results = {}
+        offset = 0
+        for port in out_ports:
+            n = self.port_words[port]
+            results[port] = samples[:, offset].copy() if n == 1 else samples[:, offset:offset + n].copy()
+            offset += n
+        return results
+
+    def stimulus_words(self, port, data):
+        """Convert the stimulus of a port to a (ncycles, nwords) uint64 array"""
+        n = self.port_words[port]
+        data = np.asarray(data)
+        if data.dtype == object:
+            # Python ints may be wider than 64 bits
+            return np.array([to_words(x, n) for x in data.ravel()], dtype=np.uint64).reshape(-1, n)
+        # The row width is explicit, an empty stimulus cannot infer it
+        data = data.astype(np.uint64).reshape(len(data), int(np.prod(data.shape[1:], dtype=int)))
+        if data.shape[1] < n:
+            data = np.pad(data, ((0, 0), (0, n - data.shape[1])))
+        return data
 
     def term(self):
         self.wait_signal()
-        write_data(self.mm_sig, TERM)
-        time.sleep(1)
-        os.remove("./in.dat")
-        os.remove("./out.dat")
-        os.remove("./sig.dat")
+        self.send_signal(TERM)
+        try:
+            self.process.wait(timeout=term_timeout)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+        # The segment is freed once both sides dropped it
+        os.close(self.channel_fd)
+        if self.log is not None:
+            self.log.close()
+
+    def trace_on(self):
+        """Dump waves from the next cycle on, regardless of the trace window"""
+        if self.trace_window is None:
+            raise RuntimeError("Simulator was built with trace=\"off\"")
+        self.wait_signal()
+        struct.pack_into("<2Q", self.mm_sig, SIG_TRACE_START * uint64_t_size, 0, trace_forever)
+        self.send_signal(TRACE_ON)
+
+    def trace_off(self):
+        """Stop dumping waves and flush the trace file"""
+        if self.trace_window is None:
+            raise RuntimeError("Simulator was built with trace=\"off\"")
+        self.wait_signal()
+        self.send_signal(TRACE_OFF)
 
     def start(self):
-        write_data(self.mm_sig, START)
+        self.wait_signal()
+        self.send_signal(START)
+        self.reset_cycles += 1
 
     def reset(self):
-        write_data(self.mm_sig, RESET)
+        self.wait_signal()
+        self.send_signal(RESET)
+        self.reset_cycles += 1
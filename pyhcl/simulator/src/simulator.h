@@ -3,11 +3,21 @@
 #include <iostream>
 #include <fstream>
 #include <cstdlib>
+#include <cstdint>
+#include <cstring>
 #include <sys/mman.h>
 #include <unistd.h>
+#include <sched.h>
+#include <time.h>
+#ifdef __linux__
+#include <linux/futex.h>
+#include <sys/syscall.h>
+#endif
 #include <fcntl.h>
+#include <sys/stat.h>
 #include <vector>
 #include <map>
+#include <algorithm>
 
 using namespace std;
 
@@ -19,15 +29,70 @@ using namespace std;
 #define STEP  4
 #define START 5
 #define RESET 6
+#define CYCLE 7
+#define VECTOR 8
+#define TRACE_ON  9
+#define TRACE_OFF 10
+#define RUN_UNTIL 11
+#define SNAPSHOT  12
+#define SAVE      13
+#define RESTORE   14
+#define LOAD_MEM  15
+#define DUMP_MEM  16
+#define RANDOM    17
+
+/* Random stimulus distributions */
+#define DIST_RANGE  0
+#define DIST_CHOICE 1
+
+// Words of the signal page, the host fills them before starting the harness
+#define SIG_SIGNAL      0
+#define SIG_WAIT_MODE   1
+#define SIG_TRACE_START 2
+#define SIG_TRACE_STOP  3
+#define SIG_IN_OFFSET   4
+#define SIG_OUT_OFFSET  5
+#define SIG_VEC_OFFSET  6
+
+// Wait modes, selected by the host in sig[1]
+#define WAIT_SPIN     0
+#define WAIT_ADAPTIVE 1
+#define WAIT_FUTEX    2
+
+// Spin rounds before an adaptive or futex waiter starts to block
+#define SPIN_LIMIT 4096
+
+// Blocked wait rounds between two checks that the host is still alive
+#define ALIVE_CHECK 1024
 
 /* Simulation finish flag */
 size_t is_exit = 0;
 
+/* Channel segment and ready pipe passed by the host */
+int channel_fd = -1;
+int ready_fd = -1;
+
 class DataWrapper
 {
 public:
     virtual void poke(uint64_t value) = 0;
     virtual uint64_t peek() = 0;
+
+    // Number of 64-bit channel words the value takes
+    virtual int words()
+    {
+        return 1;
+    }
+
+    virtual void poke_words(const uint64_t *src)
+    {
+        poke(src[0]);
+    }
+
+    virtual void peek_words(uint64_t *dst)
+    {
+        dst[0] = peek();
+    }
 };
 
 // Wrap Verilator data types
@@ -118,6 +183,138 @@ public:
     }
 };
 
+// Signals wider than 64 bits, verilated as arrays of 32-bit words
+class WDataWrapper: public DataWrapper
+{
+private:
+    EData *signal;
+    int width;
+    int nwords;
+public:
+    WDataWrapper(EData *_signal, int _width)
+    {
+        this->signal = _signal;
+        this->width = _width;
+        this->nwords = (_width + 31) / 32;
+    }
+
+    virtual int words()
+    {
+        return (this->width + 63) / 64;
+    }
+
+    virtual void poke(uint64_t value)
+    {
+        uint64_t src[1] = {value};
+        for (int i = 0; i < this->nwords; i++)
+            signal[i] = i < 2 ? (EData)(src[0] >> (32 * i)) : 0;
+    }
+
+    virtual uint64_t peek()
+    {
+        return (uint64_t) signal[0] | ((uint64_t) signal[1] << 32);
+    }
+
+    virtual void poke_words(const uint64_t *src)
+    {
+        for (int i = 0; i < this->nwords; i++)
+            signal[i] = (EData)(src[i / 2] >> (32 * (i % 2)));
+        if (this->width % 32 != 0)
+            signal[this->nwords - 1] &= ((EData)1 << (this->width % 32)) - 1;
+    }
+
+    virtual void peek_words(uint64_t *dst)
+    {
+        for (int i = 0; i < words(); i++)
+        {
+            dst[i] = (uint64_t) signal[2 * i];
+            if (2 * i + 1 < this->nwords)
+                dst[i] |= (uint64_t) signal[2 * i + 1] << 32;
+        }
+    }
+};
+
+static inline uint64_t load_word(uint64_t *addr)
+{
+    return __atomic_load_n(addr, __ATOMIC_ACQUIRE);
+}
+
+static inline void store_word(uint64_t *addr, uint64_t value)
+{
+    __atomic_store_n(addr, value, __ATOMIC_RELEASE);
+}
+
+static inline void futex_wait(uint64_t *addr, uint64_t value)
+{
+#ifdef __linux__
+    // Signal values fit in the low 32 bits of the little-endian word
+    struct timespec timeout = {0, 10000000};
+    syscall(SYS_futex, (uint32_t *)addr, FUTEX_WAIT, (uint32_t)value, &timeout, NULL, 0);
+#else
+    sched_yield();
+#endif
+}
+
+static inline void futex_wake(uint64_t *addr)
+{
+#ifdef __linux__
+    syscall(SYS_futex, (uint32_t *)addr, FUTEX_WAKE, 1, NULL, NULL, 0);
+#endif
+}
+
+static void parse_args(int argc, char **argv)
+{
+    /* +channel_fd=N and +ready_fd=N are passed by the host */
+    for (int i = 1; i < argc; i++)
+    {
+        if (strncmp(argv[i], "+channel_fd=", 12) == 0)
+            channel_fd = atoi(argv[i] + 12);
+        else if (strncmp(argv[i], "+ready_fd=", 10) == 0)
+            ready_fd = atoi(argv[i] + 10);
+    }
+}
+
+static void notify_ready()
+{
+    /* Report READY on the pipe once the channel is mapped */
+    if (ready_fd < 0)
+        return;
+    if (write(ready_fd, "READY\n", 6) != 6)
+        perror("ready notification failed");
+    close(ready_fd);
+}
+
+static inline uint64_t splitmix64(uint64_t &state)
+{
+    /* Stimulus generator, fast and reproducible from the seed */
+    uint64_t z = (state += 0x9e3779b97f4a7c15ULL);
+    z = (z ^ (z >> 30)) * 0xbf58476d1ce4e5b9ULL;
+    z = (z ^ (z >> 27)) * 0x94d049bb133111ebULL;
+    return z ^ (z >> 31);
+}
+
+static inline uint64_t random_below(uint64_t &state, uint64_t n)
+{
+    /* Uniform in [0, n), n == 0 means the full 64-bit range */
+    uint64_t x = splitmix64(state);
+    return n == 0 ? x : (uint64_t)(((unsigned __int128)x * n) >> 64);
+}
+
+template<class M> bool access_mem(M &mem, uint64_t size, bool write, uint64_t base, uint64_t count, uint64_t *data)
+{
+    /* Copy between a verilated memory array and the vector region */
+    if (base + count > size)
+        return false;
+    for (uint64_t i = 0; i < count; i++)
+    {
+        if (write)
+            mem[base + i] = data[i];
+        else
+            data[i] = mem[base + i];
+    }
+    return true;
+}
+
 template<class T> struct Sim_data
 {
     vector<T> inputs;
@@ -130,52 +327,331 @@ protected:
     uint64_t *in;
     uint64_t *out;
     uint64_t *sig;
+    uint64_t *vec;
+    uint64_t *channel;
+    size_t channel_size;
     Sim_data<T> sim_datas;
     uint64_t main_time;
-    int in_fd;
-    int out_fd;
-    int sig_fd;
+    bool tracing;
+    pid_t host;
 
 public:
     Simulator()
     {
-        // Create file memory mapping
-        this->in_fd = open("in.dat", O_RDWR | O_CREAT, 00777);
-        this->out_fd = open("out.dat", O_RDWR | O_CREAT, 00777);
-        this->sig_fd = open("sig.dat", O_RDWR | O_CREAT, 00777);
-        
-        int psize = getpagesize();
-        ftruncate(this->in_fd, psize);
-        ftruncate(this->out_fd, psize);
-        ftruncate(this->sig_fd, psize);
-
-        this->in = (uint64_t*)mmap(NULL, psize, PROT_WRITE | PROT_READ, MAP_SHARED, this->in_fd, 0);
-        this->out = (uint64_t*)mmap(NULL, psize, PROT_WRITE | PROT_READ, MAP_SHARED, this->out_fd, 0);
-        this->sig = (uint64_t*)mmap(NULL, psize, PROT_WRITE | PROT_READ, MAP_SHARED, this->sig_fd, 0);
-
-        if (this->in == MAP_FAILED || this->out == MAP_FAILED || this->sig == MAP_FAILED)
+        // Map the shared memory segment created by the host
+        struct stat st;
+        if (channel_fd < 0 || fstat(channel_fd, &st) != 0)
+        {
+            fprintf(stderr, "No channel segment, the harness must be started by the host\n");
+            exit(1);
+        }
+
+        this->channel_size = st.st_size;
+        this->channel = (uint64_t*)mmap(NULL, this->channel_size, PROT_WRITE | PROT_READ, MAP_SHARED, channel_fd, 0);
+        if (this->channel == MAP_FAILED)
         {
             perror("mmap failed");
             exit(1);
         }
 
-        *(this->sig) = WAIT;    // Initial signal
+        // The signal page leads, the host publishes the other region offsets in it
+        this->sig = this->channel;
+        this->in = this->channel + this->sig[SIG_IN_OFFSET] / sizeof(uint64_t);
+        this->out = this->channel + this->sig[SIG_OUT_OFFSET] / sizeof(uint64_t);
+        this->vec = this->channel + this->sig[SIG_VEC_OFFSET] / sizeof(uint64_t);
         this->main_time = 0;
+        this->tracing = true;
+        this->host = getppid();
+    }
+
+    virtual ~Simulator()
+    {
+        munmap(this->channel, this->channel_size);
+        close(channel_fd);
     }
 
     virtual void input_value(uint64_t *in)
     {
+        /* in: [value, signum] or [0, signum, value words] for wide signals */
         int signal_num = (int)in[1];
         T obj = this->sim_datas.inputs[signal_num];
-        obj->poke(in[0]);
+        if (obj->words() == 1)
+            obj->poke(in[0]);
+        else
+            obj->poke_words(in + 2);
     }
 
     virtual void output_value(uint64_t *out)
     {
+        /* out: [value, signum] or [0, signum, value words] for wide signals */
         int signal_num = (int)out[1];
         T obj = this->sim_datas.outputs[signal_num];
-        uint64_t wdata = obj->peek();
-        out[0] = wdata;
+        if (obj->words() == 1)
+            out[0] = obj->peek();
+        else
+            obj->peek_words(out + 2);
+    }
+
+    virtual void cycle(uint64_t *in, uint64_t *out)
+    {
+        /* Batched transaction frame
+         * in:  [n, npoke, nsample, (signum, value words) * npoke, signum * nsample]
+         * out: [value words * nsample]
+         */
+        uint64_t n = in[0];
+        uint64_t npoke = in[1];
+        uint64_t nsample = in[2];
+        uint64_t *p = in + 3;
+
+        for (uint64_t i = 0; i < npoke; i++)
+        {
+            T obj = this->sim_datas.inputs[(int)p[0]];
+            obj->poke_words(p + 1);
+            p += 1 + obj->words();
+        }
+
+        for (uint64_t i = 0; i < n; i++)
+            step();
+
+        sample_outputs(p, nsample, out);
+    }
+
+    void sample_outputs(uint64_t *signums, uint64_t nsample, uint64_t *out)
+    {
+        /* Pack the value words of the sampled outputs one after another */
+        for (uint64_t i = 0; i < nsample; i++)
+        {
+            T obj = this->sim_datas.outputs[(int)signums[i]];
+            obj->peek_words(out);
+            out += obj->words();
+        }
+    }
+
+    virtual void snapshot(uint64_t *out)
+    {
+        /* out: value words of every output, in signal number order */
+        for (size_t i = 0; i < this->sim_datas.outputs.size(); i++)
+        {
+            T obj = this->sim_datas.outputs[i];
+            obj->peek_words(out);
+            out += obj->words();
+        }
+    }
+
+    virtual void run_vectors(uint64_t *in, uint64_t *vec)
+    {
+        /* Stream one ring slot of stimulus vectors
+         * in:  [offset, ncycles, nin, nout, signum * nin, signum * nout]
+         * vec: inputs matrix (ncycles x input words) at offset, followed by
+         *      the outputs matrix (ncycles x output words)
+         */
+        uint64_t ncycles = in[1];
+        uint64_t nin = in[2];
+        uint64_t nout = in[3];
+        uint64_t *in_sigs = in + 4;
+        uint64_t *out_sigs = in_sigs + nin;
+        uint64_t in_words = 0, out_words = 0;
+
+        vector<T> inputs, outputs;
+        for (uint64_t i = 0; i < nin; i++)
+        {
+            inputs.push_back(this->sim_datas.inputs[(int)in_sigs[i]]);
+            in_words += inputs[i]->words();
+        }
+        for (uint64_t i = 0; i < nout; i++)
+        {
+            outputs.push_back(this->sim_datas.outputs[(int)out_sigs[i]]);
+            out_words += outputs[i]->words();
+        }
+
+        uint64_t *stimulus = vec + in[0];
+        uint64_t *samples = stimulus + ncycles * in_words;
+
+        for (uint64_t c = 0; c < ncycles; c++)
+        {
+            uint64_t *row = stimulus + c * in_words;
+            for (uint64_t i = 0; i < nin; i++)
+            {
+                inputs[i]->poke_words(row);
+                row += inputs[i]->words();
+            }
+            step();
+            row = samples + c * out_words;
+            for (uint64_t i = 0; i < nout; i++)
+            {
+                outputs[i]->peek_words(row);
+                row += outputs[i]->words();
+            }
+        }
+    }
+
+    virtual void run_until(uint64_t *in, uint64_t *out)
+    {
+        /* Step until an output reaches a value
+         * in:  [signum, value, max_cycles, nsample, signum * nsample]
+         * out: [cycles, matched, value * nsample]
+         */
+        T watched = this->sim_datas.outputs[(int)in[0]];
+        uint64_t value = in[1];
+        uint64_t max_cycles = in[2];
+        uint64_t nsample = in[3];
+        uint64_t *samples = in + 4;
+        uint64_t cycles = 0;
+
+        while (cycles < max_cycles && watched->peek() != value)
+        {
+            step();
+            cycles++;
+        }
+
+        out[0] = cycles;
+        out[1] = watched->peek() == value;
+        sample_outputs(samples, nsample, out + 2);
+    }
+
+    virtual void run_random(uint64_t *in, uint64_t *out)
+    {
+        /* Draw constrained random inputs every cycle and fold the outputs into a signature
+         * in:  [cycles, seed, nrand, nsig, distribution * nrand, signum * nsig]
+         *      distribution: [signum, DIST_RANGE, 2, lo, hi]
+         *                    [signum, DIST_CHOICE, n, value * n, cumulative weight * n]
+         * out: [cycles, failed, stopped, signature]
+         */
+        uint64_t max_cycles = in[0];
+        uint64_t state = in[1];
+        uint64_t nrand = in[2];
+        uint64_t nsig = in[3];
+        std::vector<uint64_t*> dists;
+        uint64_t *p = in + 4;
+        for (uint64_t i = 0; i < nrand; i++)
+        {
+            dists.push_back(p);
+            p += 3 + p[2] * (p[1] == DIST_CHOICE ? 2 : 1);
+        }
+        uint64_t *sig_sigs = p;
+
+        // Assertions end the run instead of the harness
+        bool fatal = Verilated::fatalOnError();
+        Verilated::fatalOnError(false);
+
+        // Wide signature ports are hashed word by word
+        int max_words = 1;
+        for (uint64_t i = 0; i < nsig; i++)
+            max_words = std::max(max_words, this->sim_datas.outputs[(int)sig_sigs[i]]->words());
+        std::vector<uint64_t> words(max_words);
+
+        uint64_t signature = 0xcbf29ce484222325ULL;
+        uint64_t cycles = 0;
+        bool stopped = false;
+        while (cycles < max_cycles && !stopped)
+        {
+            for (size_t i = 0; i < dists.size(); i++)
+            {
+                uint64_t *d = dists[i];
+                uint64_t value;
+                if (d[1] == DIST_RANGE)
+                    value = d[3] + random_below(state, d[4] - d[3] + 1);
+                else
+                {
+                    uint64_t n = d[2];
+                    uint64_t r = random_below(state, d[3 + 2 * n - 1]);
+                    uint64_t k = 0;
+                    while (d[3 + n + k] <= r)
+                        k++;
+                    value = d[3 + k];
+                }
+                this->sim_datas.inputs[(int)d[0]]->poke(value);
+            }
+
+            step();
+            cycles++;
+            // $finish and failed assertions both end the run
+            stopped = Verilated::gotFinish();
+
+            // FNV-1a over the signature outputs
+            for (uint64_t i = 0; i < nsig; i++)
+            {
+                T obj = this->sim_datas.outputs[(int)sig_sigs[i]];
+                if (obj->words() == 1)
+                    words[0] = obj->peek();
+                else
+                    obj->peek_words(words.data());
+                for (int w = 0; w < obj->words(); w++)
+                {
+                    signature ^= words[w];
+                    signature *= 0x100000001b3ULL;
+                }
+            }
+        }
+
+        // Only $stop and $fatal raise the error flag, a clean $finish does not
+#if VERILATOR_VERSION_INTEGER >= 4200000
+        bool failed = Verilated::gotError();
+        Verilated::gotError(false);
+#else
+        bool failed = stopped;
+#endif
+        Verilated::gotFinish(false);
+        Verilated::fatalOnError(fatal);
+        out[0] = cycles;
+        out[1] = failed;
+        out[2] = stopped;
+        out[3] = signature;
+    }
+
+    bool trace_active()
+    {
+        /* Dump only when tracing is on and the cycle is in the trace window */
+        uint64_t cycle = this->main_time / 2;
+        return this->tracing && cycle >= this->sig[SIG_TRACE_START] && cycle < this->sig[SIG_TRACE_STOP];
+    }
+
+    virtual void trace_on()
+    {
+        this->tracing = true;
+    }
+
+    virtual void trace_off()
+    {
+        this->tracing = false;
+    }
+
+    /* Model serialization, steps is the host cycle count kept with the state */
+    virtual bool save(const char *path, uint64_t *steps)
+    {
+        return false;
+    }
+
+    virtual bool restore(const char *path, uint64_t *steps)
+    {
+        return false;
+    }
+
+    void state_transaction(int signal, uint64_t *in, uint64_t *out)
+    {
+        /* in: [steps, path length, path bytes]
+         * out: [ok, steps]
+         */
+        uint64_t steps = in[0];
+        const char *path = (const char*)(in + 2);
+        bool ok = signal == SAVE ? save(path, &steps) : restore(path, &steps);
+        out[0] = ok;
+        out[1] = steps;
+    }
+
+    /* Bulk memory access, the harness overrides it with one case a memory */
+    virtual bool mem_access(int mem, bool write, uint64_t base, uint64_t count, uint64_t *data)
+    {
+        return false;
+    }
+
+    void mem_transaction(int signal, uint64_t *in, uint64_t *out)
+    {
+        /* in: [memory number, base address, count]
+         * vec: count values
+         * out: [ok]
+         */
+        out[0] = mem_access((int)in[0], signal == LOAD_MEM, in[1], in[2], this->vec);
     }
 
     virtual void step() = 0;
@@ -191,6 +667,45 @@ public:
         return is_exit;
     }
 
+    void wait_signal()
+    {
+        /* Wait until the host writes a signal other than WAIT */
+        uint64_t spins = 0;
+        struct timespec backoff = {0, 1000};
+
+        while (load_word(this->sig) == WAIT)
+        {
+            if (spins < SPIN_LIMIT)
+            {
+                spins++;
+                continue;
+            }
+
+            // Exit if the host died and the harness was orphaned
+            if (++spins % ALIVE_CHECK == 0 && getppid() != this->host)
+                exit(1);
+
+            switch (load_word(this->sig + SIG_WAIT_MODE))
+            {
+                case WAIT_FUTEX: futex_wait(this->sig, WAIT); break;
+                case WAIT_ADAPTIVE:
+                    nanosleep(&backoff, NULL);
+                    if (backoff.tv_nsec < 1000000)
+                        backoff.tv_nsec *= 2;
+                    break;
+                default: break;
+            }
+        }
+    }
+
+    void ack_signal()
+    {
+        /* Hand the channel back to the host */
+        store_word(this->sig, WAIT);
+        if (load_word(this->sig + SIG_WAIT_MODE) == WAIT_FUTEX)
+            futex_wake(this->sig);
+    }
+
     void tick()
     {
         /* Signal ticks, deal with every incomming signal */
@@ -198,9 +713,9 @@ public:
         // Waiting for signal
         while(1)
         {
-            while (*sig == WAIT);
+            wait_signal();
 
-            switch (*sig)
+            switch (load_word(this->sig))
             {
                 case DIN: input_value(this->in); break;
                 case DOUT: output_value(this->out); break;
@@ -208,6 +723,17 @@ public:
                 case RESET: reset(); break;
                 case TERM: finish(); break;
                 case START: start(); break;
+                case CYCLE: cycle(this->in, this->out); break;
+                case VECTOR: run_vectors(this->in, this->vec); break;
+                case TRACE_ON: trace_on(); break;
+                case TRACE_OFF: trace_off(); break;
+                case RUN_UNTIL: run_until(this->in, this->out); break;
+                case SNAPSHOT: snapshot(this->out); break;
+                case SAVE:
+                case RESTORE: state_transaction(load_word(this->sig), this->in, this->out); break;
+                case LOAD_MEM:
+                case DUMP_MEM: mem_transaction(load_word(this->sig), this->in, this->out); break;
+                case RANDOM: run_random(this->in, this->out); break;
                 default: break;
             }
 
@@ -215,7 +741,7 @@ public:
                 break;
 
             // Wait for next signal
-            *sig = WAIT;
+            ack_signal();
         }
     }
 };
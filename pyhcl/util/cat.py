@@ -3,11 +3,11 @@
 Filename: cat.py
 Author: SunnyChen
 """
-import sys
 
 from pyhcl.core import rawdata
+from pyhcl.core.context import current_context
 from pyhcl.core.define import Define
-from pyhcl.core.resources import HasInfo, InstanceId
+from pyhcl.core.resources import HasInfo, InstanceId, caller_frame
 from pyhcl.firrtl import ir
 
 
@@ -39,13 +39,13 @@ def Cat(*cat_list):
                                [prv_node, clist[cat_index + 1]._data._ir_exp], [])
 
             # Construct internal node
-            sourceinfo = HasInfo(sys._getframe(1))._sourceinfo
+            sourceinfo = HasInfo(caller_frame(1))._sourceinfo
             _id = InstanceId()
             node = ir.DefNode(sourceinfo, "_T_" + str(_id.id), _id, cat_op)
             inter_node_ref = ir.RefId(ir.Gender.male, node.node_exp.type, True, node)
 
             prv_node = inter_node_ref
-            rawdata.local_sytax_tree.append(node)
+            current_context().local_syntax_tree.append(node)
 
             if cat_index == clist_len - 2:
                 last_node = node
@@ -54,7 +54,7 @@ def Cat(*cat_list):
 
         # Create node reference
         node_ref = ir.RefId(ir.Gender.male, last_node.node_exp.type, True, last_node)
-        raw_data = rawdata.Bits(sys._getframe(1))
+        raw_data = rawdata.Bits(caller_frame(1))
         raw_data._ir_exp = node_ref
         def_node = Define(raw_data)
 
@@ -3,12 +3,12 @@
 Filename: listlookup.py
 Author: SunnyChen
 """
-import sys
 from typing import List
 from pyhcl.core.define import Define
-from pyhcl.core.resources import HasInfo, InstanceId
+from pyhcl.core.resources import HasInfo, InstanceId, caller_frame
 from pyhcl.util import utils_func
 from pyhcl.core import rawdata
+from pyhcl.core.context import current_context
 from pyhcl.firrtl import ir
 
 
@@ -28,7 +28,7 @@ def ListLookup(addr: Define, default: List, dictionary: dict) -> List:
     stack = []
     ret_list = []
     equal_map = {}
-    sourceinfo = HasInfo(sys._getframe(1))._sourceinfo
+    sourceinfo = HasInfo(caller_frame(1))._sourceinfo
 
     # Append all statements in the list
     # for i in default:
@@ -67,9 +67,9 @@ def ListLookup(addr: Define, default: List, dictionary: dict) -> List:
             mux_node = ir.DefNode(sourceinfo, "_T_" + str(_id.id), _id, mux_op)
             prv_node_ref = ir.RefId(ir.Gender.male, mux_node.node_exp.type, True, mux_node)
 
-            rawdata.local_sytax_tree.append(mux_node)
+            current_context().local_syntax_tree.append(mux_node)
 
-        raw_data = rawdata.Bits(sys._getframe(1))
+        raw_data = rawdata.Bits(caller_frame(1))
         raw_data._ir_exp = prv_node_ref
         def_node = Define(raw_data)
 
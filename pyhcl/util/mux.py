@@ -5,11 +5,11 @@ Include basic mux function and complex muxlookup function
 Filename: mux.py
 Author: SunnyChen
 """
-import sys
 
 from pyhcl.core import rawdata
+from pyhcl.core.context import current_context
 from pyhcl.core.define import Define
-from pyhcl.core.resources import HasInfo, InstanceId
+from pyhcl.core.resources import HasInfo, InstanceId, caller_frame
 from pyhcl.firrtl import ir
 from pyhcl.util import utils_func
 
@@ -24,17 +24,17 @@ def Mux(condition: Define, true_define: Define, false_define: Define):
                      true_define._data._ir_exp, false_define._data._ir_exp)
 
     # Construct internal node
-    sourceinfo = HasInfo(sys._getframe(1))._sourceinfo
+    sourceinfo = HasInfo(caller_frame(1))._sourceinfo
     _id = InstanceId()
     node = ir.DefNode(sourceinfo, "_T_" + str(_id.id), _id, mux_exp)
 
     # Create node reference
     node_ref = ir.RefId(ir.Gender.male, node.node_exp.type, True, node)
-    raw_data = rawdata.Bits(sys._getframe(1))
+    raw_data = rawdata.Bits(caller_frame(1))
     raw_data._ir_exp = node_ref
     def_node = Define(raw_data)
 
-    rawdata.local_sytax_tree.append(node)
+    current_context().local_syntax_tree.append(node)
 
     return def_node
 
@@ -48,7 +48,7 @@ def MuxLookUp(key: Define, default: Define, dictionary: dict):
         dictionary: Map the key value to the case value
     """
     stack = []
-    sourceinfo = HasInfo(sys._getframe(1))._sourceinfo
+    sourceinfo = HasInfo(caller_frame(1))._sourceinfo
 
     # Append all statements
     # for k, v in dictionary.items():
@@ -81,10 +81,10 @@ def MuxLookUp(key: Define, default: Define, dictionary: dict):
         mux_node = ir.DefNode(sourceinfo, "_T_" + str(_id.id), _id, mux_op)
         prv_node_ref = ir.RefId(ir.Gender.male, mux_node.node_exp.type, True, mux_node)
 
-        rawdata.local_sytax_tree.append(mux_node)
+        current_context().local_syntax_tree.append(mux_node)
 
     # Return definition
-    raw_data = rawdata.Bits(sys._getframe(1))
+    raw_data = rawdata.Bits(caller_frame(1))
     raw_data._ir_exp = prv_node_ref
     def_node = Define(raw_data)
 
@@ -0,0 +1,86 @@
+"""Designs and helpers shared by the tests
+
+Filename: designs.py
+"""
+import shutil
+
+import pytest
+
+from pyhcl import *
+
+# The Verilator backend needs verilator, a C++ toolchain and the firrtl compiler
+needs_verilator = pytest.mark.skipif(shutil.which("verilator") is None or shutil.which("firrtl") is None,
+                                     reason="verilator and firrtl are required")
+
+
+class AccIO(Bundle):
+    def __init__(self):
+        super().__init__()
+        self.a = Input(UInt(8))
+        self.b = Input(UInt(8))
+        self.o = Output(UInt(8))
+        self.s = Output(UInt(8))
+
+
+class Top(Module):
+    """io.o = a + b, io.s accumulates a every cycle"""
+
+    def __init__(self):
+        super().__init__()
+        self.io = AccIO().IO()
+        self.r = RegInit(U(0, 8))
+        self.r @= self.r + self.io.a
+        self.io.s @= self.r
+        self.io.o @= self.io.a + self.io.b
+
+
+class WideIO(Bundle):
+    def __init__(self):
+        super().__init__()
+        self.a = Input(UInt(100))
+        self.o = Output(UInt(100))
+        self.n = Output(UInt(8))
+
+
+class Wide(Module):
+    def __init__(self):
+        super().__init__()
+        self.io = WideIO().IO()
+        self.io.o @= self.io.a + U(1)
+        self.io.n @= self.io.a[7:0]
+
+
+class SubIO(Bundle):
+    def __init__(self):
+        super().__init__()
+        self.a = Input(UInt(2))
+        self.o = Output(UInt(32))
+
+
+class Sub(Module):
+    def __init__(self):
+        super().__init__()
+        self.io = SubIO().IO()
+        self.mem = Mem(4, UInt(32))
+        self.io.o @= self.mem[self.io.a]
+
+
+class MemIO(Bundle):
+    def __init__(self):
+        super().__init__()
+        self.addr = Input(UInt(4))
+        self.o = Output(UInt(8))
+        self.so = Output(UInt(32))
+
+
+class MemTop(Module):
+    """Reads a memory of its own and one of a submodule"""
+
+    def __init__(self):
+        super().__init__()
+        self.io = MemIO().IO()
+        self.mem = Mem(16, UInt(8))
+        self.sub = Sub().gen()
+        self.sub.io.a @= self.io.addr
+        self.io.so @= self.sub.io.o
+        self.io.o @= self.mem[self.io.addr]
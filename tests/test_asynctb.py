@@ -0,0 +1,155 @@
+"""Tests of the asyncio testbench
+
+Filename: test_asynctb.py
+"""
+import asyncio
+
+import pytest
+
+from pyhcl.simulator.asynctb import AsyncTestbench
+from pyhcl.simulator.pysim import PySimulator
+from tests.designs import Top
+
+
+class CountingSimulator(PySimulator):
+    """Records the n of every cycle() transaction"""
+
+    def __init__(self, module):
+        super().__init__(module)
+        self.transactions = []
+
+    def cycle(self, inputs=None, sample=None, n=1):
+        self.transactions.append(n)
+        return super().cycle(inputs, sample, n)
+
+
+@pytest.fixture
+def bench():
+    m = Top().gen()
+    sim = CountingSimulator(m)
+    sim.reset()
+    sim.start()
+    return m, sim, AsyncTestbench(sim)
+
+
+def test_driver_and_monitor(bench):
+    m, sim, tb = bench
+
+    async def driver():
+        for value in range(1, 6):
+            tb.drive(m.io.a, value)
+            await tb.clock()
+        tb.drive(m.io.a, 0)
+        await tb.clock()
+
+    async def main():
+        tb.fork(driver())
+        waited = await tb.wait_for(m.io.s, 10)
+        assert tb.peek(m.io.s) == 10
+        return waited
+
+    assert tb.run(main()) == 4
+    assert sim.peek(m.io.s) == 10
+
+
+def test_idle_clocks_are_batched(bench):
+    m, sim, tb = bench
+
+    async def main():
+        tb.drive(m.io.a, 2)
+        await tb.clock()
+        await tb.clock(10)
+        return tb.peek(m.io.s)
+
+    assert tb.run(main()) == 22
+    assert sim.transactions == [1, 10]
+    assert tb.cycles == 11
+
+
+def test_wait_for_timeout(bench):
+    m, sim, tb = bench
+
+    async def main():
+        tb.drive(m.io.a, 2)
+        await tb.wait_for(m.io.s, 7, max_cycles=20)
+
+    with pytest.raises(TimeoutError):
+        tb.run(main())
+    assert tb.cycles == 20
+
+
+def test_process_failure_stops_run(bench):
+    m, sim, tb = bench
+
+    async def checker():
+        await tb.clock(3)
+        raise AssertionError("checker failed")
+
+    async def main():
+        tb.fork(checker())
+        await tb.clock(100)
+
+    with pytest.raises(AssertionError, match="checker failed"):
+        tb.run(main())
+    assert tb.cycles == 3
+    # The testbench can run again after a failure
+    assert tb.run(tb.clock(2)) is None
+    assert tb.cycles == 5
+
+
+def test_main_awaits_forked_process(bench):
+    m, sim, tb = bench
+
+    async def driver():
+        for value in (1, 2, 3):
+            tb.drive(m.io.a, value)
+            await tb.clock()
+        tb.drive(m.io.a, 0)
+        await tb.clock()
+        return tb.peek(m.io.s)
+
+    async def main():
+        return await tb.fork(driver())
+
+    assert tb.run(main()) == 6
+
+
+def test_monitor_feeds_scoreboard_through_queue(bench):
+    m, sim, tb = bench
+    expected = []
+
+    async def driver():
+        for value in (4, 5, 6, 7):
+            tb.drive(m.io.a, value)
+            tb.drive(m.io.b, value)
+            expected.append(2 * value)
+            await tb.clock()
+
+    async def monitor(queue):
+        await tb.clock()
+        for _ in range(4):
+            await queue.put(tb.peek(m.io.o))
+            await tb.clock()
+
+    async def scoreboard(queue):
+        return [await queue.get() for _ in range(4)]
+
+    async def main():
+        queue = asyncio.Queue()
+        tb.fork(driver())
+        tb.fork(monitor(queue))
+        results = await asyncio.gather(tb.fork(scoreboard(queue)), tb.clock(2))
+        return results[0]
+
+    assert tb.run(main()) == expected == [8, 10, 12, 14]
+    assert tb.cycles == 4
+
+
+def test_deadlock_raises(bench):
+    m, sim, tb = bench
+
+    async def main():
+        await asyncio.Event().wait()
+
+    with pytest.raises(RuntimeError):
+        tb.run(main())
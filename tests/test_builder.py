@@ -0,0 +1,49 @@
+"""Tests of the builder
+
+Filename: test_builder.py
+"""
+import functools
+import pickle
+
+import pytest
+
+from pyhcl import builder, elaborate_many, load_circuit
+from pyhcl.core.context import ElaborationContext
+from tests.designs import MemTop, Top
+
+
+def generate(cls):
+    return cls().gen()
+
+
+def reference(cls, mode="full"):
+    with ElaborationContext(sourceinfo_mode=mode):
+        return builder.elaborate(cls().gen()).emit()
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_elaborate_many(workers):
+    factories = [functools.partial(generate, cls) for cls in (Top, MemTop, Top)]
+    results = elaborate_many(factories, workers=workers)
+    assert results == [reference(Top), reference(MemTop), reference(Top)]
+    # Identical results are one object
+    assert results[0] is results[2]
+
+
+@pytest.mark.parametrize("mode", ["full", "lazy", "sampled", "off"])
+def test_elaborate_many_circuits(monkeypatch, mode):
+    monkeypatch.setenv("PYHCL_SOURCEINFO", mode)
+    factories = [functools.partial(generate, cls) for cls in (Top, MemTop)]
+    circuits = elaborate_many(factories, workers=2, output="circuit")
+    assert [load_circuit(c).emit() for c in circuits] == [reference(Top, mode), reference(MemTop, mode)]
+
+
+def test_lazy_sourceinfo_pickles_resolved():
+    with ElaborationContext(sourceinfo_mode="lazy"):
+        circuit = builder.elaborate(Top().gen())
+        assert pickle.loads(pickle.dumps(circuit)).emit() == circuit.emit()
+
+
+def test_elaborate_many_unknown_output():
+    with pytest.raises(ValueError):
+        elaborate_many([functools.partial(generate, Top)], output="json")
@@ -0,0 +1,81 @@
+"""Tests of the elaboration context
+
+Filename: test_context.py
+"""
+import threading
+
+from pyhcl import builder
+from pyhcl.core.context import ElaborationContext, current_context, reset_context
+from tests.designs import MemTop, Top
+
+
+def emit(cls):
+    return builder.elaborate(cls().gen()).emit()
+
+
+def test_contexts_nest():
+    outer = current_context()
+    with ElaborationContext(sourceinfo_mode="off") as first:
+        assert current_context() is first
+        with ElaborationContext() as second:
+            assert current_context() is second
+        assert current_context() is first
+    assert current_context() is outer
+
+
+def test_fresh_context_is_deterministic():
+    # Elaborate once in the default context, the ids move on
+    emit(Top)
+    with ElaborationContext():
+        first = emit(MemTop)
+    with ElaborationContext():
+        assert emit(MemTop) == first
+
+
+def test_reset_context():
+    with ElaborationContext(sourceinfo_mode="off") as context:
+        first = emit(Top)
+        MemTop().gen()
+        assert context.global_id > 0 and len(context.modules_list) > 0
+        reset_context()
+        # The state is dropped, the settings are kept
+        assert (context.global_id, context.module_defs, context.sourceinfo_mode) == (0, {}, "off")
+        assert emit(Top) == first
+
+
+def test_elaborations_do_not_leak():
+    first = builder.elaborate(MemTop().gen())
+    second = builder.elaborate(Top().gen())
+    assert [m.name for m in first.modules] == ["Sub", "MemTop"]
+    assert [m.name for m in second.modules] == ["Top"]
+    context = current_context()
+    assert (context.modules_list, context.module_defs, context.module_cache, context.when_list) == ([], {}, {}, [])
+    # A later design names its definitions afresh
+    assert [m.name for m in builder.elaborate(MemTop().gen()).modules] == ["Sub", "MemTop"]
+
+
+def test_threads_elaborate_in_isolation():
+    with ElaborationContext():
+        expected = [emit(Top), emit(MemTop)]
+    results = {}
+    barrier = threading.Barrier(4)
+
+    def work(index):
+        barrier.wait()
+        with ElaborationContext():
+            results[index] = [emit(Top), emit(MemTop)]
+
+    threads = [threading.Thread(target=work, args=(i,)) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert [results[i] for i in range(4)] == [expected] * 4
+
+
+def test_threads_have_own_default_context():
+    contexts = []
+    thread = threading.Thread(target=lambda: contexts.append(current_context()))
+    thread.start()
+    thread.join()
+    assert contexts[0] is not current_context()
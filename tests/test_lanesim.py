@@ -0,0 +1,76 @@
+"""Tests of the NumPy lane simulator backend
+
+Filename: test_lanesim.py
+"""
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from pyhcl import *
+from pyhcl.exceptions import PyHCLException
+from pyhcl.simulator.lanesim import LaneSimulator
+from tests.designs import MemTop, Top
+
+
+class ArithIO(Bundle):
+    def __init__(self):
+        super().__init__()
+        self.a = Input(UInt(4))
+        self.b = Input(UInt(4))
+        self.sum = Output(UInt(5))
+        self.quo = Output(UInt(4))
+        self.rem = Output(UInt(4))
+        self.lt = Output(Bool())
+
+
+class Arith(Module):
+    def __init__(self):
+        super().__init__()
+        self.io = ArithIO().IO()
+        self.io.sum @= self.io.a + self.io.b
+        self.io.quo @= self.io.a / self.io.b
+        self.io.rem @= self.io.a % self.io.b
+        self.io.lt @= self.io.a < self.io.b
+
+
+def test_exhaustive_sweep():
+    m = Arith().gen()
+    sim = LaneSimulator(m, lanes=256)
+    poked = sim.poke_all([m.io.a, m.io.b])
+    a, b = (poked[m.io.a].astype(int), poked[m.io.b].astype(int))
+    assert len({(x, y) for x, y in zip(a, b)}) == 256
+    assert (sim.peek(m.io.sum) == a + b).all()
+    assert (sim.peek(m.io.lt) == (a < b)).all()
+    nonzero = b != 0
+    assert (sim.peek(m.io.quo)[nonzero] == a[nonzero] // b[nonzero]).all()
+    assert (sim.peek(m.io.rem)[nonzero] == a[nonzero] % b[nonzero]).all()
+
+
+def test_lanes_are_independent():
+    m = Top().gen()
+    sim = LaneSimulator(m, lanes=8)
+    sim.reset()
+    sim.start()
+    sim.poke(m.io.a, np.arange(8))
+    sim.poke(m.io.b, 1)
+    sim.step(3)
+    assert sim.peek(m.io.o).tolist() == list(range(1, 9))
+    assert sim.peek(m.io.s).tolist() == [3 * x for x in range(8)]
+
+
+def test_memories_per_lane(tmp_path):
+    m = MemTop().gen()
+    sim = LaneSimulator(m, lanes=4)
+    assert sim.mem_info(m.mem)[1:] == (16, 8)
+    sim.load_mem(m.mem, [[lane * 16 + i for lane in range(4)] for i in range(16)])
+    sim.poke(m.io.addr, [0, 5, 10, 15])
+    assert sim.peek(m.io.o).tolist() == [0, 21, 42, 63]
+    path = str(tmp_path / "mem.hex")
+    assert sim.dump_mem(m.mem, path, base=2, count=2).tolist() == [[2, 18, 34, 50], [3, 19, 35, 51]]
+    assert open(path).read() == "@2\n02\n03\n"
+
+
+def test_poke_output_rejected():
+    sim = LaneSimulator(Top().gen(), lanes=2)
+    with pytest.raises(PyHCLException):
+        sim.poke("io_o", 1)
@@ -0,0 +1,24 @@
+"""Tests of the memory image helpers
+
+Filename: test_memimage.py
+"""
+from pyhcl.simulator.memimage import find_mems, read_hex, write_hex
+from tests.designs import MemTop
+
+
+def test_find_mems():
+    m = MemTop().gen()
+    assert find_mems(m) == {m.mem: ["mem"], m.sub.mem: ["sub", "mem"]}
+
+
+def test_hex_round_trip(tmp_path):
+    path = str(tmp_path / "image.hex")
+    write_hex(path, [1, 0x2a, 0xfff], 12, base=4)
+    assert open(path).read() == "@4\n001\n02a\nfff\n"
+    assert read_hex(path) == [(4, [1, 0x2a, 0xfff])]
+
+
+def test_read_hex_blocks(tmp_path):
+    path = tmp_path / "image.hex"
+    path.write_text("// image\n01 02\n@8\nff 1_0 // tail\n")
+    assert read_hex(str(path)) == [(0, [1, 2]), (8, [0xff, 0x10])]
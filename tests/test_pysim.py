@@ -0,0 +1,101 @@
+"""Tests of the pure-Python simulator backend
+
+Filename: test_pysim.py
+"""
+import pytest
+
+from pyhcl import *
+from pyhcl.exceptions import PyHCLException
+from pyhcl.simulator.pysim import PySimulator
+from tests.designs import MemTop, Top, Wide
+
+
+class SelIO(Bundle):
+    def __init__(self):
+        super().__init__()
+        self.sel = Input(Bool())
+        self.a = Input(UInt(8))
+        self.b = Input(UInt(8))
+        self.o = Output(UInt(8))
+        self.m = Output(UInt(8))
+
+
+class Select(Module):
+    def __init__(self):
+        super().__init__()
+        self.io = SelIO().IO()
+        self.io.m @= Mux(self.io.sel, self.io.a, self.io.b)
+        with When(self.io.sel):
+            self.io.o @= self.io.a - self.io.b
+        with Otherwise():
+            self.io.o @= Cat(self.io.a[3:0], self.io.b[3:0])
+
+
+def test_combinational_and_registers():
+    sim = PySimulator(Top().gen())
+    sim.reset()
+    sim.start()
+    sim.poke("io_a", 3)
+    sim.poke("io_b", 4)
+    assert sim.peek("io_o") == 7
+    sim.step(2)
+    assert sim.peek("io_s") == 6
+    assert sim.step_count == 4
+
+
+def test_ports_by_object():
+    m = Top().gen()
+    sim = PySimulator(m)
+    sim.reset()
+    sim.start()
+    assert sim.cycle({m.io.a: 200, m.io.b: 100}, [m.io.o, m.io.s], n=2) == {m.io.o: 44, m.io.s: 144}
+
+
+def test_when_mux_cat():
+    m = Select().gen()
+    sim = PySimulator(m)
+    assert sim.cycle({m.io.sel: 1, m.io.a: 5, m.io.b: 7}, [m.io.o, m.io.m], n=0) == {m.io.o: 254, m.io.m: 5}
+    assert sim.cycle({m.io.sel: 0, m.io.a: 0x12, m.io.b: 0x34}, [m.io.o, m.io.m], n=0) == {m.io.o: 0x24, m.io.m: 0x34}
+
+
+def test_wide_ports():
+    m = Wide().gen()
+    sim = PySimulator(m)
+    sim.poke(m.io.a, (1 << 100) - 1)
+    assert sim.peek(m.io.o) == 0
+    sim.poke(m.io.a, (1 << 99) + 0x1ff)
+    assert sim.peek(m.io.o) == (1 << 99) + 0x200
+    assert sim.peek(m.io.n) == 0xff
+
+
+def test_memories(tmp_path):
+    m = MemTop().gen()
+    sim = PySimulator(m)
+    sim.load_mem(m.mem, list(range(100, 116)))
+    sim.load_mem(m.sub.mem, [7, 8, 9, 10])
+    sim.poke(m.io.addr, 9)
+    assert (sim.peek(m.io.o), sim.peek(m.io.so)) == (109, 8)
+    path = str(tmp_path / "mem.hex")
+    assert list(sim.dump_mem(m.mem, path, base=14)) == [114, 115]
+    assert open(path).read() == "@e\n72\n73\n"
+
+
+def test_save_restore():
+    sim = PySimulator(Top().gen())
+    sim.reset()
+    sim.start()
+    sim.poke("io_a", 3)
+    sim.step(4)
+    handle = sim.save_state()
+    sim.step(3)
+    assert sim.peek("io_s") == 21
+    sim.restore_state(handle)
+    assert (sim.peek("io_s"), sim.step_count) == (12, 6)
+
+
+def test_errors():
+    sim = PySimulator(Top().gen())
+    with pytest.raises(PyHCLException):
+        sim.peek("io_x")
+    with pytest.raises(PyHCLException):
+        sim.poke("io_o", 1)
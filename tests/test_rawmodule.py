@@ -0,0 +1,172 @@
+"""Tests of module generation
+
+Filename: test_rawmodule.py
+"""
+import gc
+import re
+import weakref
+
+import pytest
+
+from pyhcl import *
+from pyhcl import builder
+from pyhcl.core.context import ElaborationContext
+from pyhcl.simulator.pysim import PySimulator
+
+
+class OpIO(Bundle):
+    def __init__(self, width):
+        super().__init__()
+        self.a = Input(UInt(width))
+        self.b = Input(UInt(width))
+        self.o = Output(UInt(width))
+
+
+class Apply(Module):
+    """io.o = f(io.a, io.b)"""
+
+    def __init__(self, f, width=8):
+        super().__init__()
+        self.io = OpIO(width).IO()
+        self.io.o @= f(self.io.a, self.io.b)
+
+
+def add(a, b):
+    return a + b
+
+
+class Chain(Module):
+    """Instances of Apply, the adders are built from different call sites"""
+
+    def __init__(self):
+        super().__init__()
+        self.io = OpIO(8).IO()
+        self.u0 = Apply(add).gen()
+        self.u1 = Apply(lambda a, b: a + b).gen()
+        self.u2 = Apply(lambda a, b:
+                        a + b).gen()
+        self.u3 = Apply(lambda a, b: a ^ b).gen()
+        self.u4 = Apply(add, 16).gen()
+        for u in (self.u0, self.u1, self.u2, self.u3, self.u4):
+            u.io.b @= self.io.b
+        self.u0.io.a @= self.io.a
+        self.u1.io.a @= self.u0.io.o
+        self.u2.io.a @= self.u1.io.o
+        self.u3.io.a @= self.u2.io.o
+        self.u4.io.a @= self.u3.io.o
+        self.io.o @= self.u4.io.o[7:0]
+
+
+def definitions(code):
+    return re.findall(r"^  module (\w+)", code, re.M)
+
+
+def instances(code):
+    return dict(re.findall(r"inst (\w+) of (\w+)", code))
+
+
+@pytest.mark.parametrize("mode", ["full", "sampled", "lazy", "off"])
+def test_identical_submodules_share_a_definition(mode):
+    with ElaborationContext(sourceinfo_mode=mode, sourceinfo_rate=2):
+        code = builder.elaborate(Chain().gen()).emit()
+    assert definitions(code) == ["Apply", "Apply_1", "Apply_2", "Chain"]
+    assert instances(code) == {"u0": "Apply", "u1": "Apply", "u2": "Apply", "u3": "Apply_1", "u4": "Apply_2"}
+
+
+def test_shared_definitions_simulate():
+    with ElaborationContext():
+        sim = PySimulator(Chain().gen())
+    sim.poke("io_a", 5)
+    sim.poke("io_b", 3)
+    assert sim.peek("io_o") == ((5 + 3 + 3 + 3) ^ 3) + 3
+
+
+@cached_module
+class Table(Module):
+    """io.o = mem[io.a] + io.b, counts the elaborated bodies"""
+    bodies = 0
+
+    def __init__(self, width, size=4, tag=None):
+        super().__init__()
+        Table.bodies += 1
+        self.io = OpIO(width).IO()
+        self.mem = Mem(size, UInt(width))
+        self.io.o @= self.mem[self.io.a] + self.io.b
+
+
+class Tables(Module):
+    def __init__(self, *args):
+        super().__init__()
+        self.io = OpIO(8).IO()
+        for i, a in enumerate(args):
+            u = Table(*a).gen()
+            setattr(self, "u{}".format(i), u)
+            u.io.a @= self.io.a
+            u.io.b @= self.io.b
+        self.io.o @= self.u0.io.o[7:0] ^ self.u1.io.o[7:0]
+
+
+def units(top):
+    return [v for k, v in sorted(vars(top).items()) if re.fullmatch(r"u\d", k)]
+
+
+def test_cached_module_reuses_definitions():
+    Table.bodies = 0
+    with ElaborationContext():
+        top = Tables((8,), (8,), (8,), (16,), (8, 8)).gen()
+        code = builder.elaborate(top).emit()
+    assert Table.bodies == 3
+    assert [u.__dict__.get("_cached", False) for u in units(top)] == [False, True, True, False, False]
+    assert definitions(code) == ["Table", "Table_1", "Table_2", "Tables"]
+    assert list(instances(code).values()) == ["Table", "Table", "Table", "Table_1", "Table_2"]
+
+    # The cache lives in the context
+    with ElaborationContext():
+        Tables((8,), (8,)).gen()
+    assert Table.bodies == 4
+
+
+def test_cached_modules_belong_to_one_design():
+    Table.bodies = 0
+    top = Tables((8,), (8,)).gen()
+    prototype = weakref.ref(units(top)[0])
+    first = builder.elaborate(top)
+    del top
+    gc.collect()
+    assert prototype() is None
+
+    # The next design elaborates its own prototype and definition
+    top = Tables((8,), (8,)).gen()
+    second = builder.elaborate(top)
+    assert Table.bodies == 2
+    assert [m.name for m in second.modules] == ["Table", "Tables"]
+    assert second.modules[0] is not first.modules[0]
+
+
+def test_cached_clones_have_own_memories():
+    with ElaborationContext():
+        top = Tables((8,), (8,)).gen()
+        sim = PySimulator(top)
+    first, second = units(top)
+    assert first.mem is not second.mem
+    sim.load_mem(first.mem, [1, 2, 3, 4])
+    sim.load_mem(second.mem, [0x10, 0x20, 0x30, 0x40])
+    sim.poke("io_a", 2)
+    sim.poke("io_b", 1)
+    assert sim.peek("io_o") == (3 + 1) ^ (0x30 + 1)
+
+
+def test_cached_module_falls_back():
+    class Wider(Table):
+        pass
+
+    Table.bodies = 0
+    with ElaborationContext():
+        # Subclasses and unhashable arguments are not cached
+        Wider(8).gen()
+        Wider(8).gen()
+        Table(8, tag=[1]).gen()
+        Table(8, tag=[1]).gen()
+        Table(8, tag=(1,)).gen()
+        Table(8, tag=(1,)).gen()
+    assert Table.bodies == 5
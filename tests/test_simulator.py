@@ -0,0 +1,476 @@
+"""Tests of the Verilator simulator backend
+
+Filename: test_simulator.py
+"""
+import json
+import os
+import time
+
+import pytest
+
+from pyhcl.core.context import ElaborationContext
+from pyhcl.simulator import sim_src
+from pyhcl.simulator.sim_src import SimBuildConfig, Simulator, from_words, read_log
+from tests.designs import needs_verilator, MemTop, Top, Wide
+
+@pytest.fixture
+def simulator(tmp_path):
+    """Builds a Simulator of a fresh module, terminated after the test"""
+    sims = []
+
+    def build(module_cls=Top, **kwargs):
+        kwargs.setdefault("wait_mode", "futex")
+        # A fresh context numbers the nodes alike, the same design gives the same Verilog
+        with ElaborationContext():
+            module = module_cls().gen()
+            sim = Simulator(module, workdir=str(tmp_path / str(len(sims))), **kwargs)
+        sims.append(sim)
+        return module, sim
+
+    yield build
+    for sim in sims:
+        sim.term()
+
+
+def accumulate(m, sim):
+    sim.reset()
+    sim.start()
+    return sim.cycle({m.io.a: 3, m.io.b: 4}, [m.io.o, m.io.s], n=2)
+
+
+@needs_verilator
+def test_trace_off_builds_without_tracing(simulator):
+    m, sim = simulator(trace="off")
+    assert accumulate(m, sim) == {m.io.o: 7, m.io.s: 6}
+    assert not os.path.exists(sim.path("Top.vcd"))
+
+
+@needs_verilator
+def test_trace_full_dumps(simulator):
+    m, sim = simulator(trace="full")
+    accumulate(m, sim)
+    sim.trace_off()
+    # trace_off() does not wait for the harness, a peek does
+    sim.peek(m.io.s)
+    assert os.path.getsize(sim.path("Top.vcd")) > 0
+
+
+@needs_verilator
+def test_trace_window(simulator):
+    m, sim = simulator(trace=(1, 2))
+    accumulate(m, sim)
+    assert sim.cycle({m.io.a: 1}, [m.io.s], n=3) == {m.io.s: 9}
+
+
+@needs_verilator
+def test_save_restore(simulator, capfd):
+    m, sim = simulator(build=SimBuildConfig(savable=True))
+    accumulate(m, sim)
+    handle = sim.save_state()
+    steps = sim.step_count
+    assert sim.cycle({m.io.a: 1}, [m.io.s], n=5) == {m.io.s: 11}
+
+    sim.restore_state(handle)
+    assert sim.step_count == steps
+    assert sim.cycle({m.io.a: 2}, [m.io.s], n=1) == {m.io.s: 8}
+    sim.trace_off()
+    # The trace timestamp keeps increasing across the restore
+    assert "dump call ignored" not in capfd.readouterr().err
+
+    m2, sim2 = simulator(build=SimBuildConfig(savable=True), trace="off")
+    sim2.restore_state(handle)
+    assert sim2.cycle({m2.io.a: 0}, [m2.io.s], n=1) == {m2.io.s: 6}
+
+
+@needs_verilator
+def test_save_needs_savable_build(simulator):
+    m, sim = simulator(trace="off")
+    assert "--savable" not in SimBuildConfig().verilator_args()
+    with pytest.raises(RuntimeError):
+        sim.save_state()
+
+
+def test_state_access_source():
+    source = sim_src.state_access()
+    assert "{{" not in source and "}}" not in source
+    assert source.count("{") == source.count("}") == 2
+
+
+@needs_verilator
+def test_mem_design_builds_without_mem_access(simulator):
+    m, sim = simulator(MemTop, trace="off")
+    assert "--public-flat-rw" not in SimBuildConfig().verilator_args()
+    assert sim.cycle({m.io.addr: 1}, [m.io.o]) == {m.io.o: 0}
+    with pytest.raises(RuntimeError):
+        sim.load_mem(m.mem, [1, 2, 3])
+
+
+@needs_verilator
+def test_load_dump_mem(simulator, tmp_path):
+    m, sim = simulator(MemTop, trace="off", build=SimBuildConfig(mem_access=True))
+    sim.load_mem(m.mem, [3 * i + 250 for i in range(16)])
+    image = tmp_path / "image.hex"
+    image.write_text("// image\n01 02\n@4\nff 1_0\n")
+    sim.load_mem(m.mem, str(image), base=8)
+    sim.load_mem(m.sub.mem, [7, 8, 9, 0x1ffffffff])
+
+    assert list(sim.dump_mem(m.mem, base=8, count=6)) == [1, 2, 24, 27, 0xff, 0x10]
+    assert list(sim.dump_mem(m.sub.mem, base=1, count=3)) == [8, 9, 0xffffffff]
+    assert sim.cycle({m.io.addr: 9}, [m.io.o, m.io.so]) == {m.io.o: 2, m.io.so: 8}
+    with pytest.raises(ValueError):
+        sim.dump_mem(m.mem, base=10, count=10)
+
+
+@needs_verilator
+def test_multithreaded_model(simulator):
+    m, sim = simulator(trace="off", build=SimBuildConfig(threads=2))
+    assert accumulate(m, sim) == {m.io.o: 7, m.io.s: 6}
+
+
+def test_build_config_args():
+    build = SimBuildConfig(threads=4, optimize=3, x_assign="fast", output_split=2000, jobs=2, ccache=True)
+    assert build.verilator_args() == ["--threads", "4", "-O3", "--x-assign", "fast", "--x-initial", "fast",
+                                      "--output-split", "2000"]
+    assert build.make_args() == ["-j2", "OPT_FAST=-O3", "OBJCACHE=ccache"]
+    # Only the options which change the binary are part of the cache key
+    assert build.key() == SimBuildConfig(threads=4, optimize=3, x_assign="fast", output_split=2000).key()
+    assert build.key() != SimBuildConfig().key()
+
+
+@needs_verilator
+def test_cycle_transaction(simulator):
+    m, sim = simulator(trace="off")
+    sim.reset()
+    sim.start()
+    assert sim.cycle({m.io.a: 5, m.io.b: 6}, [m.io.o, m.io.s]) == {m.io.o: 11, m.io.s: 5}
+    assert sim.cycle(sample=[m.io.s], n=3) == {m.io.s: 20}
+    assert sim.cycle({m.io.a: 0}) == {}
+    assert (sim.peek(m.io.s), sim.step_count) == (20, 5)
+
+
+@needs_verilator
+@pytest.mark.parametrize("wait_mode", ["spin", "adaptive", "futex"])
+def test_wait_modes(simulator, wait_mode):
+    m, sim = simulator(trace="off", wait_mode=wait_mode)
+    assert accumulate(m, sim) == {m.io.o: 7, m.io.s: 6}
+    sim.poke(m.io.a, 1)
+    sim.step()
+    assert sim.peek(m.io.s) == 7
+
+
+def test_unknown_wait_mode():
+    with pytest.raises(ValueError):
+        Simulator(Top().gen(), wait_mode="poll")
+
+
+@needs_verilator
+def test_run_vectors(simulator):
+    np = pytest.importorskip("numpy")
+    m, sim = simulator(trace="off")
+    sim.reset()
+    sim.start()
+    # Long enough to wrap around both ring slots several times
+    a = np.random.default_rng(1).integers(0, 256, 20000, dtype=np.uint64)
+    b = np.arange(20000, dtype=np.uint64) % 256
+    samples = sim.run_vectors({m.io.a: a, m.io.b: b}, [m.io.o, m.io.s])
+    assert (samples[m.io.o] == (a + b) % 256).all()
+    assert (samples[m.io.s] == np.cumsum(a) % 256).all()
+    assert sim.step_count == 20000
+    assert sim.run_vectors({m.io.a: a[:0]}, [m.io.s])[m.io.s].shape == (0,)
+    with pytest.raises(ValueError):
+        sim.run_vectors({m.io.a: a, m.io.b: b[:10]}, [m.io.s])
+
+
+@needs_verilator
+def test_build_cache(simulator, tmp_path, monkeypatch):
+    cache = tmp_path / "cache"
+    monkeypatch.setattr(sim_src, "cache_root", str(cache))
+    m, sim = simulator(trace="off")
+    assert os.path.exists(sim.path("obj_dir", "VTop"))
+    assert len(os.listdir(str(cache))) == 1
+
+    # The same design reuses the cached binary without running verilator
+    m2, sim2 = simulator(trace="off")
+    assert not os.path.exists(sim2.path("obj_dir"))
+    assert accumulate(m2, sim2) == {m2.io.o: 7, m2.io.s: 6}
+
+    # Another harness or build configuration is another binary
+    simulator(trace="full")
+    simulator(trace="off", build=SimBuildConfig(threads=2))
+    assert len(os.listdir(str(cache))) == 3
+
+    _, sim5 = simulator(trace="off", cache=False)
+    assert os.path.exists(sim5.path("obj_dir", "VTop"))
+    assert len(os.listdir(str(cache))) == 3
+
+
+@needs_verilator
+def test_concurrent_simulators(simulator):
+    m1, sim1 = simulator(trace="off")
+    m2, sim2 = simulator(MemTop, trace="off")
+    m3, sim3 = simulator(trace="off")
+    # Signals are numbered per simulator
+    assert sim1.input_sig_map[m1.io.a] == sim2.input_sig_map[m2.io.addr] == 2
+    for sim in (sim1, sim3):
+        sim.reset()
+        sim.start()
+    for i in range(1, 4):
+        sim1.poke(m1.io.a, i)
+        sim3.poke(m3.io.a, 10 * i)
+        sim1.step()
+        sim3.step()
+        assert sim2.cycle({m2.io.addr: i}, [m2.io.o]) == {m2.io.o: 0}
+    assert (sim1.peek(m1.io.s), sim3.peek(m3.io.s)) == (6, 60)
+
+
+@needs_verilator
+def test_default_workdirs(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    sims = [Simulator(Top().gen(), trace="off") for _ in range(2)]
+    try:
+        assert sims[0].workdir != sims[1].workdir
+        for sim in sims:
+            assert os.path.dirname(sim.workdir) == str(tmp_path / "simulation")
+            assert os.path.exists(sim.path("Top.v"))
+    finally:
+        for sim in sims:
+            sim.term()
+
+
+@needs_verilator
+def test_multi_step_and_run_until(simulator):
+    m, sim = simulator(trace="off")
+    sim.reset()
+    sim.start()
+    sim.poke(m.io.a, 5)
+    sim.poke(m.io.b, 1)
+    sim.step(4)
+    assert (sim.peek(m.io.s), sim.step_count) == (20, 4)
+
+    assert sim.run_until(m.io.s, 35, max_cycles=10, sample=[m.io.s, m.io.o]) == (3, {m.io.s: 35, m.io.o: 6})
+    # The condition already holds, no cycle runs
+    assert sim.run_until(m.io.s, 35, max_cycles=10) == (0, {m.io.s: 35})
+    assert sim.step_count == 7
+
+    sim.poke(m.io.a, 2)
+    with pytest.raises(TimeoutError):
+        sim.run_until(m.io.s, 4, max_cycles=10)
+    assert (sim.peek(m.io.s), sim.step_count) == (55, 17)
+
+
+@needs_verilator
+def test_wide_ports(simulator):
+    np = pytest.importorskip("numpy")
+    m, sim = simulator(Wide, trace="off")
+    top = (1 << 100) - 1
+    sim.poke(m.io.a, (1 << 64) - 1)
+    sim.step()
+    assert sim.peek(m.io.o) == 1 << 64
+    assert sim.cycle({m.io.a: top}, [m.io.o, m.io.n]) == {m.io.o: 0, m.io.n: 0xff}
+
+    values = [1 << 99, (1 << 70) + 0x1ff, 0]
+    samples = sim.run_vectors({m.io.a: np.array(values, dtype=object)}, [m.io.o, m.io.n])
+    assert samples[m.io.o].shape == (3, 2)
+    assert [from_words(row) for row in samples[m.io.o]] == [(1 << 99) + 1, (1 << 70) + 0x200, 1]
+    assert samples[m.io.n].tolist() == [0, 0xff, 0]
+    with pytest.raises(ValueError):
+        sim.run_until(m.io.o, 0, max_cycles=1)
+
+
+@needs_verilator
+def test_dead_harness_raises(tmp_path):
+    m = Top().gen()
+    sim = Simulator(m, trace="off", workdir=str(tmp_path))
+    sim.process.kill()
+    sim.process.wait()
+    with pytest.raises(RuntimeError):
+        sim.peek(m.io.s)
+    os.close(sim.channel_fd)
+
+
+@needs_verilator
+def test_failed_build_raises(tmp_path, monkeypatch):
+    tools = tmp_path / "bin"
+    tools.mkdir()
+    verilator = tools / "verilator"
+    verilator.write_text("#!/bin/sh\nexit 1\n")
+    verilator.chmod(0o755)
+    monkeypatch.setenv("PATH", "{}{}{}".format(tools, os.pathsep, os.environ["PATH"]))
+    with pytest.raises(RuntimeError):
+        Simulator(Top().gen(), trace="off", cache=False, workdir=str(tmp_path / "sim"))
+
+
+@needs_verilator
+def test_channel_segment(simulator):
+    m, sim = simulator(trace="off")
+    # Only the build files, obj_dir is missing if the binary came from the cache
+    assert set(os.listdir(sim.workdir)) - {"obj_dir"} == {"Top-harness.cpp", "Top.fir", "Top.v", "simulator.h"}
+    assert os.fstat(sim.channel_fd).st_size == len(sim.mm_sig) + sim.in_size + sim.out_size + sim.vec_size
+    assert accumulate(m, sim) == {m.io.o: 7, m.io.s: 6}
+
+
+@pytest.mark.parametrize("memfd", [True, False])
+def test_create_segment(monkeypatch, memfd):
+    if not memfd:
+        monkeypatch.delattr(os, "memfd_create", raising=False)
+    elif not hasattr(os, "memfd_create"):
+        pytest.skip("memfd_create is not supported")
+    fd = sim_src.create_segment("pyhcl-test", 3 * 4096)
+    try:
+        assert os.fstat(fd).st_size == 3 * 4096
+        # Nothing is left on the file system
+        assert os.fstat(fd).st_nlink == 0
+    finally:
+        os.close(fd)
+
+
+@needs_verilator
+def test_snapshot(simulator):
+    pytest.importorskip("numpy")
+    m, sim = simulator(trace="off")
+    accumulate(m, sim)
+    outputs = sim.snapshot()
+    assert outputs.dtype.names == ("io_o", "io_s")
+    assert (int(outputs["io_o"]), int(outputs["io_s"])) == (7, 6)
+    assert sim.output_words.tolist() == [7, 6]
+    kept = outputs.copy()
+
+    # The view follows the channel, a copy keeps the values
+    sim.step()
+    assert int(sim.snapshot()["io_s"]) == 9
+    assert int(outputs["io_s"]) == 9
+    assert int(kept["io_s"]) == 6
+
+
+@needs_verilator
+def test_snapshot_wide(simulator):
+    pytest.importorskip("numpy")
+    m, sim = simulator(Wide, trace="off")
+    sim.cycle({m.io.a: (1 << 80) + 0x41})
+    outputs = sim.snapshot()
+    assert from_words(outputs["io_o"]) == (1 << 80) + 0x42
+    assert int(outputs["io_n"]) == 0x41
+
+
+@needs_verilator
+@pytest.mark.parametrize("log_format", ["jsonl", "binary"])
+def test_transaction_log(tmp_path, log_format):
+    m = Top().gen()
+    log = str(tmp_path / "log")
+    sim = Simulator(m, trace="off", workdir=str(tmp_path / "sim"), log=log, log_format=log_format)
+    try:
+        sim.reset()
+        sim.start()
+        sim.poke(m.io.a, 3)
+        sim.step(2)
+        assert sim.peek(m.io.s) == 6
+        assert sim.cycle({m.io.b: 1}, [m.io.o]) == {m.io.o: 4}
+    finally:
+        sim.term()
+
+    records = [("poke", "io_a", 3, 0), ("step", None, 2, 0), ("peek", "io_s", 6, 2),
+               ("poke", "io_b", 1, 2), ("step", None, 1, 2), ("peek", "io_o", 4, 3)]
+    if log_format == "binary":
+        assert list(read_log(log)) == records
+    else:
+        with open(log) as log_file:
+            lines = [json.loads(line) for line in log_file]
+        assert [(r["op"], r.get("port"), r.get("value", r.get("n")), r["cycle"]) for r in lines] == records
+        with pytest.raises(ValueError):
+            list(read_log(log))
+
+
+def test_unknown_log_format(tmp_path):
+    with pytest.raises(ValueError):
+        Simulator(Top().gen(), log=str(tmp_path / "log"), log_format="csv")
+
+
+@needs_verilator
+def test_run_random(simulator):
+    m, sim = simulator(trace="off")
+    sim.reset()
+    sim.start()
+    constraints = {m.io.a: (0, 255), m.io.b: {0: 3, 0xff: 1}}
+    ran, failed, stopped, signature = sim.run_random(constraints, 100, seed=7)
+    assert (ran, failed, stopped, sim.step_count) == (100, False, False, 100)
+    assert sim.run_random(constraints, 100, seed=8)[3] != signature
+
+    # Degenerate distributions pin the stimulus
+    sim.poke(m.io.a, 0)
+    sim.reset()
+    sim.start()
+    sim.run_random({m.io.a: (1, 1), m.io.b: [2]}, 10, signature=[m.io.s])
+    assert (sim.peek(m.io.s), sim.peek(m.io.o)) == (10, 3)
+
+
+@needs_verilator
+def test_run_random_reproducible(simulator):
+    signatures = []
+    for _ in range(2):
+        m, sim = simulator(trace="off")
+        sim.reset()
+        sim.start()
+        signatures.append(sim.run_random({m.io.a: (0, 255)}, 50, seed=3))
+    assert signatures[0] == signatures[1]
+
+
+@needs_verilator
+def test_run_random_hashes_wide_ports(simulator):
+    m, sim = simulator(Wide, trace="off")
+    signatures = []
+    # The inputs differ only above the low 64 bits of the outputs
+    for a in (1, 1 | (5 << 80)):
+        sim.poke(m.io.a, a)
+        signatures.append(sim.run_random({}, 4, signature=[m.io.o])[3])
+    assert signatures[0] != signatures[1]
+
+
+def test_encode_distribution():
+    assert sim_src.encode_distribution(2, (1, 5), 8) == [2, sim_src.DIST_RANGE, 2, 1, 5]
+    assert sim_src.encode_distribution(3, {4: 1, 0x1ff: 3}, 8) == [3, sim_src.DIST_CHOICE, 2, 4, 0xff, 1, 4]
+    assert sim_src.encode_distribution(3, [7, 9], 8) == [3, sim_src.DIST_CHOICE, 2, 7, 9, 1, 2]
+    with pytest.raises(ValueError):
+        sim_src.encode_distribution(2, (0, 256), 8)
+    with pytest.raises(ValueError):
+        sim_src.encode_distribution(2, {1: 0}, 8)
+
+
+@needs_verilator
+def test_stats(simulator, capsys):
+    m, sim = simulator(trace="off")
+    accumulate(m, sim)
+    sim.step(10)
+    sim.peek(m.io.s)
+    stats = sim.stats()
+    # reset, start and step are not waited on, only cycle and peek are round trips
+    assert (stats["cycles"], stats["round_trips"]) == (14, 2)
+    assert sum(stats["latency_histogram"].values()) == 2
+    assert stats["wall_time"] >= stats["harness_time"] > 0
+    assert stats["python_time"] == pytest.approx(stats["wall_time"] - stats["harness_time"])
+    sim.report()
+    assert capsys.readouterr().out.startswith("[Top] 14 cycles in ")
+
+
+@needs_verilator
+def test_latency_leaves_out_testbench_time(simulator):
+    m, sim = simulator(trace="off")
+    sim.reset()
+    sim.start()
+    sim.poke(m.io.a, 1)
+    # Testbench code between a fire-and-forget transaction and the next one
+    time.sleep(0.05)
+    sim.step()
+    time.sleep(0.05)
+    assert sim.peek(m.io.s) == 1
+    stats = sim.stats()
+    assert stats["round_trips"] == 1
+    assert stats["mean_latency"] < 0.05
+    assert stats["harness_time"] < 0.05
+
+
+@needs_verilator
+def test_report_interval(simulator, capsys):
+    m, sim = simulator(trace="off", report_interval=0)
+    accumulate(m, sim)
+    # A report after each of reset, start and cycle completed
+    assert capsys.readouterr().out.count("[Top] ") == 3
@@ -0,0 +1,57 @@
+"""Tests of the source info capture modes
+
+Filename: test_sourceinfo.py
+"""
+import re
+
+import pytest
+
+from pyhcl import builder
+from pyhcl.core import resources
+from pyhcl.core.context import ElaborationContext
+from tests import designs
+from tests.designs import Top
+
+
+def emit(mode, rate=64):
+    with ElaborationContext(sourceinfo_mode=mode, sourceinfo_rate=rate):
+        return builder.elaborate(Top().gen()).emit()
+
+
+def locations(code):
+    return re.findall(r"@\[([^\]]*)\]", code)
+
+
+def test_full_mode_records_construction_sites():
+    with open(designs.__file__) as source:
+        line = source.read().splitlines().index("        self.io.o @= self.io.a + self.io.b") + 1
+    assert "designs.py:{}".format(line) in locations(emit("full"))
+
+
+def test_lazy_mode_matches_full():
+    assert emit("lazy") == emit("full")
+
+
+def test_off_mode_does_not_inspect_frames(monkeypatch):
+    class NoFrames(object):
+        def _getframe(self, depth=0):
+            raise AssertionError("frame inspected with source info off")
+
+    monkeypatch.setattr(resources, "sys", NoFrames())
+    assert set(locations(emit("off"))) <= {"unknown"}
+
+
+def test_sampled_mode():
+    assert set(locations(emit("sampled", rate=1000))) <= {"unknown"}
+    assert locations(emit("sampled", rate=1)) == locations(emit("full"))
+
+
+def test_unknown_mode():
+    with ElaborationContext():
+        with pytest.raises(ValueError):
+            resources.set_sourceinfo_mode("verbose")
+
+
+def test_caches_are_bounded():
+    assert resources.short_filename.cache_info().maxsize is not None
+    assert resources.line_of.cache_info().maxsize is not None